@@ -84,6 +84,10 @@ class citation(object):
 	
 	"""
 	
+	__slots__ = ['cite_ref', 'text', 'type', 'search', 'entries']
+	_fields = tuple(__slots__)
+	_keys = frozenset(__slots__)
+	
 	def __init__(self, properties=None):
 		
 		self.cite_ref = None
@@ -95,37 +99,152 @@ class citation(object):
 		self.set(properties)
 	
 	def __getitem__(self, key):
-		return self.__dict__[key]
+		if key not in self._keys:
+			raise KeyError(key)
+		return getattr(self, key)
 	
 	def __setitem__(self, key, value):
-		if key not in self.__dict__.keys():
+		if key not in self._keys:
 			raise IndexError('No new key can be created in citation objects.')
-		self.__dict__[key] = value
+		object.__setattr__(self, key, value)
+	
+	def __eq__(self, other):
+		return isinstance(other, citation) and _values(self)==_values(other)
+	
+	def __ne__(self, other):
+		return not self.__eq__(other)
+	
+	def __hash__(self):
+		if type(self.cite_ref)==type(list()):
+			return hash((tuple(self.cite_ref), self.type))
+		return hash((self.cite_ref, self.type))
+	
+	def __getstate__(self):
+		return _values(self)
+	
+	def __setstate__(self, state):
+		_setValues(self, state)
 	
 	def __str__(self):
-		return self.__dict__.__str__()
+		return self.dict().__str__()
+	
+	def keys(self):
+		return list(self._fields)
+	
+	def has_key(self, key):
+		return key in self._keys
 	
 	def iteritems(self):
-		return self.__dict__.iteritems()
+		return iter(_items(self))
 	
 	def dict(self):
 		"""Returns a copy of the properties as a ``dict``."""
-		return dict(self.__dict__)
+		return dict(_items(self))
 	
 	def set(self, properties):
 		"""Sets the properties using a ``dict``."""
 		
-		keys = self.__dict__.keys()
-		
 		if properties is not None:
-			for k in keys:
+			for k in self._fields:
 				if properties.has_key(k):
 					object.__setattr__(self, k, properties[k])
 
+#-----------
+# Helpers for the classes with __slots__ and dict-like access
+
+def _values(x):
+	return [getattr(x, k) for k in x._fields]
+
+def _items(x):
+	return [(k, getattr(x, k)) for k in x._fields]
+
+def _setValues(x, values):
+	for k, v in zip(x._fields, values):
+		object.__setattr__(x, k, v)
+
 
 
 #============================================================================================
 
+import array
+import heapq
+import itertools
+import threading
+
+class frozenStyle(dict):
+	"""A style ``dict`` of :data:`styleTable`, that cannot be modified since it is shared by all the portions of
+	text using it. ``dict(style)`` gives a copy that can be modified. Its :attr:`index` in the table is kept, so
+	that the styles read from a :class:`text` are added to another one without looking them up."""
+	
+	__slots__ = ['index']
+	
+	def __init__(self, *args, **kwargs):
+		dict.__init__(self, *args, **kwargs)
+		self.index = None
+	
+	def _readOnly(self, *args, **kwargs):
+		raise TypeError('frozenStyle objects cannot be modified.')
+	
+	__setitem__ = __delitem__ = clear = update = pop = popitem = setdefault = _readOnly
+	
+	def __reduce__(self):
+		# Unpickled as a plain dict, since the indices of another process differ
+		return (dict, (dict(self),))
+
+# The styles of the bBase.text objects. Each distinct style is stored once, see styleId().
+styleTable = list()
+styleIds   = dict()
+styleLock  = threading.Lock()
+styleLast  = (None, 0) # The last style dict looked up by styleId(), and its index
+
+def styleId(style):
+	"""Returns the index of the ``dict`` *style* in :data:`styleTable`. A copy of the style is added to the
+	table the first time it is used. ``None`` is the empty style."""
+	
+	global styleLast
+	
+	if not style:
+		return 0
+	if type(style) is frozenStyle and style.index is not None:
+		return style.index
+	
+	# The same dict object, unchanged since the last call
+	last, i = styleLast
+	if style is last and style==styleTable[i]:
+		return i
+	
+	items = style.items()
+	if len(items)>1:
+		items.sort()
+	key = tuple(items)
+	try:
+		hash(key)
+	except TypeError:
+		key = repr(key)
+	
+	i = styleIds.get(key)
+	if i is None:
+		styleLock.acquire()
+		try:
+			i = styleIds.get(key)
+			if i is None:
+				i = len(styleTable)
+				x = frozenStyle(style)
+				x.index = i
+				styleTable.append(x)
+				styleIds[key] = i
+		finally:
+			styleLock.release()
+	
+	styleLast = (style, i)
+	
+	return i
+
+# The empty style is the first one
+styleTable.append(frozenStyle())
+styleTable[0].index = 0
+styleIds[()] = 0
+
 class text(object):
 	"""This class provides an abstraction for formatted text.
 	
@@ -169,99 +288,160 @@ class text(object):
 	  +--------------+----------------------------------------------------+
 	
 	The objects support iteration, ``[i]`` access and assignement, ``+`` addition, and ``*`` multiplication like Python ``list``\ s.
+	``+`` copies the text: to build a text from many portions, :meth:`append`, ``+=`` or a :class:`textBuilder` should be used.
+	
+	Internally, the strings and the styles are stored separately. Each distinct style is stored once in :data:`styleTable`,
+	and only its index is kept for each portion of text. The styles obtained by iteration or ``[i]`` access are thus shared,
+	read-only :class:`frozenStyle` objects. A ``None`` style is the empty style.
 	
 	Note: the format is somewhat not practical but is handy for text processor that does not allow formatting variations inside fields.
 	
+	.. attribute:: strings
+	   
+	   The ``list`` of the strings.
+	
+	.. attribute:: ids
+	   
+	   The indices of the styles in :data:`styleTable`, in an ``array``.
+	
 	.. attribute:: t
 	   
-	   Contains the ``list`` of tuples.
+	   The ``list`` of tuples. It is built at each access, so :meth:`append` or ``[i]`` should be preferred. Assigning it replaces the text.
 	
 	"""
 	
+	__slots__ = ['strings', 'ids']
+	
 	def __init__(self, txt='', style=None):
 		
 		LIST   = type(list())
 		TUPLE  = type(tuple())
-		STRING = type(str())
+		
+		self.strings = list()
+		self.ids     = array.array('i')
 		
 		if type(txt)==LIST and type(style)==LIST:
-			self.t = zip(txt, style)
-		elif type(txt)==LIST and type(style!=LIST):
+			self._set(zip(txt, style))
+		elif type(txt)==LIST:
 			if style is None:
-				if type(txt[0])==TUPLE:
-					self.t = txt
+				if len(txt)>0 and type(txt[0])==TUPLE:
+					self._set(txt)
 				else:
-					self.t = list()
 					for x in txt:
-						self.t.append( (x, dict()) )
+						self.append(x)
 			else:
 				raise TypeError("If a list of tuples is supplied, no second argument should be provided (%s given)." % str(style))
-		elif type(txt)==STRING:
-			if style is None:
-				self.t = [(txt, dict())]
-			elif type(style)==type(dict()):
-				self.t = [(txt, style)]
+		elif isinstance(txt, basestring):
+			if style is None or type(style)==type(dict()):
+				self.append(txt, style)
 			else:
 				raise TypeError("When 'txt' is simple text, 'style' should be None or a dict (%s given)." % str(style))
-		elif type(txt)==type(self):
-			self.t = list( txt.t )
+		elif isinstance(txt, text):
+			self.strings = list(txt.strings)
+			self.ids     = array.array('i', txt.ids)
+	
+	def _set(self, t):
+		for x, style in t:
+			self.strings.append(x)
+			self.ids.append(styleId(style))
+	
+	def _get_t(self):
+		return zip(self.strings, [styleTable[i] for i in self.ids])
+	
+	def _set_t(self, t):
+		self.strings = list()
+		self.ids     = array.array('i')
+		self._set(t)
+	
+	t = property(_get_t, _set_t)
+	
+	def __getstate__(self):
+		return self.t
+	
+	def __setstate__(self, t):
+		self.t = t
 	
 	def __str__(self):
-		return "".join([x[0] for x in self.t])
+		return "".join(self.strings)
 	
 	def __iter__(self):
-		return self.t.__iter__()
+		return itertools.izip(self.strings, [styleTable[i] for i in self.ids])
 	
 	def __len__(self):
-		return len(self.t)
+		return len(self.strings)
 	
 	def __getitem__(self, i):
-		return self.t[i]
+		if isinstance(i, slice):
+			return zip(self.strings[i], [styleTable[j] for j in self.ids[i]])
+		return (self.strings[i], styleTable[self.ids[i]])
 	
 	def __setitem__(self, i, v):
-		self.t[i] = v
+		if isinstance(i, slice):
+			self.strings[i] = [x[0] for x in v]
+			self.ids[i]     = array.array('i', [styleId(x[1]) for x in v])
+		else:
+			self.strings[i] = v[0]
+			self.ids[i]     = styleId(v[1])
 	
 	def __add__(self, t):
-		return text( list(self.t) + ( text(t).t ) )
+		r = text(self)
+		if isinstance(t, text):
+			r.extend(t)
+		else:
+			r.extend(text(t))
+		return r
+	
+	def __iadd__(self, t):
+		if isinstance(t, text):
+			self.extend(t)
+		else:
+			self.extend(text(t))
+		return self
 	
 	def __mul__(self, n):
-		return text( list(self.t) * int(n))
+		r = text()
+		r.strings = self.strings * int(n)
+		r.ids     = self.ids * int(n)
+		return r
 	
 	def append(self, txt, style=None, sep=''):
 		"""Adds a portion of text with its format at the end of the string.
 		
 		The ``sep`` argument can be used to add a separator to the previous chunk of text so that the style of the separator is the one of the previous bit of text."""
 		
-		if style is None:
-			style = dict()
-		if len(self.t)!=0:
-			self.t[-1] = (self.t[-1][0]+sep, self.t[-1][1])
+		if sep and len(self.strings)!=0:
+			self.strings[-1] += sep
 		
-		self.t.append((txt, style))
+		self.strings.append(txt)
+		if style:
+			self.ids.append(styleId(style))
+		else:
+			self.ids.append(0)
 	
 	def extend(self, t, sep=''):
 		"""Extends the text with a list of formatted text or a `bBase.text` object."""
 		
-		if len(self.t)!=0:
-			self.t[-1] = (self.t[-1][0]+sep, self.t[-1][1])
+		if sep and len(self.strings)!=0:
+			self.strings[-1] += sep
 		if isinstance(t, text):
-			self.t.extend(t.t)
+			self.strings.extend(t.strings)
+			self.ids.extend(t.ids)
 		else:
-			self.t.extend(t)
+			self._set(t)
 	
 	def reduce(self):
 		"""Concatenates all the consecutive portions of text that have the same format. Operates in place."""
-		if len(self.t)==0:
+		
+		ids = self.ids
+		if len(ids)==0:
 			return
 		
-		nt = [self.t[0]]
-		for i in range(1,len(self.t)):
-			if self.t[i][1] == nt[-1][1]:
-				nt[-1] = (nt[-1][0]+self.t[i][0], nt[-1][1])
-			else:
-				nt.append(self.t[i])
+		# The portions where the style changes
+		starts = [0] + [k for k in xrange(1, len(ids)) if ids[k]!=ids[k-1]]
+		ends   = starts[1:] + [len(ids)]
 		
-		self.t = nt
+		self.strings = ["".join(self.strings[i:j]) for i, j in itertools.izip(starts, ends)]
+		self.ids     = array.array('i', [ids[i] for i in starts])
 	
 	def strip(self, chars=None):
 		"""Applies the `strip()` method to the first and last items. See `Python string method <http://docs.python.org/library/stdtypes.html#str.strip>`_ for details.
@@ -274,13 +454,207 @@ class text(object):
 		"""Applies `lstrip()` to the first item. See `Python string method <http://docs.python.org/library/stdtypes.html#str.lstrip>`_ for details.
 		
 		Operates in place."""
-		self.t[0] = (self.t[0][0].lstrip(chars), self.t[0][1])
+		self.strings[0] = self.strings[0].lstrip(chars)
 	
 	def rstrip(self, chars=None):
 		"""Applies `rstrip()` to the last item. See `Python string method <http://docs.python.org/library/stdtypes.html#str.rstrip>`_ for details.
 		
 		Operates in place."""
-		self.t[-1] = (self.t[-1][0].rstrip(chars), self.t[-1][1])
+		self.strings[-1] = self.strings[-1].rstrip(chars)
+
+class textBuilder(object):
+	"""Builds a :class:`text` from many portions of text. Adding a portion only appends to a list, whatever the
+	length of the text already built, while ``+`` on :class:`text` objects copies the portions each time. The
+	portions are assembled by :meth:`build`::
+	
+	   b = bBase.textBuilder()
+	   b.append('Smith, J.', {'char_style': 'Author'})
+	   b.append(' (2005). ')
+	   b += bBase.text('Title', {'italics': True})
+	   t = b.build()
+	
+	.. attribute:: strings
+	   
+	   The ``list`` of the strings added.
+	
+	.. attribute:: ids
+	   
+	   The indices of their styles in :data:`styleTable`, in an ``array``.
+	"""
+	
+	__slots__ = ['strings', 'ids']
+	
+	def __init__(self):
+		self.strings = list()
+		self.ids     = array.array('i')
+	
+	def __len__(self):
+		return len(self.strings)
+	
+	def __str__(self):
+		return "".join(self.strings)
+	
+	def __iadd__(self, t):
+		self.extend(t)
+		return self
+	
+	def append(self, txt, style=None, sep=''):
+		"""Same as :meth:`text.append`. The separator is added as a portion with the style of the previous one."""
+		
+		if sep and len(self.strings)!=0:
+			self.strings.append(sep)
+			self.ids.append(self.ids[-1])
+		
+		self.strings.append(txt)
+		if style:
+			self.ids.append(styleId(style))
+		else:
+			self.ids.append(0)
+	
+	def extend(self, t, sep=''):
+		"""Same as :meth:`text.extend`. *t* can also be a string, or another :class:`textBuilder`."""
+		
+		if sep and len(self.strings)!=0:
+			self.strings.append(sep)
+			self.ids.append(self.ids[-1])
+		
+		if isinstance(t, (text, textBuilder)):
+			self.strings.extend(t.strings)
+			self.ids.extend(t.ids)
+		elif isinstance(t, basestring):
+			self.strings.append(t)
+			self.ids.append(0)
+		else:
+			for x, style in t:
+				self.strings.append(x)
+				self.ids.append(styleId(style))
+	
+	def build(self, reduce=True):
+		"""Returns the :class:`text`. If *reduce* is ``True``, the consecutive portions with the same style are
+		concatenated (see :meth:`text.reduce`). The builder can still be used afterwards."""
+		
+		r = text()
+		r.strings = list(self.strings)
+		r.ids     = array.array('i', self.ids)
+		if reduce:
+			r.reduce()
+		
+		return r
+
+#-----------
+def _deepSize(x, seen=None):
+	# Approximate memory used by x and the objects it refers to, for the tests
+	import sys
+	
+	if seen is None:
+		seen = set()
+	if id(x) in seen:
+		return 0
+	seen.add(id(x))
+	
+	s = sys.getsizeof(x)
+	if isinstance(x, dict):
+		s += sum([_deepSize(k, seen)+_deepSize(v, seen) for k, v in x.iteritems()])
+	elif isinstance(x, (list, tuple)):
+		s += sum([_deepSize(v, seen) for v in x])
+	elif hasattr(x, '__slots__'):
+		for c in type(x).__mro__:
+			s += sum([_deepSize(getattr(x, k), seen) for k in c.__dict__.get('__slots__', [])])
+	elif hasattr(x, '__dict__'):
+		s += _deepSize(x.__dict__, seen)
+	return s
+
+#-----------
+def test_text():
+	import time
+	
+	# A reference list of 500 entries, formatted with appends as a style would do
+	def fill(append):
+		authors = ['Smith, J.', 'Jones, A. B.', 'van Dijk, P.', 'Doe, J.', 'Roe, R.']
+		for i in range(500):
+			for j, a in enumerate(authors[:1+i%5]):
+				append(a, {'char_style': 'Author'}, ', ' if j else '')
+			append(' (%d). ' % (1950+i%60), {})
+			append('A title with a number %d' % i, {})
+			append('. ', {})
+			append('Journal of Things', {'italics': True})
+			append(', ', {})
+			append(str(i%40), {'bold': True})
+			append(', %d-%d.' % (i, i+10), {})
+			append('\n', {'para_style': 'Reference'})
+	
+	# The former representation: a list of tuples, with a dict for each portion of text
+	former = [('', dict())]
+	def append(txt, style, sep=''):
+		if len(former)!=0:
+			former[-1] = (former[-1][0]+sep, former[-1][1])
+		former.append((txt, style))
+	
+	t = time.time()
+	fill(append)
+	t_former = time.time()-t
+	
+	t = time.time()
+	reflist = text()
+	fill(reflist.append)
+	t_build = time.time()-t
+	
+	print "%d portions of text, %d styles" % (len(reflist), len(styleTable))
+	print "built in %.1f ms (list of tuples: %.1f ms)" % (t_build*1e3, t_former*1e3)
+	print "memory: %.0f kB (list of tuples: %.0f kB)" % (_deepSize(reflist)/1024., _deepSize(former)/1024.)
+	
+	t = time.time()
+	nt = [former[0]]
+	for i in range(1,len(former)):
+		if former[i][1] == nt[-1][1]:
+			nt[-1] = (nt[-1][0]+former[i][0], nt[-1][1])
+		else:
+			nt.append(former[i])
+	t_former = time.time()-t
+	
+	t = time.time()
+	reflist.reduce()
+	t_reduce = time.time()-t
+	
+	print "reduced to %d portions in %.1f ms (list of tuples: %.1f ms), same text: %s" % (len(reflist), t_reduce*1e3, t_former*1e3, reflist.t==nt)
+	
+	# An entry built with + is copied at each step
+	t = time.time()
+	x = text()
+	for i in range(2000):
+		x = x + text('Smith, J.', {'char_style': 'Author'})
+		x = x + text(' (2005). ')
+	t_add = time.time()-t
+	
+	t = time.time()
+	b = textBuilder()
+	for i in range(2000):
+		b.append('Smith, J.', {'char_style': 'Author'})
+		b += ' (2005). '
+	y = b.build(False)
+	t_builder = time.time()-t
+	
+	print "4000 additions: %.1f ms with +, %.1f ms with textBuilder, same text: %s" % (t_add*1e3, t_builder*1e3, x.t[1:]==y.t)
+	
+	x = text('The big ', {}) + [('bold', {'bold': True})] + text(' text.')
+	x[0] = ('The small ', {})
+	print str(x), x.t, x[1:], str(x*2)
+	
+	# None is the empty style, and the shared styles cannot be modified
+	x = text('A', None) + [('B', {'bold': True}), ('C', None)]
+	try:
+		x[1][1]['bold'] = False
+	except TypeError:
+		pass
+	import pickle
+	print list(x.ids), x[1][1], pickle.loads(pickle.dumps(x, 2)).t==x.t
+	
+	# A style dict modified between two appends
+	style = {'bold': True}
+	y = text('a', style)
+	style['bold'] = False
+	y.append('b', style)
+	print y[0][1], y[1][1], list(text(x.t).ids)==list(x.ids)
 
 #============================================================================================
 
@@ -301,6 +675,10 @@ class author(object):
 	
 	"""
 	
+	__slots__ = ['firstname', 'initials', 'surname', 'prefix']
+	_fields = tuple(__slots__)
+	_keys = frozenset(__slots__)
+	
 	def __init__(self, x=None):
 		
 		self.firstname = ''
@@ -309,14 +687,12 @@ class author(object):
 		self.prefix    = ''
 		
 		if x is not None:
-			if type(x)==type(str()):
+			if isinstance(x, basestring):
 				self.from_string(x)
 			elif type(x)==type(list()):
 				self.from_list(x)
-			elif type(x)==type(dict()):
+			elif type(x)==type(dict()) or isinstance(x, author):
 				self.from_dict(x)
-			elif type(x)==type(self):
-				self.from_dict(x.__dict__)
 			else:
 				raise TypeError('%s is not a valid type for author constructor.' % str(type(x)))
 	
@@ -325,32 +701,61 @@ class author(object):
 		self.from_list(x)
 	
 	def from_list(self, x):
-		self.firstname = x[0]
-		self.initials  = x[1]
-		self.surname   = x[2]
-		self.prefix    = x[3]
+		self.firstname = internName(x[0])
+		self.initials  = internName(x[1])
+		self.surname   = internName(x[2])
+		self.prefix    = internName(x[3])
 		
 		self._check_firstname()
 	
 	def from_dict(self, x):
-		keys = self.__dict__.keys()
-		
 		if x is not None:
-			for k in keys:
+			for k in self._fields:
 				if x.has_key(k):
 					object.__setattr__(self, k, x[k])
 		
 		self._check_firstname()
 	
 	def __getitem__(self, key):
-		return self.__dict__[key]
+		if key not in self._keys:
+			raise KeyError(key)
+		return getattr(self, key)
 	
 	def __setitem__(self, key, value):
-		if key not in self.__dict__.keys():
-			raise IndexError('No new key can be created in citation objects.')
-		self.__dict__[key] = value
+		if key not in self._keys:
+			raise IndexError('No new key can be created in author objects.')
+		object.__setattr__(self, key, value)
 		
-		self._check_firstname()
+		if key=='firstname' or key=='initials':
+			self._check_firstname()
+	
+	def __eq__(self, other):
+		return isinstance(other, author) and _values(self)==_values(other)
+	
+	def __ne__(self, other):
+		return not self.__eq__(other)
+	
+	def __hash__(self):
+		return hash(tuple(_values(self)))
+	
+	def keys(self):
+		return list(self._fields)
+	
+	def has_key(self, key):
+		return key in self._keys
+	
+	def iteritems(self):
+		return iter(_items(self))
+	
+	def dict(self):
+		"""Returns a copy of the name parts as a ``dict``."""
+		return dict(_items(self))
+	
+	def __getstate__(self):
+		return _values(self)
+	
+	def __setstate__(self, state):
+		_setValues(self, state)
 	
 	def _check_firstname(self):
 		if len(self.firstname.strip())==0:
@@ -370,11 +775,17 @@ class author(object):
 	def to_string(self):
 		"""Joins the fields to produce a text representation as stored in the database."""
 		return ' | '.join([self.firstname, self.initials, self.surname, self.prefix])
+	
+	def frozen(self):
+		"""Returns a copy of the author that cannot be modified (see :class:`frozenAuthor`)."""
+		a = author(self)
+		a.__class__ = frozenAuthor
+		return a
 
 #-----------
 def test_author():
 	a = author('firstname | initials | surname with spaces | prefix')
-	print a.__dict__
+	print a.dict()
 	print a
 
 #============================================================================================
@@ -389,16 +800,18 @@ class authorlist(object):
 	
 	"""
 	
+	__slots__ = ['_list']
+	
 	def __init__(self, x=None):
 		
 		self._list = list()
 		
 		if x is not None:
-			if type(x)==type(str()):
+			if isinstance(x, basestring):
 				self.from_string(x)
 			elif type(x)==type(list()):
 				self.from_list(x)
-			elif type(x)==type(self):
+			elif isinstance(x, authorlist):
 				self.from_list(x._list)
 			else:
 				raise TypeError('%s is not a valid type for authorlist constructor.' % str(type(x)))
@@ -410,7 +823,7 @@ class authorlist(object):
 		self._list = [author(y) for y in x]
 	
 	def __iter__(self):
-		self._list.__iter__()
+		return self._list.__iter__()
 	
 	def __getitem__(self, i):
 		return self._list[i]
@@ -421,23 +834,238 @@ class authorlist(object):
 	def __len__(self):
 		return len(self._list)
 	
+	def __eq__(self, other):
+		return isinstance(other, authorlist) and self._list==other._list
+	
+	def __ne__(self, other):
+		return not self.__eq__(other)
+	
 	def append(self, v):
 		self._list.append(author(v))
 	
 	def extend(self, v):
 		self._list.extend( authorlist(v)._list )
 	
+	def __getstate__(self):
+		# In a tuple, since an empty state would not be restored
+		return (self._list,)
+	
+	def __setstate__(self, state):
+		self._list, = state
+	
 	def __str__(self):
-		return ', '.join([str(x) for x in self.__list])
+		return ', '.join([str(x) for x in self._list])
 	
 	def to_string(self):
 		"""Produces a list of authors as stored in the database (using '#' delimiters)."""
-		return ' # '.join([x.to_string() for x in self.__list])
+		return ' # '.join([x.to_string() for x in self._list])
+	
+	def frozen(self):
+		"""Returns a copy of the list that cannot be modified (see :class:`frozenAuthorlist`)."""
+		l = authorlist()
+		l._list = [x.frozen() for x in self._list]
+		l.__class__ = frozenAuthorlist
+		return l
+
+class frozenAuthor(author):
+	"""An :class:`author` that cannot be modified, obtained with :meth:`author.frozen`. It can be shared, for
+	instance by the :class:`bBase.entry` objects using the same :data:`authorlistCache` item."""
+	
+	__slots__ = []
+	
+	def __setattr__(self, key, value):
+		raise TypeError('frozenAuthor objects cannot be modified.')
+	
+	def __setitem__(self, key, value):
+		raise TypeError('frozenAuthor objects cannot be modified.')
+	
+	def __reduce__(self):
+		# Copied and pickled as a plain author
+		return (author, (self.dict(),))
+	
+	def frozen(self):
+		return self
+
+class frozenAuthorlist(authorlist):
+	"""An :class:`authorlist` of :class:`frozenAuthor`\ s that cannot be modified, obtained with :meth:`authorlist.frozen`.
+	A modifiable copy is obtained with ``authorlist(x)``. The copies made with :mod:`copy` and :mod:`pickle` are plain
+	:class:`authorlist`\ s."""
+	
+	__slots__ = []
+	
+	def __setattr__(self, key, value):
+		raise TypeError('frozenAuthorlist objects cannot be modified.')
+	
+	def __setitem__(self, i, v):
+		raise TypeError('frozenAuthorlist objects cannot be modified.')
+	
+	def append(self, v):
+		raise TypeError('frozenAuthorlist objects cannot be modified.')
+	
+	def extend(self, v):
+		raise TypeError('frozenAuthorlist objects cannot be modified.')
+	
+	def __reduce__(self):
+		# Copied and pickled as a plain authorlist
+		return (authorlist, (list(self._list),))
+	
+	def frozen(self):
+		return self
+
+#-----------
+# The parts of the names of the authors read from strings are taken from this pool, see internName()
+namePool = dict()
+namePoolSize = 100000
+
+def internName(s):
+	"""Returns the string of :data:`namePool` equal to *s*, adding *s* to the pool if needed. The authors
+	parsed from strings thus share the strings of their names. The pool is emptied when it holds
+	:data:`namePoolSize` names, the names already in use being kept by their authors."""
+	
+	x = namePool.get(s)
+	if x is None:
+		if len(namePool)>=namePoolSize:
+			namePool.clear()
+		x = namePool.setdefault(s, s)
+	return x
+
+class authorCache(object):
+	"""Least recently used cache of the :class:`frozenAuthorlist` parsed from the author strings stored in the
+	database (see :meth:`authorlist.to_string`). The entries with the same authors share the same list.
+	
+	A hit only reads and writes a ``dict``, under :attr:`lock`. When the cache is full, the least recently used tenth is
+	dropped at once.
+	
+	.. attribute:: size
+	   
+	   The maximum number of lists kept.
+	
+	.. attribute:: hits
+	
+	.. attribute:: misses
+	
+	"""
+	
+	def __init__(self, size=10000):
+		self.size   = size
+		self.items  = dict()
+		self.used   = dict() # Value of clock at the last use of each item
+		self.clock  = 0
+		self.lock   = threading.Lock()
+		self.hits   = 0
+		self.misses = 0
+	
+	def get(self, s):
+		"""Returns the :class:`frozenAuthorlist` of the string *s*."""
+		
+		self.lock.acquire()
+		try:
+			self.clock += 1
+			x = self.items.get(s)
+			if x is not None:
+				self.used[s] = self.clock
+				self.hits += 1
+				return x
+			self.misses += 1
+		finally:
+			self.lock.release()
+		
+		# Parsed without holding the lock
+		y = authorlist(s).frozen()
+		
+		self.lock.acquire()
+		try:
+			# Another thread may have added the same list in the meantime
+			x = self.items.setdefault(s, y)
+			self.used[s]  = self.clock
+			if len(self.items)>self.size:
+				for k, t in heapq.nsmallest(len(self.items)-self.size+self.size//10, self.used.iteritems(), lambda y: y[1]):
+					self.items.pop(k, None)
+					self.used.pop(k, None)
+		finally:
+			self.lock.release()
+		
+		return x
+	
+	def clear(self):
+		self.lock.acquire()
+		try:
+			self.items.clear()
+			self.used.clear()
+		finally:
+			self.lock.release()
+	
+	def stats(self):
+		"""Returns a ``dict`` with the number of hits, misses and lists in the cache."""
+		return {'hits': self.hits, 'misses': self.misses, 'lists': len(self.items)}
+
+# The cache used by parseAuthors()
+authorlistCache = authorCache()
+
+def parseAuthors(x):
+	"""Returns an :class:`authorlist` from *x*. The lists parsed from strings are shared and frozen (see :data:`authorlistCache`),
+	other :class:`frozenAuthorlist` objects are returned as is, and anything else is copied into a new :class:`authorlist`."""
+	
+	if isinstance(x, basestring):
+		return authorlistCache.get(x)
+	if isinstance(x, frozenAuthorlist):
+		return x
+	return authorlist(x)
+
+#-----------
+def test_parseAuthors():
+	import time
+	
+	surnames = ['Smith', 'Jones', 'Dijk', 'Doe', 'Roe', 'Patterson', 'Moore', 'Baker']
+	strings = [" # ".join(["John | %s | %s | " % (chr(65+(i+j)%26), surnames[(i*7+j)%8]) for j in range(1+i%4)]) for i in range(1000)]
+	
+	t = time.time()
+	for i in range(20):
+		lists = [authorlist(x) for x in strings]
+	t_parse = time.time()-t
+	
+	authorlistCache.clear()
+	t = time.time()
+	for i in range(20):
+		shared = [parseAuthors(x) for x in strings]
+	t_cache = time.time()-t
+	
+	print "20 loads of 1000 author strings: %.1f ms parsed, %.1f ms with the cache %s" % (t_parse*1e3, t_cache*1e3, authorlistCache.stats())
+	print "same authors: %s, shared: %s, shared surnames: %s" % (lists==shared, parseAuthors(strings[0]) is shared[0], shared[0][0].surname is shared[8][0].surname)
+	
+	try:
+		shared[0].append('Jane | | Doe | ')
+	except TypeError, e:
+		print e
+	a = authorlist(shared[0])
+	a.append('Jane | | Doe | ')
+	print len(a), len(shared[0])
 
 #============================================================================================
 
 import unicodedata
 
+def citeRefSuffix(n):
+	"""Returns the suffix number *n* of a cite_ref: ``''`` for 0, 'a' to 'z' for 1 to 26, then 'aa', 'ab', ..., 'zz', 'aaa'...
+	(like the columns of a spreadsheet). See :func:`citeRefIndex`."""
+	
+	s = ''
+	while n>0:
+		n, r = divmod(n-1, 26)
+		s = chr(97+r) + s
+	return s
+
+def citeRefIndex(s):
+	"""Returns the number of the cite_ref suffix *s*, or ``None`` if *s* is not made of lowercase letters.
+	Inverse of :func:`citeRefSuffix`."""
+	
+	n = 0
+	for c in s:
+		if c<'a' or c>'z':
+			return None
+		n = n*26 + ord(c)-96
+	return n
+
 class entry(object):
 	"""Represents an entry in the Bibendum database. Can be initialized with a ``dict`` or another :class:`entry` object.
 	
@@ -447,8 +1075,18 @@ class entry(object):
 	   
 	   The entry type is a string. The possible values are the `same as in BibTeX <http://en.wikipedia.org/wiki/BibTeX#Entry_Types>`_. 
 	
+	.. attribute:: author
+	   
+	   The :class:`authorlist`. The lists parsed from strings are shared :class:`frozenAuthorlist`\ s (see :func:`parseAuthors`):
+	   ``e['author']``, :meth:`dict` and :meth:`iteritems` first replace it by a modifiable copy (see :meth:`thaw`), while
+	   ``e.author`` gives the shared list, for reading.
+	
 	"""
 	
+	__slots__ = ['type', 'title', 'author', 'year', 'fields', 'cite_ref', 'id_entry']
+	_fields = tuple(__slots__)
+	_keys = frozenset(__slots__)
+	
 	def __init__(self, x=None):
 		
 		self.type   = None
@@ -467,50 +1105,151 @@ class entry(object):
 	def set(self, x):
 		"""Sets the properties using a ``dict`` or an :class:`entry` object."""
 		
-		keys = self.__dict__.keys()
-		
 		if x is not None:
-			for k in keys:
-				if x.has_key(k):
-					object.__setattr__(self, k, x[k])
+			if isinstance(x, entry):
+				# The attributes are read directly, so that a shared author list stays shared
+				for k in self._fields:
+					object.__setattr__(self, k, getattr(x, k))
+			else:
+				for k in self._fields:
+					if x.has_key(k):
+						object.__setattr__(self, k, x[k])
+		
+		self.author = parseAuthors(self.author)
+	
+	def thaw(self):
+		"""Replaces the author list by a modifiable copy if it is a shared :class:`frozenAuthorlist`."""
 		
-		self.author = authorlist(self.author)
+		if isinstance(self.author, frozenAuthorlist):
+			self.author = authorlist(self.author)
 	
 	def makeRef(self, ref=None):
 		"""Creates a ``cite_ref`` using the first author's name and the year. Adds a suffix if `ref` is not ``None``.
-		In that case `ref` must be a formatted cite_ref."""
+		In that case `ref` must be a formatted cite_ref, and the next suffix is returned ('a' after no suffix,
+		'aa' after 'z', see :func:`citeRefSuffix`)."""
 		
 		# Adapted from swBib_base.php
 		
 		citeRef = self.author[0]['prefix'].replace(" ", "") + self.author[0]['surname'].replace(" ", "")
 		
-		citeRef = unicodedata('NKFD', unicode(citeRef, 'utf-8')).encode('ascii', 'ignore').lower()
+		if type(citeRef)==type(str()):
+			citeRef = unicode(citeRef, 'utf-8')
+		citeRef = unicodedata.normalize('NFKD', citeRef).encode('ascii', 'ignore').lower() + ":" + str(self.year)
 		
-		if n is None:
-			return citeRef + ":" + str(self.year)
+		if ref is None:
+			return citeRef
+		
+		if ref.startswith(citeRef):
+			n = citeRefIndex(ref[len(citeRef):])
 		else:
-			suffix = "abcdefghijklmnopqrstuvwxyz"
-			n = suffix.find(ref[-1])
-			if n == -1:
-				n = 0
-			else:
-				n += 1
-			return citeRef + ":" + str(self.year) + suffix[n]
+			n = citeRefIndex(ref[-1:])
+		return citeRef + citeRefSuffix((n or 0)+1)
 	
 	def __getitem__(self, key):
-		return self.__dict__[key]
+		if key not in self._keys:
+			raise KeyError(key)
+		if key=='author':
+			self.thaw()
+		return getattr(self, key)
 	
 	def __setitem__(self, key, value):
-		if key not in self.__dict__.keys():
-			raise IndexError('No new key can be created in citation objects.')
-		self.__dict__[key] = value
+		if key not in self._keys:
+			raise IndexError('No new key can be created in entry objects.')
 		
-		self.author = authorlist(self.author)
+		if key=='author':
+			value = parseAuthors(value)
+		object.__setattr__(self, key, value)
+	
+	def __eq__(self, other):
+		return isinstance(other, entry) and _values(self)==_values(other)
+	
+	def __ne__(self, other):
+		return not self.__eq__(other)
+	
+	def __hash__(self):
+		return hash((self.id_entry, self.cite_ref))
+	
+	def __getstate__(self):
+		return _values(self)
+	
+	def __setstate__(self, state):
+		_setValues(self, state)
 	
 	def __str__(self):
-		return cite_ref
+		return str(self.cite_ref)
 	
+	def keys(self):
+		return list(self._fields)
+	
+	def has_key(self, key):
+		return key in self._keys
+	
+	def iteritems(self):
+		self.thaw()
+		return iter(_items(self))
+	
+	def dict(self):
+		"""Returns a copy of the properties as a ``dict``."""
+		self.thaw()
+		return dict(_items(self))
 
+#-----------
+def test_entry():
+	import time
+	
+	# The same entry is equal, and can be used as a dict key
+	e = entry({'type': 'article', 'title': 'A title', 'author': 'John | | Smith | # Anne | B | Jones | van', 'year': 2005, 'cite_ref': 'smith:2005', 'id_entry': 1})
+	f = entry(e)
+	print str(e), e==f, e['author']==f['author'], len(set([e, f])), e.has_key('year'), e.has_key('journal'), f.dict()['year']
+	
+	# A synthetic library of 100000 entries
+	surnames = ['Smith', 'Jones', 'Dijk', 'Doe', 'Roe', 'Patterson', 'Moore', 'Baker']
+	t = time.time()
+	library = list()
+	for i in range(100000):
+		a = " # ".join(["%s | %s | %s | " % ('John', chr(65+(i+j)%26), surnames[(i*7+j)%8]) for j in range(1+i%4)])
+		library.append(entry({'type': 'article', 'title': 'Title %d' % i, 'author': a, 'year': 1950+i%60,
+		                      'fields': {'journal': 'JASA', 'volume': str(i%100)}, 'cite_ref': 'ref:%d' % i, 'id_entry': i}))
+	t = time.time()-t
+	
+	# The same objects with a __dict__
+	class dictObject(object):
+		pass
+	
+	def toDict(x):
+		d = dictObject()
+		for k, v in _items(x):
+			if isinstance(v, authorlist):
+				v = [toDict(y) for y in v]
+			d.__dict__[k] = v
+		return d
+	
+	former = [toDict(x) for x in library]
+	
+	m = _deepSize(library)
+	n = _deepSize(former)
+	print "100000 entries built in %.2f s, %.1f MB (with __dict__: %.1f MB, -%.0f%%)" % (t, m/1048576., n/1048576., 100.-100.*m/n)
+	
+	# The shared author lists are copied when they are accessed for modification, copied or pickled
+	import copy
+	import pickle
+	e = library[8]
+	f = entry(e)
+	print f.author is e.author, isinstance(e.author, frozenAuthorlist)
+	f['author'].append('Jane | | Doe | ')
+	f['author'][0]['surname'] = 'Smyth'
+	g = copy.deepcopy(e)
+	h = pickle.loads(pickle.dumps(e, 2))
+	g.author.append('Jane | | Doe | ')
+	print str(e.author), '/', str(f.author), len(g.author), h==e, type(h.author).__name__
 
-
-
+def test_pickle():
+	import pickle
+	
+	c = citation({'cite_ref': ['smith:2005'], 'type': 'p', 'search': {'search_type': 'string', 'search_string': 'Smith 2005'}})
+	e = entry({'type': 'article', 'title': 'A title', 'author': 'John | | Smith | # Anne | B | Jones | van', 'year': 2005,
+	           'fields': {'journal': 'JASA'}, 'cite_ref': 'smith:2005', 'id_entry': 1})
+	a = authorlist('John | | Smith | ')
+	for protocol in [0, 1, 2]:
+		x = pickle.loads(pickle.dumps([c, e, a, a[0], citation(), entry(dict())], protocol))
+		print protocol, x==[c, e, a, a[0], citation(), entry(dict())], type(x[1].author).__name__
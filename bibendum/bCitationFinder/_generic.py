@@ -26,6 +26,8 @@
 #    
 #-------------------------------------------------------------------------
 
+import copy
+
 import bTextProcessor
 
 """
@@ -45,10 +47,16 @@ class finder:
 	   A list of the implemented methods. In a non-abstract implementation, only some
 	   of the recommended methods may be implemented. This can be used to avoid to raise
 	   the ``NotImplementedError`` exception.
+	
+	.. attribute:: paragraphs
+	   
+	   The results of :meth:`scanText` for each paragraph text found by the last call to :meth:`scanIncremental`.
 	"""
 	
 	implementedMethods = []
 	
+	paragraphs = None
+	
 	def __init__(self, textProcessor):
 		self.textProcessor = textProcessor
 	
@@ -65,6 +73,91 @@ class finder:
 	def findStyleDefinition(self):
 		raise NotImplementedError()
 	
+	def scan(self):
+		"""Returns the results of :meth:`findCitations`, :meth:`findReflist` and :meth:`findStyleDefinition`
+		as a tuple ``(citations, reflists, styledefs)``. The methods that are not in :attr:`implementedMethods`
+		give empty lists. Implementations should override this method to search the text only once."""
+		
+		results = list()
+		for m in ['findCitations', 'findReflist', 'findStyleDefinition']:
+			if m in self.implementedMethods:
+				results.append(getattr(self, m)())
+			else:
+				results.append(list())
+		
+		return tuple(results)
+	
+	def scanText(self, txt, offset=0):
+		"""Same as :meth:`scan` on the text `txt`. The `offset` is added to the ranges."""
+		raise NotImplementedError()
+	
+	def iterCitations(self):
+		"""Generator of the ``(citation, range)`` of :meth:`findCitations`, in the order of the text. The text is
+		searched chunk by chunk (see :meth:`bTextProcessor._generic.bridge.iterTextChunks`), so that large documents
+		are never entirely in memory. Requires :meth:`scanText`.
+		
+		A citation is given by the chunk in which it starts, if it starts before the overlap with the next chunk.
+		The search of the next chunk resumes after it. The citations must thus be shorter than the overlap."""
+		
+		overlap = self.textProcessor.chunkOverlap
+		chunks  = self.textProcessor.iterTextChunks()
+		
+		start = 0
+		chunk = next(chunks, None)
+		while chunk is not None:
+			offset, txt = chunk
+			chunk = next(chunks, None)
+			
+			if chunk is None:
+				cut = offset+len(txt)
+			else:
+				cut = offset+len(txt)-overlap
+			
+			i = max(start, offset)-offset
+			for cite, span in reversed(self.scanText(txt[i:], offset+i)[0]):
+				if span[0]>=cut:
+					break
+				yield (cite, span)
+				start = span[1]
+			
+			start = max(start, cut)
+	
+	def scanIncremental(self):
+		"""Same as :meth:`scan`, but only the paragraphs that changed since the previous call are searched (see
+		:meth:`bTextProcessor._generic.bridge.getParagraphs`). The results of each paragraph are kept in :attr:`paragraphs`,
+		keyed by the text of the paragraph, and their ranges are shifted to the current position of the paragraph.
+		
+		Each occurrence of a paragraph gets its own copy of the :class:`bBase.citation` objects, so that the information
+		attached to the citations of a paragraph does not change the other paragraphs with the same text, nor the next calls.
+		Requires :meth:`scanText`."""
+		
+		if self.paragraphs is None:
+			self.paragraphs = dict()
+		
+		paragraphs = dict()
+		results = (list(), list(), list())
+		
+		for offset, txt in self.textProcessor.getParagraphs():
+			if paragraphs.has_key(txt):
+				r = paragraphs[txt]
+			elif self.paragraphs.has_key(txt):
+				r = self.paragraphs[txt]
+			else:
+				r = self.scanText(txt)
+			paragraphs[txt] = r
+			
+			for found, total in zip(copy.deepcopy(r), results):
+				for x, span in reversed(found):
+					total.append((x, (span[0]+offset, span[1]+offset)))
+		
+		self.paragraphs = paragraphs
+		
+		# Like findRegexp, start with the last one
+		for total in results:
+			total.reverse()
+		
+		return results
+	
 	def revertCitations(self, citation):
 		raise NotImplementedError()
 	
@@ -43,7 +43,7 @@ class finder(bCitationFinder._generic.finder):
 	and a quick reference `there <http://merkel.zoneo.net/Latex/natbib.php>`_.
 	"""
 	
-	implementedMethods = ['findCitations', 'findReflist', 'findStyleDefinition', 'revertCitations', 'revertReflist', 'revertStyleDefinition']
+	implementedMethods = ['findCitations', 'findReflist', 'findStyleDefinition', 'scanText', 'revertCitations', 'revertReflist', 'revertStyleDefinition']
 	
 	def __init__(self, textProcessor):
 		bCitationFinder._generic.finder.__init__(self, textProcessor)
@@ -54,75 +54,120 @@ class finder(bCitationFinder._generic.finder):
 		
 		self.bibliographystyle = re.compile("\\\\bibliographystyle\\{(.*?)\\}")
 		self.referencelist     = re.compile("\\\\bibliography((?:\\{(.*?)\\})?)")
-	
-	def findCitations(self):
-		"""Returns a list of tuples ``(citation, range)`` where ``citation`` is a :class:`bBase.citation`
-		object, and ``range`` is a range returned by a :mod:`bTextProcessor` implementation.
 		
-		Unlike natbib, the two commands ``\\citealt`` and ``\\citealt`` both produce the same result and
-		are mapped on the 'i' citation type (see :attr:`citation.type` in :mod:`bBase`).
+		# All the commands above in a single expression, used by scan()
+		self.scanner = re.compile("|".join([
+			"\\\\(?P<cite_case>[cC])ite(?P<cite_al>(?:al)?)(?P<cite_type>[tp])(?P<cite_star>\\*?)\\{(?P<cite_refs>.*?)\\}",
+			"\\\\(?P<author_case>[cC])iteauthor(?P<author_star>\\*?)\\{(?P<author_refs>.*?)\\}",
+			"\\\\citeyear\\{(?P<year_refs>.*?)\\}",
+			"\\\\bibliographystyle\\{(?P<style>.*?)\\}",
+			"\\\\bibliography(?:\\{(?P<reflist_options>.*?)\\})?"]))
+	
+	def scan(self):
+		"""Extracts the text of the document once and returns the citations, the reference lists and the style
+		definitions found in it, as a tuple ``(citations, reflists, styledefs)`` of lists in the formats of :meth:`findCitations`,
+		:meth:`findReflist` and :meth:`findStyleDefinition`."""
 		
-		The use of ``\\citetalias`` and ``\\citepalias`` is not supported.
-		"""
+		return self.scanText(self.textProcessor.getText())
+	
+	def scanText(self, txt, offset=0):
+		"""Same as :meth:`scan` for the text `txt`. The `offset` is added to the ranges. All the natbib commands
+		are found with a single pass of :attr:`scanner` over the text. Like for :meth:`bTextProcessor._generic.bridge.findRegexp`,
+		the lists start with the last match."""
 		
-		ls = self.textProcessor.findRegexp(self.cite)
 		citations = list()
-		for c in ls:
-			txt, span, grps = c
-			
-			cite = bBase.citation()
+		reflists  = list()
+		styledefs = list()
+		
+		for m in self.scanner.finditer(txt):
 			
-			cite.cite_ref = [x.strip() for x in grps[4].split(',')]
+			span = (m.start()+offset, m.end()+offset)
 			
-			if grps[1]=='':
-				if grps[2]=='t' or grps[2]=='p':
-					cite.type = grps[2]
+			if m.group('cite_type') is not None:
+				
+				cite = bBase.citation()
+				cite.cite_ref = [x.strip() for x in m.group('cite_refs').split(',')]
+				
+				if m.group('cite_al')=='':
+					cite.type = m.group('cite_type')
+				else:
+					cite.type = 'i'
+				
+				if m.group('cite_case').isupper():
+					cite.type = cite.type.capitalize()
+				
+				if m.group('cite_star')=='*':
+					cite.type += '*'
+				
+				cite.search = {'search_type': 'ref'}
+				citations.append((cite, span))
+				
+			elif m.group('author_case') is not None:
+				
+				cite = bBase.citation()
+				cite.cite_ref = [x.strip() for x in m.group('author_refs').split(',')]
+				cite.type = 'a'
+				
+				if m.group('author_case').isupper():
+					cite.type = cite.type.capitalize()
+				
+				if m.group('author_star')=='*':
+					cite.type += '*'
+				
+				cite.search = {'search_type': 'ref'}
+				citations.append((cite, span))
+				
+			elif m.group('year_refs') is not None:
+				
+				cite = bBase.citation()
+				cite.cite_ref = [x.strip() for x in m.group('year_refs').split(',')]
+				cite.type = 'y'
+				
+				cite.search = {'search_type': 'ref'}
+				citations.append((cite, span))
+				
+			elif m.group('style') is not None:
+				
+				styledefs.append((m.group('style'), span))
+				
 			else:
-				cite.type = 'i'
-			
-			if grps[0].isupper():
-				cite.type = cite.type.capitalize()
-			
-			if grps[3]=='*':
-				cite.type += '*'
-			
-			cite.search = {'search_type': 'ref'}
-			
-			citations.append((cite, span))
+				
+				reflists.append((self._reflistOptions(m.group('reflist_options')), span))
 		
-		ls = self.textProcessor.findRegexp(self.citeauthor)
-		for c in ls:
-			txt, span, grps = c
-			
-			cite = bBase.citation()
-			
-			cite.cite_ref = [x.strip() for x in grps[4].split(',')]
-			cite.type = 'a'
-			
-			if grps[0].isupper():
-				cite.type = cite.type.capitalize()
-			
-			if grps[3]=='*':
-				cite.type += '*'
-			
-			cite.search = {'search_type': 'ref'}
-			
-			citations.append((cite, span))
+		citations.reverse()
+		reflists.reverse()
+		styledefs.reverse()
 		
-		ls = self.textProcessor.findRegexp(self.citeyear)
-		for c in ls:
-			txt, span, grps = c
-			
-			cite = bBase.citation()
-			
-			cite.cite_ref = [x.strip() for x in grps[4].split(',')]
-			cite.type = 'y'
-			
-			cite.search = {'search_type': 'ref'}
+		return citations, reflists, styledefs
+	
+	def _reflistOptions(self, s):
+		"""Parses the options of a ``\\bibliography`` command (see :meth:`findReflist`)."""
+		
+		options = dict()
+		if s is not None:
+			optionsL = [x.split('=') for x in s.split(',')]
 			
-			citations.append((cite, span))
+			for x in optionsL:
+				if len(x)>1:
+					options[x[0].strip()] = x[1].strip()
+				else:
+					options[x[0].strip()] = None
+		
+		return options
+	
+	def findCitations(self):
+		"""Returns a list of tuples ``(citation, range)`` where ``citation`` is a :class:`bBase.citation`
+		object, and ``range`` is a range returned by a :mod:`bTextProcessor` implementation.
+		
+		Unlike natbib, the two commands ``\\citealt`` and ``\\citealt`` both produce the same result and
+		are mapped on the 'i' citation type (see :attr:`citation.type` in :mod:`bBase`).
+		
+		The use of ``\\citetalias`` and ``\\citepalias`` is not supported.
+		
+		Use :meth:`scan` to get the reference lists and style definitions at the same time.
+		"""
 		
-		return citations
+		return self.scan()[0]
 	
 	def findReflist(self):
 		"""Returns a list of tuples ``(reflist_options, range)`` where ``reflist_options`` is ``dict`` with
@@ -135,41 +180,14 @@ class finder(bCitationFinder._generic.finder):
 		
 		Note: the spaces for option names and values are trimmed."""
 		
-		ls = self.textProcessor.findRegexp(self.referencelist)
-		reflists = list()
-		for c in ls:
-			txt, span, grps = c
-			
-			options = dict()
-			if grps[1] is not None:
-				optionsL = [x.split('=') for x in grps[1].split(',')]
-				
-				for x in optionsL:
-					if len(x)>1:
-						options[x[0].strip()] = x[1].strip()
-					else:
-						options[x[0].strip()] = None
-			
-			reflists.append((options, span))
-		
-		return reflists
+		return self.scan()[1]
 	
 	def findStyleDefinition(self):
 		"""``\\bibliographystyle{style_name}``
 		
 		Also returns a list, so what to do with multiple styles is not decided here."""
 		
-		ls = self.textProcessor.findRegexp(self.bibliographystyle)
-		styledefs = list()
-		
-		for c in ls:
-			txt, span, grps = c
-			
-			style_name, = grps
-			
-			styledefs.append((style_name, span))
-		
-		return styledefs
+		return self.scan()[2]
 	
 	def revertCitations(self, citation):
 		raise NotImplementedError()
@@ -206,6 +224,8 @@ def test_find_citations():
 	\bibliography
 	
 	\bibliography{toto}
+	
+	\bibliographystyle{apa}
 	"""
 	
 	f = finder(None)
@@ -213,4 +233,45 @@ def test_find_citations():
 		print x.group(0)
 		print x.groups()
 		print "-"*50
+	
+	citations, reflists, styledefs = f.scanText(txt)
+	for cite, span in citations:
+		print cite.type, cite.cite_ref, span
+	print reflists
+	print styledefs
 
+def test_scan_incremental():
+	import bTextProcessor._generic
+	
+	class textBridge(bTextProcessor._generic.bridge):
+		def __init__(self, txt):
+			self.txt = txt
+		def getText(self):
+			return self.txt
+		def getParagraphs(self):
+			paragraphs = list()
+			offset = 0
+			for p in self.txt.splitlines(True):
+				paragraphs.append((offset, p))
+				offset += len(p)
+			return paragraphs
+	
+	b = textBridge("As shown by \\citet{jon90}.\nSee \\citep{smith:2005, jon90}.\n\\bibliography{}\n")
+	f = finder(b)
+	
+	full = f.scanText(b.getText())
+	incr = f.scanIncremental()
+	print [(c.cite_ref, span) for c, span in incr[0]]
+	print [(c.cite_ref, span) for c, span in full[0]] == [(c.cite_ref, span) for c, span in incr[0]], incr[1]==full[1]
+	
+	b.txt = "New first paragraph \\citeyear{doe:2001}.\n" + b.txt
+	incr = f.scanIncremental()
+	full = f.scanText(b.getText())
+	print [(c.cite_ref, span) for c, span in incr[0]]
+	print [(c.cite_ref, span) for c, span in full[0]] == [(c.cite_ref, span) for c, span in incr[0]], incr[1]==full[1]
+	
+	# Identical paragraphs do not share their citations
+	b.txt = "See \\citep{jon90}.\n" * 2
+	incr = f.scanIncremental()
+	incr[0][0][0].entries.append('jon90')
+	print [(c.entries, span) for c, span in incr[0]], [c.entries for c, span in f.scanIncremental()[0]]
@@ -30,39 +30,121 @@ import bBase
 import bCitationFinder._generic
 import re
 
+# Name particles that can precede an author name
+PREFIXES = ['van', 'von', 'de', 'de la', 'del', 'della']
+
+# Compiled citation grammars shared by all the finders, see grammar()
+grammars = dict()
+
+def grammar(uppercase=bBase.UPPERCASE, lowercase=bBase.LOWERCASE, prefixes=PREFIXES):
+	"""Returns the :class:`citationGrammar` for the given sets of additional `uppercase` and `lowercase`
+	characters and the list of name `prefixes`. The grammar is only built and compiled the first time a
+	set of arguments is used, then it is shared."""
+	
+	key = (uppercase, lowercase, tuple(prefixes))
+	if key not in grammars:
+		grammars[key] = citationGrammar(uppercase, lowercase, prefixes)
+	
+	return grammars[key]
+
+class citationGrammar:
+	"""Matcher of the author-year citations. The citations recognized are the ones matched by the regular
+	expression :attr:`pattern`, but they are found in linear time.
+	
+	.. attribute:: pattern
+	   
+	   The regular expression describing the citations. The named groups are ``open`` and ``close`` (the
+	   parentheses around the citation), ``first`` (the first author) and its ``prefix``, ``etal``, ``middle``
+	   (the other authors, each preceded by a comma), ``last`` (the author after "and" or "&"), and ``years``
+	   or ``pyears`` when the years are between parentheses.
+	   
+	   It is not used for the search: its nested repetitions make it backtrack on long sequences of
+	   capitalized words, like reference lists or titles, and the search time is then quadratic.
+	
+	.. attribute:: dates
+	   
+	   Regular expression matching the years of a citation, with the ``years``, ``pyears`` and ``close`` groups.
+	
+	.. attribute:: authors
+	   
+	   Regular expression matching, on the reversed text, what comes before the years in a citation, with
+	   the other groups. Read backward, the author list can be matched greedily without backtracking.
+	"""
+	
+	def __init__(self, uppercase, lowercase, prefixes):
+		
+		ps = list(prefixes)
+		ps.sort(None, len, True)
+		prefix  = '|'.join(['[%s%s]%s ' % (x[0].upper(), x[0].lower(), re.escape(x[1:])) for x in ps])
+		rprefix = '|'.join([' %s[%s%s]' % (re.escape(x[1:][::-1]), x[0].upper(), x[0].lower()) for x in ps])
+		
+		name    = '(?:Mc)?[A-Z%s][a-z%s-]+' % (uppercase, lowercase)
+		rname   = '[a-z%s-]+[A-Z%s](?:cM)?' % (lowercase, uppercase)
+		author  = '(?:%s)?%s' % (prefix, name)
+		rauthor = '%s(?:%s)?' % (rname, rprefix)
+		date    = '[1-3][0-9]{3}[a-z]?'
+		dates   = '%s(?:, +%s)*' % (date, date)
+		
+		authorBlock = '(?P<first>(?P<prefix>%s)?%s)(?:,? +(?P<etal>et al\\.?)?|(?P<middle>(?:, +%s)*),? +(?:&|and) +(?P<last>%s))?' % (prefix, name, author, author)
+		dateBlock   = '(?:(?P<years>%s)|\\((?P<pyears>%s)\\))(?P<close>\\))?' % (dates, dates)
+		
+		self.pattern = re.compile('(?P<open>\\()?'+authorBlock+',? '+dateBlock)
+		self.dates   = re.compile(dateBlock)
+		self.authors = re.compile(' ,?(?:(?P<etal>\\.?la te)? +,?|(?P<last>%s) +(?:&|dna) +,?(?P<middle>(?:%s +,)*))?(?P<first>%s(?P<prefix>%s)?)(?P<open>\\()?' % (rauthor, rauthor, rname, rprefix))
+	
+	def finditer(self, txt):
+		"""Generator of the citations found in `txt`, in the order of the text. Yields tuples ``(span, groups)``
+		where ``groups`` is a ``dict`` of the groups of :attr:`pattern`.
+		
+		Each match of :attr:`dates` is an anchor, and :attr:`authors` is matched on the reversed text
+		preceding it. The author list of a citation cannot contain digits, so only the text since the
+		previous anchor is reversed, and each character is read a bounded number of times."""
+		
+		end   = 0 # End of the last citation
+		floor = 0 # End of the digits of the last anchor
+		
+		for d in self.dates.finditer(txt):
+			
+			a = d.start()
+			seg = txt[max(end, floor):a][::-1]
+			
+			floor = d.end()
+			while not txt[floor-1].isdigit():
+				floor -= 1
+			
+			m = self.authors.match(seg)
+			if m is None:
+				continue
+			
+			groups = dict()
+			for k in ['open', 'first', 'prefix', 'etal', 'middle', 'last']:
+				x = m.group(k)
+				if x is not None:
+					x = x[::-1]
+				groups[k] = x
+			for k in ['years', 'pyears', 'close']:
+				groups[k] = d.group(k)
+			
+			end = d.end()
+			
+			yield ((a-m.end(), end), groups)
+
 class finder(bCitationFinder._generic.finder):
 	
 	"""
 	The `plaintext` implementation of the :mod:`bCitationFinder` module is meant to detect 
 	citations in plain text (surprising isn't it?). Only citations in the author-year format can be
 	found. The finder recognises "et al.", "and" and "&", and tries to determine the type of citation.
-
+	
 	Also parses the citation to build a search string for the :mod:`bDatabase` search function.
 	"""
 	
-	implementedMethods = ['findCitations']
+	implementedMethods = ['findCitations', 'scanText']
 	
 	def __init__(self, textProcessor):
 		bCitationFinder._generic.finder.__init__(self, textProcessor)
 		
-		lowercase = bBase.LOWERCASE
-		uppercase = bBase.UPPERCASE
-		
-		author  = '((?:[vV]an |[vV]on |[dD]e |[dD]e la |[dD]el |[dD]ella )?(?:Mc)?[A-Z%s][a-z%s-]+)' % (uppercase, lowercase)
-		authorI = '((?:[vV]an |[vV]on |[dD]e |[dD]e la |[dD]el |[dD]ella )?)((?:Mc)?[A-Z%s][a-z%s-]+)' % (uppercase, lowercase)
-		date    = '([1-3][0-9]{3}[a-z]?)'
-		dateI   = '([1-3][0-9]{3})[a-z]?'
-		
-		authorBlock = '%s(?:,? +(et al\.?)?|(?:, +%s)*,? +(?:&|and) +%s)?' % (author,author,author)
-		dateBlock   = '%s(?:, +%s)*' % (date, date)
-		dateBlock   = '(?:(?:%s)|(?:\\(%s\\)))' % (dateBlock, dateBlock)
-		
-		citation = '(\\(?'+authorBlock+',? '+dateBlock+'\\)?)'
-		
-		self.reCitation = re.compile(citation)
-		self.reDateI    = re.compile(dateI)
-		self.reDate     = re.compile(date)
-		#~ self.reAuthorI  = re.compile(authorI)
+		self.grammar = grammar()
 	
 	def findCitations(self):
 		"""Search for citations in plain text. For each candidate, defines a search string and
@@ -72,62 +154,106 @@ class finder(bCitationFinder._generic.finder):
 		``range`` is tuple of cursor indices.
 		"""
 		
-		ls = self.textProcessor.findRegexp(self.reCitation)
+		return self.scanText(self.textProcessor.getText())[0]
+	
+	def scan(self):
+		"""Same as :meth:`findCitations`, in the format of :meth:`bCitationFinder._generic.finder.scan`."""
+		
+		return self.scanText(self.textProcessor.getText())
+	
+	def scanText(self, txt, offset=0):
+		"""Same as :meth:`scan` for the text `txt`. The `offset` is added to the ranges. The type, the authors
+		and the year of each citation are read from the groups of the match (see :class:`citationGrammar`). The list
+		starts with the last match."""
 		
-		# For each citation candidate, determine the type, authors and year
 		citations = list()
-		for c in ls:
-			txt, span, grps = c
+		
+		for span, m in self.grammar.finditer(txt):
 			
-			cite = bBase.citation()
+			t = txt[span[0]:span[1]]
 			
-			cite.text = bBase.text(txt)
+			cite = bBase.citation()
+			cite.text = bBase.text(t)
 			
 			# Type
-			if txt.startswith('(') and txt.endswith(')'):
-				type = 'p'
-				if len(txt.split(','))-1>1:
-					type += '*'
+			n = t.count(',')
+			if t[0]=='(' and t[-1]==')':
+				cite.type = 'p'
+				if n>1:
+					cite.type += '*'
+			elif m['pyears'] is not None:
+				cite.type = 't'
+				if n>0:
+					cite.type += '*'
 			else:
-				if txt.find('(')!=-1 and txt.find(')')!=-1:
-					type = 't'
-					if len(txt.split(','))-1>0:
-						type += '*'
-				else:
-					type = 'i'
-					if len(txt.split(','))-1>1:
-						type += '*'
-			txt = txt.strip('()')
-			
-			for x in ['Van', 'De', 'Von', 'Del', 'Della']:
-				if txt.startswith(x+' '):
-					type = type.capitalize()
+				cite.type = 'i'
+				if n>1:
+					cite.type += '*'
 			
-			# Search string
-			cite.search = dict()
-			cite.search['search_type'] = 'string'
+			prefix = m['prefix']
+			if prefix is not None and prefix[0].isupper():
+				cite.type = cite.type.capitalize()
 			
-			m = reDateI.search(txt)
-			year = m.group(0)
-			m = reDate.search(txt)
-			txt = txt.replace(m.group(0), '')
-			
-			for x in '()':
-				txt = txt.replace(x, '')
-			txt = txt.strip(',. ')
-			
-			if txt.endswith('et al'):
-				txt = txt.replace('et al', '')
-				cite.etal = True
-			txt = txt.strip(',. ')
+			# Search string
+			authors = [m['first']]
+			if m['middle']:
+				authors.extend([x.strip() for x in m['middle'].split(',')[1:]])
+			if m['last'] is not None:
+				authors.append(m['last'])
 			
-			txt = txt.replace(' and ', ', ')
-			txt = txt.replace(' & ', ', ')
-			txt = txt.replace(', , ', ', ')
+			year = (m['years'] or m['pyears'])[:4]
 			
-			cite.search['search_string'] = txt+", "+year
+			cite.search = {'search_type': 'string',
+			               'search_string': ', '.join(authors)+', '+year,
+			               'etal': m['etal'] is not None}
 			
-			citations.append((cite, span))
+			citations.append((cite, (span[0]+offset, span[1]+offset)))
 		
-		return citations
+		citations.reverse()
+		
+		return (citations, list(), list())
+	
+
+#========================================================================
+
+def test_find_citations():
+	import time
 	
+	txt = """As shown by Smith (2005), and later by (Smith and Jones, 2006a, 2007), the effect is robust
+	(Van Dijk et al., 1999). Smith, Baker and Williams 2001 disagree, but de la Fuente (2003) and
+	Doe & Roe (1998, 2000) do not."""
+	
+	f = finder(None)
+	citations = f.scanText(txt)[0]
+	for cite, span in citations:
+		print "%-4s %-40s %-35s %s" % (cite.type, txt[span[0]:span[1]], cite.search['search_string'], cite.search['etal'])
+	
+	# The grammar is compiled only once
+	t = time.time()
+	for i in range(1000):
+		g = finder(None)
+	print "1000 finders in %.2f ms, shared grammar: %s" % ((time.time()-t)*1e3, g.grammar is f.grammar)
+
+def test_pathological():
+	import time
+	
+	g = grammar()
+	
+	for n in [500, 1000, 2000]:
+		
+		# Paragraphs on which the regular expression backtracks
+		corpus = [('reference list', ', '.join(['Smith']*n) + ', 2005'),
+		          ('authors with and', ' and '.join(['Smith, Jones']*n) + ' 2005'),
+		          ('title case', ' '.join(['Title']*n) + ' (2005)'),
+		          ('hyphens', ' '.join(['Ab-cd-ef-gh']*n) + ' 2005')]
+		
+		for k, txt in corpus:
+			t = time.time()
+			a = [(m.span(), m.group('first')) for m in g.pattern.finditer(txt)]
+			t_re = time.time()-t
+			
+			t = time.time()
+			b = [(span, m['first']) for span, m in g.finditer(txt)]
+			t_lin = time.time()-t
+			
+			print "%5d %-18s %6d chars: regexp %8.2f ms, linear %6.2f ms, same: %s" % (n, k, len(txt), t_re*1e3, t_lin*1e3, a==b)
@@ -27,8 +27,16 @@
 #-------------------------------------------------------------------------
 
 import re
+import time
+import bisect
+import heapq
+import unicodedata
+import threading
+import collections
 
-class database:
+import bBase
+
+class database(object):
 	"""Abstract class for access to databases. The constructor must take ``dict`` containing the options.
 	
 	.. attribute:: last_query
@@ -38,11 +46,53 @@ class database:
 	.. attribute:: last_query_exception
 	   
 	   The exception caused by the last executed query (if failed).
+	
+	.. attribute:: paramstyle
+	   
+	   The placeholder used by the database module for the values of the queries: 'format' (``%s``) or 'qmark' (``?``).
+	   See :meth:`_prepare`.
+	
+	.. attribute:: statements
+	   
+	   The :class:`statementCache` of the current connection, or ``None``. Implementations should create
+	   a new one when a connection is opened.
+	
+	.. attribute:: entry_cache
+	   
+	   The :class:`entryCache` used by :meth:`getEntries`, or ``None``. Implementations usually create it
+	   from the 'entry_cache_size' and 'entry_cache_ttl' options.
+	
+	.. attribute:: cite_refs
+	   
+	   The :class:`citeRefAllocator` that hands out the cite_refs of the new entries, or ``None`` until
+	   :meth:`getCiteRefAllocator` is called.
+	
+	.. attribute:: index_lock
+	   
+	   Lock held while the in-memory indexes (:attr:`duplicate_index`, :attr:`search_index` and
+	   :attr:`journal_index`) are created or updated by :meth:`_indexEntry`. The database is never
+	   read while it is held. The indexes also lock themselves, so they can be read at any time.
+	   Each database object has its own lock, created by the constructor: implementations must call it.
 	"""
 	
 	last_query = None
 	last_query_exception = None
 	
+	paramstyle = 'format'
+	statements = None
+	
+	duplicate_index = None
+	entry_cache = None
+	cite_refs = None
+	journal_index = None
+	search_index = None
+	
+	index_lock = None
+	_index_builds = None
+	
+	def __init__(self, options=None):
+		self.index_lock = threading.Lock()
+	
 	def open(self):
 		"""**Abstract** Establish a connection. Returns ``(True,None)`` in case of 
 		success and ``(False,error)`` where ``error`` is an :class:`Exception` in case of failure."""
@@ -52,34 +102,366 @@ class database:
 		"""**Abstract** Close the connection."""
 		raise NotImplementedError()
 	
+	def _prepare(self, sql, args):
+		"""Converts a query written with the ``%s`` placeholders of :meth:`_query` into a query for the
+		database module, with the values passed as parameters. Returns the SQL string and the ``tuple`` of parameters.
+		
+		The identifiers (``\`%s\```) are formatted in the SQL string, while the values (``'%s'``, ``"%s"`` or ``%s``)
+		are replaced by the :attr:`paramstyle` placeholder. The values that are not numbers, strings or ``None``
+		are converted to strings. A literal ``%`` must be written ``%%``.
+		
+		The resulting statements are kept in :attr:`statements` (if not ``None``), keyed by the query
+		template and the identifiers, so that a template is only parsed and formatted once.
+		"""
+		
+		if self.statements is None:
+			self.statements = statementCache()
+		
+		chunks, kinds = self.statements.template(sql)
+		if len(kinds)!=len(args):
+			raise TypeError('The query expects %d arguments (%d given).' % (len(kinds), len(args)))
+		
+		identifiers = tuple([a for k, a in zip(kinds, args) if k=='i'])
+		
+		params = list()
+		for k, a in zip(kinds, args):
+			if k=='v':
+				if a is not None and type(a) not in QUERY_VALUE_TYPES:
+					a = str(a)
+				params.append(a)
+		
+		statement = self.statements.get(sql, identifiers)
+		if statement is not None:
+			return statement, tuple(params)
+		
+		if self.paramstyle=='format':
+			chunks = [x.replace('%', '%%') for x in chunks]
+			marker = '%s'
+		else:
+			marker = '?'
+		
+		q = [chunks[0]]
+		i = 0
+		for k, c in zip(kinds, chunks[1:]):
+			if k=='i':
+				q.append('`%s`' % str(identifiers[i]).replace('`', '``'))
+				i += 1
+			else:
+				q.append(marker)
+			q.append(c)
+		statement = "".join(q)
+		
+		self.statements.put(sql, identifiers, statement)
+		
+		return statement, tuple(params)
+	
+	def _query(self, sql, *args):
+		"""Executes a SQL query on the cursor :attr:`db`. In case of SELECT query, a tuple of lists is returned
+		(one list per column). The query can contain ``%s``, that will be replaced by the following arguments.
+		Quotes must be included for the values, and backquotes for the table and column names::
+		
+		   self._query("SELECT * FROM `%s` WHERE id=%s OR name='%s'", 'tableName', 1, 'toto "the zero"')
+		
+		The values are passed to the database module as parameters (see :meth:`_prepare`).
+		Returns ``False`` if the query failed (see :attr:`last_query_exception`).
+		"""
+		
+		sql, params = self._prepare(sql, args)
+		
+		self.last_query = sql
+		
+		try:
+			self.db.execute(sql, params)
+		except Exception, e:
+			self.last_query_exception = e
+			return False
+		self.last_query_exception = None
+		
+		description = self.db.description
+		
+		if description is None:
+			return None
+		
+		result = self.db.fetchall()
+		
+		if len(result)==0:
+			return tuple([ list() for x in description ])
+		
+		return tuple([ list(x) for x in zip(*result) ])
+	
+	def _queryd(self, sql, *args):
+		"""Same as :meth:`_query` but returns a list of ``dict``. Returns ``None`` if the query failed."""
+		
+		sql, params = self._prepare(sql, args)
+		
+		self.last_query = sql
+		
+		try:
+			self.db.execute(sql, params)
+		except Exception, e:
+			self.last_query_exception = e
+			return None
+		self.last_query_exception = None
+		
+		description = self.db.description
+		
+		if description is None:
+			return None
+		
+		field_names = [x[0] for x in description]
+		
+		return [ dict(zip(field_names, row)) for row in self.db.fetchall() ]
+	
 	def insertEntry(self, e, force=False):
 		"""**Abstract** Inserts the :class:`bBase.entry` `e` in the database."""
 		raise NotImplementedError()
 	
+	def _insertEntryRow(self, e, sql):
+		"""Inserts the row of the :class:`bBase.entry` `e` in the entry table, with a cite_ref from the
+		:class:`citeRefAllocator`. `sql` is the ``INSERT`` query, that takes the table, the cite_ref, the title,
+		the author, the year and the type. If the cite_ref was taken by another client in the meantime,
+		its base is read again and the next cite_ref is tried.
+		
+		Returns the new `id_entry`, or ``None`` if a query failed (see :attr:`last_query_exception`)."""
+		
+		cite_refs = self.getCiteRefAllocator()
+		while True:
+			citeRef = cite_refs.allocate(e)
+			if citeRef is None:
+				return None
+			
+			args = (self.entry_table, citeRef, e.title, e.author.to_string(), e.year, e.type)
+			if self._query(sql, *args)!=False:
+				cite_refs.confirm([citeRef])
+				return self.db.lastrowid
+			
+			exception = self.last_query_exception
+			ids = self._query("SELECT `id_entry` FROM `%s` WHERE `cite_ref`='%s'", self.entry_table, citeRef)
+			if ids==False or len(ids[0])==0:
+				cite_refs.free([citeRef])
+				self.last_query_exception = exception
+				return None
+			
+			cite_refs.confirm([citeRef])
+			if not cite_refs.refresh([citeRef]):
+				return None
+	
 	def insertEntries(self, entries, force=False):
 		"""Inserts a ``list`` of :class:`bBase.entry` objects If the `force` switch is ``True``,
-		the entries are inserted even if they are thought to be duplicates."""
+		the entries are inserted even if they are thought to be duplicates.
+		
+		Returns the ``list`` of the ids of the inserted entries, and a ``list`` of ``(entry, duplicates)``
+		for the entries that were not inserted because potential duplicates were found.
+		
+		Implementations can override this method to provide a faster bulk import."""
 		
 		ids = list()
 		duplicates = list()
 		for e in entries:
 			id, d = self.insertEntry(e, force)
-			if e is None or len(e)==0:
+			if d is None or len(d)==0:
 				ids.append(id)
 			else:
-				duplicates.extend(d)
+				duplicates.append(d)
 		
 		return ids, duplicates
 	
+	def _prepareEntries(self, entries, force=False):
+		"""Prepares a bulk insertion of `entries` (see :meth:`insertEntries`). Unless `force` is ``True``, the
+		entries that are duplicates of an entry of the database or of a previous entry of the list are put aside.
+		The cite_refs of the other entries are reserved at once with the :class:`citeRefAllocator`, and must be
+		confirmed or freed by the caller once the entries are inserted or not.
+		
+		Returns the ``list`` of the entries to insert, the ``list`` of their cite_refs, and the ``list``
+		of ``(entry, duplicates)``. The cite_refs are ``None`` if they could not be resolved."""
+		
+		duplicates = list()
+		batch = list()
+		keys = dict()
+		for e in entries:
+			if not force:
+				d = self.findDuplicates(e)
+				k = self._duplicateKey(e)
+				if keys.has_key(k):
+					d.append(keys[k])
+				if len(d)>0:
+					duplicates.append((e, d))
+					continue
+				keys[k] = e
+			batch.append(e)
+		
+		refs = self.getCiteRefAllocator().allocateMany(batch)
+		
+		return batch, refs, duplicates
+	
+	def _existingCiteRefs(self, refs):
+		"""Returns the ``set`` of the cite_refs of the database that start with one of the cite_refs in `refs`
+		(i.e. including the ones with a suffix), or ``None`` if the query failed."""
+		
+		prefixes = dict()
+		for r in refs:
+			prefixes[r.replace('!', '!!').replace('%', '!%').replace('_', '!_')+'%'] = None
+		prefixes = prefixes.keys()
+		
+		taken = set()
+		for i in range(0, len(prefixes), 500):
+			chunk = prefixes[i:i+500]
+			sql = "SELECT `cite_ref` FROM `%s` WHERE " + " OR ".join(["`cite_ref` LIKE '%s' ESCAPE '!'"]*len(chunk))
+			res = self._query(sql, self.entry_table, *chunk)
+			if res==False:
+				return None
+			taken.update(res[0])
+		
+		return taken
+	
+	def getCiteRefAllocator(self):
+		"""Returns the :class:`citeRefAllocator` of the database (see :attr:`cite_refs`)."""
+		
+		if self.cite_refs is None:
+			self.cite_refs = citeRefAllocator(self)
+		return self.cite_refs
+	
+	def _duplicateKey(self, e):
+		"""Returns a hashable key that is the same for two entries that are strict duplicates
+		(same author surnames, year and title, case insensitive). See :meth:`findDuplicates`."""
+		
+		key, block = duplicateKeys(e.author, e.year, e.title)
+		return key
+	
+	def getDuplicateIndex(self):
+		"""Returns the :class:`duplicateIndex` of the database. The index is built on the first call
+		from the rows returned by :meth:`_duplicateRows`, and must then be kept up to date by the
+		implementation when entries are inserted, updated or deleted (see :meth:`_indexEntry`).
+		
+		If the rows cannot be read, an empty index is returned but not kept, so that the next call tries again."""
+		
+		def build():
+			rows = self._duplicateRows()
+			if rows is None:
+				return None
+			return duplicateIndex(rows)
+		
+		index = self.duplicate_index
+		if index is None:
+			index = self._buildIndex('duplicate_index', build)
+			if index is None:
+				return duplicateIndex()
+		return index
+	
+	def _duplicateRows(self):
+		"""**Abstract** Returns an iterable of ``(id_entry, author, year, title)`` for all the entries
+		of the database, where `author` is the author string as stored in the database. Used to build
+		the :class:`duplicateIndex`. Returns ``None`` if the query failed."""
+		raise NotImplementedError()
+	
+	def _indexEntry(self, id, e=None):
+		"""Updates the :class:`duplicateIndex` (if already built) for the entry `id`: the entry is removed
+		from the index, and added back with the values of the :class:`bBase.entry` `e` if provided.
+		The entry is also removed from :attr:`entry_cache` and updated in the :class:`searchIndex`, so this
+		must be called whenever an entry is inserted, updated or deleted."""
+		
+		if self.entry_cache is not None:
+			self.entry_cache.remove(id)
+		
+		row = None
+		if e is not None:
+			row = self._searchRow(e)[1:]
+		
+		self.index_lock.acquire()
+		try:
+			if self._index_builds is not None:
+				for changes in self._index_builds.itervalues():
+					changes[id] = (e, row)
+			self._updateIndex(self.search_index, id, e, row)
+			self._updateIndex(self.duplicate_index, id, e, row)
+		finally:
+			self.index_lock.release()
+	
+	def _updateIndex(self, index, id, e, row):
+		"""Removes the entry `id` from `index` (a :class:`searchIndex`, a :class:`duplicateIndex` or ``None``),
+		and adds it back with the values of the :class:`bBase.entry` `e` and of its search `row` if `e` is not ``None``."""
+		
+		if index is None:
+			return
+		index.remove(id)
+		if e is None:
+			return
+		if isinstance(index, searchIndex):
+			index.add(id, *row)
+		else:
+			index.add(id, e.author, e.year, e.title)
+	
+	def _buildIndex(self, attribute, build):
+		"""Creates the index :attr:`duplicate_index` or :attr:`search_index` (the name is given by `attribute`) with
+		the function `build`, that reads the database and returns the index, or ``None`` if the query failed.
+		The database is read without holding :attr:`index_lock`: the changes made by :meth:`_indexEntry` in the
+		meantime are recorded, and applied to the new index before it is kept. Returns the index, or ``None``."""
+		
+		token = object()
+		changes = dict()
+		self.index_lock.acquire()
+		try:
+			if getattr(self, attribute) is not None:
+				return getattr(self, attribute)
+			if self._index_builds is None:
+				self._index_builds = dict()
+			self._index_builds[token] = changes
+		finally:
+			self.index_lock.release()
+		
+		index = None
+		try:
+			index = build()
+		finally:
+			self.index_lock.acquire()
+			try:
+				del self._index_builds[token]
+				if index is not None and getattr(self, attribute) is None:
+					for id, (e, row) in changes.iteritems():
+						self._updateIndex(index, id, e, row)
+					setattr(self, attribute, index)
+				index = getattr(self, attribute)
+			finally:
+				self.index_lock.release()
+		
+		return index
+	
+	def _searchRow(self, e, journals=None):
+		"""Returns the row ``(id_entry, author, n_author, year, journal)`` of the search table for
+		the :class:`bBase.entry` `e`. `journals` is an optional ``dict`` used to cache the results of
+		:meth:`getJournal` when many rows are built at once.
+		
+		Can be used for the implementation of :meth:`makeSearch`."""
+		
+		journal_all = ''
+		if e.fields is not None and e.fields.has_key('journal'):
+			name = e.fields['journal']
+			if journals is not None and journals.has_key(name):
+				journal = journals[name]
+			else:
+				journal = self.getJournal(name)
+				if journals is not None:
+					journals[name] = journal
+			
+			if journal is None:
+				journal_all = name
+			else:
+				journal_all = ", ".join([journal[k] for k in ['short', 'pubmed', 'long'] if journal.has_key(k)])
+		
+		return e.id_entry, str(e.author), len(e.author), e.year, journal_all
+	
 	def serializeEntry(self, e, method='python_repr'):
 		"""Serialize an :class:`bBase.entry` object. Supported methods are "python_repr" (default)
 		and "php_serialize". See also :meth:`unserializeEntry`."""
 		
+		d = e.dict()
+		d['author'] = e.author.to_string()
+		
 		if method=='python_repr':
-			serialized_entry = repr(e.__dict__)
+			serialized_entry = repr(d)
 		elif method=='php_serialize':
 			import phpserialize
-			serialized_entry = phpserialize.serialize(e.__dict__)
+			serialized_entry = phpserialize.serialize(d)
 		else:
 			raise NotImplementedError()
 			
@@ -115,6 +497,105 @@ class database:
 		or a :class:`bBase.entry` object. Returns a filled :class:`bBase.entry` object."""
 		raise NotImplementedError()
 	
+	def getEntries(self, xs):
+		"""Retrieves several entries at once. `xs` is a ``list`` of database ids, cite_refs or :class:`bBase.entry`
+		objects, as for :meth:`getEntry`. Returns a ``list`` of :class:`bBase.entry` objects in the same order as `xs`,
+		with ``None`` for the entries that cannot be found, or ``None`` if a query failed.
+		
+		The entries found in :attr:`entry_cache` are not read again. The others are read with one query on
+		:attr:`entry_table` and one query on :attr:`field_table` (per chunk of 500 entries), instead of two
+		queries per entry."""
+		
+		keys = list()
+		for x in xs:
+			if isinstance(x, bBase.entry):
+				x = x.cite_ref
+			if isinstance(x, basestring) and x.isdigit():
+				x = int(x)
+			keys.append(x)
+		
+		by_id = dict()
+		by_ref = dict()
+		ids = dict()
+		refs = dict()
+		for k in keys:
+			if k is None:
+				continue
+			r = None
+			if self.entry_cache is not None:
+				r = self.entry_cache.get(k)
+			if r is not None:
+				by_id[r['id_entry']] = r
+				by_ref[r['cite_ref'].lower()] = r
+			elif isinstance(k, (int, long)):
+				ids[k] = None
+			else:
+				refs[k] = None
+		ids = ids.keys()
+		refs = refs.keys()
+		
+		rows = list()
+		for i in range(0, max(len(ids), len(refs)), 500):
+			chunk_ids = ids[i:i+500]
+			chunk_refs = refs[i:i+500]
+			where = list()
+			if len(chunk_ids)!=0:
+				where.append("`id_entry` IN (%s)" % ", ".join(["%s"]*len(chunk_ids)))
+			if len(chunk_refs)!=0:
+				where.append("`cite_ref` IN (%s)" % ", ".join(["%s"]*len(chunk_refs)))
+			res = self._queryd("SELECT * FROM `%%s` WHERE %s" % " OR ".join(where), self.entry_table, *(chunk_ids+chunk_refs))
+			if res is None:
+				return None
+			rows.extend(res)
+		
+		fields = dict()
+		for r in rows:
+			r['fields'] = dict()
+			fields[r['id_entry']] = r['fields']
+		
+		found = fields.keys()
+		for i in range(0, len(found), 500):
+			chunk = found[i:i+500]
+			sql = "SELECT `id_entry`, `field_name`, `field_value` FROM `%%s` WHERE `id_entry` IN (%s)" % ", ".join(["%s"]*len(chunk))
+			res = self._query(sql, self.field_table, *chunk)
+			if res==False:
+				return None
+			for id, k, v in zip(*res):
+				fields[id][k] = v
+		
+		for r in rows:
+			by_id[r['id_entry']] = r
+			by_ref[r['cite_ref'].lower()] = r
+			if self.entry_cache is not None:
+				self.entry_cache.put(r)
+		
+		entries = list()
+		for k in keys:
+			if isinstance(k, (int, long)):
+				r = by_id.get(k)
+			elif k is not None:
+				r = by_ref.get(k.lower())
+			else:
+				r = None
+			if r is None:
+				entries.append(None)
+			else:
+				# The rows may be in the cache: the entry gets its own fields
+				r = dict(r)
+				r['fields'] = dict(r['fields'])
+				entries.append(bBase.entry(r))
+		
+		return entries
+	
+	def entryCacheStats(self):
+		"""Returns the statistics of :attr:`entry_cache` (see :meth:`entryCache.stats`), or ``None``
+		if there is no cache."""
+		
+		if self.entry_cache is None:
+			return None
+		
+		return self.entry_cache.stats()
+	
 	def findDuplicates(self, e, strict=True):
 		"""**Abstract** Returns a list of :class:`bBase.entry` objects that
 		are potential duplicates of `e`. If `strict` is ``True``, a duplicate has the same authors, year and title.
@@ -126,40 +607,108 @@ class database:
 		"""Computes the word correlation between two strings, i.e. how many unique words in common the two strings have.
 		Returns the number of common words, the number of unique words in A and the number of unique words in B (``float``\ s).
 		
-		Can be used for the implementation of :meth:`findDuplicates`."""
+		Can be used for the implementation of :meth:`findDuplicates`. The words are obtained with :func:`titleTokens`."""
 		
-		A = re.split('\W+', A)
-		uA = dict()
-		for x in A:
-			if len(x)!=0:
-				uA[x.lower()] = None
-		uA = uA.keys()
+		uA = titleTokens(A)
+		uB = titleTokens(B)
 		
-		B = re.split('\W+', B)
-		uB = dict()
-		for x in B:
-			if len(x)!=0:
-				uB[x.lower()] = None
-		uB = uB.keys()
+		return float(len(uA & uB)), float(len(uA)), float(len(uB))
+	
+	def wordCorrelationMany(self, A, candidates):
+		"""Same as :meth:`wordCorrelation` for one string `A` and a ``list`` of strings `candidates`.
+		Returns a ``list`` with the ``(n, nA, nB)`` of each candidate, in the same order."""
 		
-		n = 0
-		for x in uA:
-			if x in uB:
-				n += 1
+		uA = titleTokens(A)
+		nA = float(len(uA))
 		
-		return float(n), float(len(uA)), float(len(uB))
+		r = list()
+		for B in candidates:
+			uB = titleTokens(B)
+			r.append((float(len(uA & uB)), nA, float(len(uB))))
+		
+		return r
 	
 	def getJournal(self, journal, strict=True):
-		"""**Abstract** Returns a ``dict`` with the alternative versions of a journal's title: long, pubmed,
-		iso or short. If a version is empty in the database, the key should not be present in the returned ``dict``.
-		The `journal` argument must be one of the versions of the journal's title.
-		The `strict` flag may allow to get only best matches for journal titles."""
-		raise NotImplementedError()
+		"""Returns a ``dict`` with the alternative versions of a journal's title: long, pubmed,
+		iso or short. If a version is empty in the database, the key is not present in the returned ``dict``.
+		Returns ``None`` if the journal is not found.
+		
+		If `strict` is ``True``, the `journal` argument must be one of the versions of the journal's title
+		(case, punctuation and spaces are ignored). Otherwise, the journal whose title has the most words in
+		common with `journal` is returned (see :meth:`journalIndex.findFuzzy`).
+		
+		The lookups are made in the :class:`journalIndex` of the database (see :meth:`getJournalIndex`)."""
+		
+		index = self.getJournalIndex()
+		if strict:
+			id = index.find(journal)
+		else:
+			id = index.findFuzzy(journal)
+		
+		if id is None:
+			return None
+		
+		return dict(index.journals[id])
+	
+	def getJournalIndex(self):
+		"""Returns the :class:`journalIndex` of the database. The journal table is read on the first call.
+		See :meth:`refreshJournalIndex`."""
+		
+		if self.journal_index is None:
+			self.refreshJournalIndex()
+		return self.journal_index
+	
+	def refreshJournalIndex(self):
+		"""Adds the journals inserted in the journal table since the last call to the :class:`journalIndex`.
+		Only the journals with a larger `id_journal` are read. Returns ``False`` if the query failed."""
+		
+		self.index_lock.acquire()
+		try:
+			if self.journal_index is None:
+				self.journal_index = journalIndex()
+			index = self.journal_index
+		finally:
+			self.index_lock.release()
+		
+		sql = "SELECT `id_journal`, `iso`, `long`, `pubmed`, `short` FROM `%s` WHERE `id_journal`>%s"
+		res = self._query(sql, self.journal_table, index.last_id)
+		if res==False:
+			return False
+		
+		for row in zip(*res):
+			index.add(*row)
+		
+		return True
+	
+	def addJournal(self, iso, long, pubmed, short):
+		"""Inserts a journal in the journal table and in the :class:`journalIndex`. Returns ``True``
+		in case of success, and ``False`` otherwise (see :attr:`last_query_exception`)."""
+		
+		sql = "INSERT INTO `%s` (`iso`, `long`, `pubmed`, `short`) VALUES ('%s', '%s', '%s', '%s')"
+		if self._query(sql, self.journal_table, iso, long, pubmed, short)==False:
+			return False
+		
+		return self.refreshJournalIndex()
 	
 	def makeSearch(self, x):
 		"""**Abstract** Creates the easy search string and insert it or update it in the database."""
 		raise NotImplementedError()
 	
+	def getSearchIndex(self):
+		"""Returns the :class:`searchIndex` of the database. The index is built on the first call from the
+		search table, and is then kept up to date by :meth:`_indexEntry`."""
+		
+		def build():
+			res = self._query("SELECT `id_entry`, `author`, `n_author`, `year`, `journal` FROM `%s`", self.search_table)
+			if res==False:
+				return None
+			return searchIndex(zip(*res))
+		
+		index = self.search_index
+		if index is None:
+			index = self._buildIndex('search_index', build)
+		return index
+	
 	def naturalSearch(self, q, limit=100):
 		"""**Abstract** Searches in the database using a :class:`query` object. Must build the corresponding
 		query for the specific implementation. This includes converting "*" into the specific query language wildcare.
@@ -175,12 +724,929 @@ class database:
 	
 	
 
+#============================================================================================
+
+QUERY_VALUE_TYPES = (type(0), type(0L), type(0.), type(''), type(u''))
+reQueryArg = re.compile("%%|`%s`|'%s'|\"%s\"|%s")
+
+def parseQueryTemplate(sql):
+	"""Splits a query written for :meth:`database._query` into the ``list`` of the literal SQL chunks
+	and a string with the kind of each placeholder: 'i' for an identifier (``\`%s\```), 'v' for a value.
+	There is one more chunk than placeholders. ``%%`` is converted into ``%`` in the chunks."""
+	
+	chunks = ['']
+	kinds = ''
+	pos = 0
+	for m in reQueryArg.finditer(sql):
+		chunks[-1] += sql[pos:m.start()]
+		pos = m.end()
+		if m.group()=='%%':
+			chunks[-1] += '%'
+		else:
+			if m.group()[0]=='`':
+				kinds += 'i'
+			else:
+				kinds += 'v'
+			chunks.append('')
+	chunks[-1] += sql[pos:]
+	
+	return chunks, kinds
+
+class statementCache:
+	"""Cache of the statements built by :meth:`database._prepare` for one connection. The statements
+	are keyed by the query template and the values of its identifiers. When the cache reaches `size` statements,
+	it is emptied.
+	
+	.. attribute:: hits
+	   
+	   Number of statements found in the cache.
+	
+	.. attribute:: misses
+	   
+	   Number of statements that had to be built.
+	
+	"""
+	
+	def __init__(self, size=1024):
+		
+		self.size = size
+		self.hits = 0
+		self.misses = 0
+		
+		self.templates = dict()
+		self.statements = dict()
+	
+	def template(self, sql):
+		"""Returns the result of :func:`parseQueryTemplate` for `sql`."""
+		
+		try:
+			return self.templates[sql]
+		except KeyError:
+			pass
+		
+		if len(self.templates)>=self.size:
+			self.templates.clear()
+		
+		t = parseQueryTemplate(sql)
+		self.templates[sql] = t
+		
+		return t
+	
+	def get(self, sql, identifiers):
+		"""Returns the statement for the template `sql` and the ``tuple`` of `identifiers`, or ``None``."""
+		
+		statement = self.statements.get((sql, identifiers))
+		if statement is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		
+		return statement
+	
+	def put(self, sql, identifiers, statement):
+		"""Stores a statement."""
+		
+		if len(self.statements)>=self.size:
+			self.statements.clear()
+		self.statements[(sql, identifiers)] = statement
+	
+	def stats(self):
+		"""Returns a ``dict`` with the number of `hits`, `misses` and cached `statements`."""
+		
+		return {'hits': self.hits, 'misses': self.misses, 'statements': len(self.statements)}
+
+class entryCache:
+	"""Least recently used cache of the entries read by :meth:`database.getEntries`, keyed by `id_entry`
+	and by `cite_ref` (case insensitive). The cache holds the rows of the entries (``dict`` with the
+	`fields`), not :class:`bBase.entry` objects, so that the entries returned to the caller can be modified.
+	
+	The cache keeps at most `size` entries. If `ttl` is not ``None``, the entries are dropped after
+	`ttl` seconds, which limits the time a change made by another client can go unnoticed.
+	
+	.. attribute:: hits
+	   
+	   Number of entries found in the cache.
+	
+	.. attribute:: misses
+	   
+	   Number of entries not found in the cache (or expired).
+	
+	.. attribute:: evictions
+	   
+	   Number of entries dropped to keep the cache under `size` entries.
+	
+	"""
+	
+	def __init__(self, size=1000, ttl=None):
+		
+		self.size = size
+		self.ttl = ttl
+		
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		
+		self.rows = collections.OrderedDict()
+		self.refs = dict()
+		self.lock = threading.Lock()
+	
+	def get(self, x):
+		"""Returns the row of the entry `x` (an `id_entry` or a `cite_ref`), or ``None``."""
+		
+		self.lock.acquire()
+		try:
+			if isinstance(x, basestring):
+				id = self.refs.get(x.lower())
+			else:
+				id = x
+			item = self.rows.pop(id, None)
+			if item is None:
+				self.misses += 1
+				return None
+			row, t = item
+			if self.ttl is not None and time.time()-t>self.ttl:
+				del self.refs[row['cite_ref'].lower()]
+				self.misses += 1
+				return None
+			self.rows[id] = item
+			self.hits += 1
+			return row
+		finally:
+			self.lock.release()
+	
+	def put(self, row):
+		"""Stores the `row` of an entry."""
+		
+		self.lock.acquire()
+		try:
+			id = row['id_entry']
+			old = self.rows.pop(id, None)
+			if old is not None:
+				del self.refs[old[0]['cite_ref'].lower()]
+			self.rows[id] = (row, time.time())
+			self.refs[row['cite_ref'].lower()] = id
+			while len(self.rows)>self.size:
+				id, (r, t) = self.rows.popitem(last=False)
+				del self.refs[r['cite_ref'].lower()]
+				self.evictions += 1
+		finally:
+			self.lock.release()
+	
+	def remove(self, x):
+		"""Removes the entry `x` (an `id_entry` or a `cite_ref`) from the cache."""
+		
+		self.lock.acquire()
+		try:
+			if isinstance(x, basestring):
+				id = self.refs.get(x.lower())
+			else:
+				id = x
+			item = self.rows.pop(id, None)
+			if item is not None:
+				del self.refs[item[0]['cite_ref'].lower()]
+		finally:
+			self.lock.release()
+	
+	def clear(self):
+		"""Empties the cache."""
+		
+		self.lock.acquire()
+		self.rows.clear()
+		self.refs.clear()
+		self.lock.release()
+	
+	def __len__(self):
+		return len(self.rows)
+	
+	def stats(self):
+		"""Returns a ``dict`` with the number of `hits`, `misses`, `evictions` and cached `entries`."""
+		
+		return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self.rows)}
+
+class citeRefAllocator:
+	"""Hands out the free cite_refs of the entries inserted in a :class:`database`. The cite_refs of the
+	database that start with the ``author:year`` base of an entry (see :meth:`bBase.entry.makeRef`) are read
+	once, with one query for a whole batch of entries (see :meth:`database._existingCiteRefs`), and the next
+	free suffix of the base is then found in memory, instead of one query per suffix.
+	
+	The cite_refs handed out are reserved until they are inserted (see :meth:`confirm`) or released (see
+	:meth:`free`), so that the threads sharing the database never get the same cite_ref. The cite_refs taken
+	by other clients of the database are not seen: the insertion of such a cite_ref fails on the unique key
+	of the `cite_ref` column, and the base must then be read again with :meth:`refresh`.
+	
+	.. attribute:: bases
+	   
+	   ``dict`` of the bases to the ``set`` of the numbers of their suffixes that are taken or reserved
+	   (see :func:`bBase.citeRefIndex`).
+	
+	.. attribute:: reserved
+	   
+	   ``dict`` of the reserved cite_refs to their ``(base, number)``.
+	
+	"""
+	
+	def __init__(self, db):
+		
+		self.db = db
+		self.bases = dict()
+		self.first = dict() # Lowest number that may be free, for each base
+		self.reserved = dict()
+		self.lock = threading.Lock()
+	
+	def _split(self, ref, bases):
+		"""Returns the ``(base, number)`` of the cite_ref `ref` if its base is in `bases`, or ``None``."""
+		
+		ref = ref.lower()
+		i = len(ref)
+		while True:
+			if ref[:i] in bases:
+				return ref[:i], bBase.citeRefIndex(ref[i:])
+			if i==0 or ref[i-1]<'a' or ref[i-1]>'z':
+				return None
+			i -= 1
+	
+	def _read(self, bases):
+		"""Reads the cite_refs of `bases` from the database. Returns a ``dict`` like :attr:`bases`, or ``None``
+		if the query failed."""
+		
+		taken = dict([(b, set()) for b in bases])
+		if len(taken)==0:
+			return taken
+		
+		refs = self.db._existingCiteRefs(taken.keys())
+		if refs is None:
+			return None
+		for r in refs:
+			x = self._split(r, taken)
+			if x is not None:
+				taken[x[0]].add(x[1])
+		
+		return taken
+	
+	def load(self, bases):
+		"""Reads the cite_refs of the `bases` that are not known yet. Returns ``False`` if the query failed."""
+		
+		self.lock.acquire()
+		try:
+			bases = [b for b in set(bases) if b not in self.bases]
+		finally:
+			self.lock.release()
+		
+		taken = self._read(bases)
+		if taken is None:
+			return False
+		
+		self.lock.acquire()
+		try:
+			for b, numbers in taken.iteritems():
+				self.bases.setdefault(b, set()).update(numbers)
+		finally:
+			self.lock.release()
+		
+		return True
+	
+	def refresh(self, refs):
+		"""Reads again the bases of the cite_refs `refs` (or bases) from the database, keeping the reserved
+		cite_refs. Returns ``False`` if the query failed."""
+		
+		self.lock.acquire()
+		try:
+			bases = set()
+			for r in refs:
+				x = self._split(r, self.bases)
+				bases.add(r.lower() if x is None else x[0])
+		finally:
+			self.lock.release()
+		
+		taken = self._read(bases)
+		if taken is None:
+			return False
+		
+		self.lock.acquire()
+		try:
+			for b, n in self.reserved.itervalues():
+				if taken.has_key(b):
+					taken[b].add(n)
+			for b, numbers in taken.iteritems():
+				self.bases[b] = numbers
+				self.first[b] = 0
+		finally:
+			self.lock.release()
+		
+		return True
+	
+	def allocate(self, e):
+		"""Returns a free cite_ref for the :class:`bBase.entry` `e` and reserves it, or ``None`` if the query failed."""
+		
+		refs = self.allocateMany([e])
+		if refs is None:
+			return None
+		return refs[0]
+	
+	def allocateMany(self, entries):
+		"""Same as :meth:`allocate` for a ``list`` of entries, with a single query for all their bases.
+		Returns the ``list`` of the cite_refs, or ``None`` if the query failed."""
+		
+		bases = [e.makeRef() for e in entries]
+		if not self.load(bases):
+			return None
+		
+		self.lock.acquire()
+		try:
+			refs = list()
+			for b in bases:
+				taken = self.bases[b]
+				n = self.first.get(b, 0)
+				while n in taken:
+					n += 1
+				taken.add(n)
+				self.first[b] = n+1
+				r = b + bBase.citeRefSuffix(n)
+				self.reserved[r] = (b, n)
+				refs.append(r)
+			return refs
+		finally:
+			self.lock.release()
+	
+	def confirm(self, refs):
+		"""Ends the reservation of the cite_refs `refs` once they are inserted in the database."""
+		
+		self.lock.acquire()
+		try:
+			for r in refs:
+				self.reserved.pop(r, None)
+		finally:
+			self.lock.release()
+	
+	def free(self, refs):
+		"""Makes the cite_refs `refs` available again: reserved cite_refs that were not inserted, or cite_refs
+		deleted from the database."""
+		
+		self.lock.acquire()
+		try:
+			for r in refs:
+				x = self.reserved.pop(r, None) or self._split(r, self.bases)
+				if x is None:
+					continue
+				b, n = x
+				self.bases[b].discard(n)
+				self.first[b] = min(self.first.get(b, 0), n)
+		finally:
+			self.lock.release()
+
+reWords = re.compile('\W+')
+
+# Cache of titleTokens(), emptied when it reaches TITLE_TOKENS_CACHE_SIZE items
+TITLE_TOKENS_CACHE_SIZE = 100000
+_title_tokens = dict()
+
+def titleTokens(title):
+	"""Returns the ``frozenset`` of the unique lower case words of `title`. The results are cached
+	by title, so the same ``frozenset`` object is returned for the same string."""
+	
+	try:
+		return _title_tokens[title]
+	except KeyError:
+		pass
+	
+	if len(_title_tokens)>=TITLE_TOKENS_CACHE_SIZE:
+		_title_tokens.clear()
+	
+	tokens = frozenset([x for x in reWords.split(title.lower()) if len(x)!=0])
+	_title_tokens[title] = tokens
+	
+	return tokens
+
+def duplicateKeys(author, year, title):
+	"""Returns the strict key and the blocking key used by :class:`duplicateIndex` for an entry
+	(surnames and title are case insensitive). `author` is either a :class:`bBase.authorlist` or the author
+	string as stored in the database. Malformed authors are ignored, and a year that is not a number
+	is replaced by ``None``, so that these entries are blocked together."""
+	
+	if author is None:
+		author = ''
+	if isinstance(author, basestring):
+		surnames = list()
+		for x in author.split('#'):
+			x = x.split('|')
+			if len(x)>2 and len(x[2].strip())!=0:
+				surnames.append(x[2])
+	else:
+		surnames = [x['surname'] for x in author if x['surname']]
+	surnames = tuple([x.strip().lower() for x in surnames])
+	try:
+		year = int(year)
+	except (TypeError, ValueError):
+		year = None
+	if title is None:
+		title = ''
+	
+	if len(surnames)==0:
+		block = None
+	else:
+		block = (surnames[0], year)
+	
+	return (surnames, year, title.strip().lower()), block
+
+class duplicateIndex:
+	"""An in-memory index of the entries used to find duplicates without querying the database
+	(see :meth:`database.findDuplicates`). Strict duplicates are found with a hash lookup on the
+	author surnames, the year and the title. For fuzzy duplicates, the entries are grouped in blocks
+	by first author surname and year, and only the titles of the block are compared.
+	
+	`rows` is an iterable of ``(id_entry, author, year, title)``, where `author` is either a
+	:class:`bBase.authorlist` or the author string as stored in the database.
+	
+	.. attribute:: strict
+	   
+	   ``dict`` of the strict keys to the ``set`` of matching entry ids.
+	
+	.. attribute:: blocks
+	   
+	   ``dict`` of the ``(first author surname, year)`` blocking keys to the ``set`` of matching entry ids.
+	
+	.. attribute:: entries
+	   
+	   ``dict`` of the entry ids to ``(strict_key, block_key, title_tokens)``.
+	
+	"""
+	
+	def __init__(self, rows=None):
+		
+		self.strict  = dict()
+		self.blocks  = dict()
+		self.entries = dict()
+		self.lock    = threading.RLock()
+		
+		if rows is not None:
+			for id, author, year, title in rows:
+				self._add(id, author, year, title)
+	
+	def _add(self, id, author, year, title):
+		"""Same as :meth:`add`, without locking."""
+		
+		key, block = duplicateKeys(author, year, title)
+		
+		self.entries[id] = (key, block, titleTokens(title or ''))
+		self.strict.setdefault(key, set()).add(id)
+		if block is not None:
+			self.blocks.setdefault(block, set()).add(id)
+	
+	def add(self, id, author, year, title):
+		"""Adds the entry `id` to the index."""
+		
+		self.lock.acquire()
+		try:
+			self._add(id, author, year, title)
+		finally:
+			self.lock.release()
+	
+	def remove(self, id):
+		"""Removes the entry `id` from the index, if present."""
+		
+		self.lock.acquire()
+		try:
+			if not self.entries.has_key(id):
+				return
+			
+			key, block, tokens = self.entries.pop(id)
+			self.strict[key].discard(id)
+			if len(self.strict[key])==0:
+				del self.strict[key]
+			if block is not None:
+				self.blocks[block].discard(id)
+				if len(self.blocks[block])==0:
+					del self.blocks[block]
+		finally:
+			self.lock.release()
+	
+	def findStrict(self, e):
+		"""Returns the ``list`` of the ids of the entries with the same author surnames, year and title as
+		the :class:`bBase.entry` `e`."""
+		
+		self.lock.acquire()
+		try:
+			key, block = duplicateKeys(e.author, e.year, e.title)
+			return list(self.strict.get(key, ()))
+		finally:
+			self.lock.release()
+	
+	def findFuzzy(self, e, threshold=50.):
+		"""Returns the ``list`` of the ids of the entries with the same first author and year as the
+		:class:`bBase.entry` `e`, and of which at least `threshold` percent of the title words are in
+		the title of `e`."""
+		
+		self.lock.acquire()
+		try:
+			key, block = duplicateKeys(e.author, e.year, e.title)
+			tokens = titleTokens(e.title or '')
+			
+			ids = list()
+			for id in self.blocks.get(block, ()):
+				t = self.entries[id][2]
+				if len(t)!=0 and len(t & tokens)*100./len(t)>=threshold:
+					ids.append(id)
+			
+			return ids
+		finally:
+			self.lock.release()
+	
+	def __len__(self):
+		return len(self.entries)
+
+reJournalWords = re.compile('[\W_]+', re.UNICODE)
+
+def normalizeJournal(name):
+	"""Returns the lower case words of the journal title `name` separated by single spaces, so that
+	``"J. Acoust. Soc. Am."`` and ``"J Acoust Soc Am"`` are the same."""
+	
+	if isinstance(name, str):
+		name = name.decode('utf-8', 'replace')
+	
+	return " ".join(reJournalWords.split(name.lower())).strip().encode('utf-8')
+
+class journalIndex:
+	"""An in-memory index of the journal table used by :meth:`database.getJournal`. All the versions of
+	the titles (iso, long, pubmed and short) are keyed by their :func:`normalizeJournal` form.
+	
+	.. attribute:: journals
+	   
+	   ``dict`` of the journal ids to the ``dict`` of the non-empty versions of their title.
+	
+	.. attribute:: names
+	   
+	   ``dict`` of the normalized titles to the journal ids.
+	
+	.. attribute:: words
+	   
+	   ``dict`` of the words of the titles to the ``set`` of journal ids.
+	
+	.. attribute:: last_id
+	   
+	   The largest journal id in the index.
+	
+	"""
+	
+	def __init__(self):
+		
+		self.journals = dict()
+		self.names = dict()
+		self.words = dict()
+		self.last_id = 0
+		self.lock = threading.RLock()
+	
+	def add(self, id, iso, long, pubmed, short):
+		"""Adds the journal `id` to the index."""
+		
+		self.lock.acquire()
+		try:
+			j = dict()
+			for k, v in [('iso', iso), ('long', long), ('pubmed', pubmed), ('short', short)]:
+				if v is not None and len(v.strip())!=0:
+					j[k] = v
+			self.journals[id] = j
+			
+			for v in j.values():
+				n = normalizeJournal(v)
+				# The first journal that uses a name keeps it
+				self.names.setdefault(n, id)
+				for w in n.split():
+					self.words.setdefault(w, set()).add(id)
+			
+			self.last_id = max(self.last_id, id)
+		finally:
+			self.lock.release()
+	
+	def find(self, name):
+		"""Returns the id of the journal that has `name` as one of its titles, or ``None``."""
+		
+		self.lock.acquire()
+		try:
+			return self.names.get(normalizeJournal(name))
+		finally:
+			self.lock.release()
+	
+	def findFuzzy(self, name, threshold=50.):
+		"""Returns the id of the journal that has `name` as one of its titles, or else the id of the journal
+		that has the title with the most words in common with `name`, provided that at least `threshold` percent
+		of the words of both titles are common. Returns ``None`` if there is no such journal."""
+		
+		self.lock.acquire()
+		try:
+			n = normalizeJournal(name)
+			if self.names.has_key(n):
+				return self.names[n]
+			
+			uA = set(n.split())
+			if len(uA)==0:
+				return None
+			
+			candidates = set()
+			for w in uA:
+				candidates.update(self.words.get(w, ()))
+			
+			best = None
+			best_score = 0.
+			for id in sorted(candidates):
+				for v in self.journals[id].values():
+					uB = set(normalizeJournal(v).split())
+					c = float(len(uA & uB))
+					score = min(c/len(uA), c/len(uB))*100
+					if score>best_score:
+						best, best_score = id, score
+			
+			if best_score<threshold:
+				return None
+			
+			return best
+		finally:
+			self.lock.release()
+	
+	def __len__(self):
+		return len(self.journals)
+
+reSearchWords = re.compile('[^\W_]+\*?', re.UNICODE)
+reSearchWordsASCII = re.compile('[^\W_]+\*?')
+
+def searchTokens(s):
+	"""Returns the ``list`` of the lower case words of `s`, without diacritics. A "*" at the end of
+	a word is kept (see :meth:`searchIndex.match`)."""
+	
+	if s is None:
+		return list()
+	if isinstance(s, str):
+		try:
+			s.decode('ascii')
+		except UnicodeDecodeError:
+			s = s.decode('utf-8', 'replace')
+		else:
+			return reSearchWordsASCII.findall(s.lower())
+	elif not isinstance(s, unicode):
+		s = unicode(s)
+	
+	s = unicodedata.normalize('NFKD', s.lower())
+	s = u"".join([c for c in s if not unicodedata.combining(c)])
+	
+	return [w.encode('utf-8') for w in reSearchWords.findall(s)]
+
+class searchIndex:
+	"""An in-memory inverted index of the search table used to implement :meth:`database.naturalSearch`
+	without scanning the table. The words of the author and journal columns, the year and the number of
+	authors are mapped to the ``set`` of the matching entry ids.
+	
+	`rows` is an iterable of ``(id_entry, author, n_author, year, journal)``, as returned by :meth:`database._searchRow`.
+	
+	.. attribute:: words
+	   
+	   ``dict`` with, for 'author' and 'journal', a ``dict`` of the words to the ``set`` of entry ids.
+	
+	.. attribute:: years
+	   
+	   ``dict`` of the years to the ``set`` of entry ids.
+	
+	.. attribute:: n_authors
+	   
+	   ``dict`` of the numbers of authors to the ``set`` of entry ids.
+	
+	.. attribute:: entries
+	   
+	   ``dict`` of the entry ids to ``(author_words, n_author, year, journal_words)``.
+	
+	"""
+	
+	def __init__(self, rows=None):
+		
+		self.words = {'author': dict(), 'journal': dict()}
+		self.years = dict()
+		self.n_authors = dict()
+		self.entries = dict()
+		self.lock = threading.RLock()
+		
+		# Sorted vocabularies for the prefix searches, rebuilt when needed
+		self.vocabulary = {'author': None, 'journal': None}
+		
+		if rows is not None:
+			for id, author, n_author, year, journal in rows:
+				self._add(id, frozenset(searchTokens(author)), n_author, year, frozenset(searchTokens(journal)))
+	
+	def _add(self, id, author, n_author, year, journal):
+		"""Same as :meth:`add` without locking, `author` and `journal` being the ``frozenset`` of their words."""
+		
+		self._remove(id)
+		
+		self.entries[id] = (author, n_author, year, journal)
+		
+		for field, words in [('author', author), ('journal', journal)]:
+			index = self.words[field]
+			for w in words:
+				if not index.has_key(w):
+					self.vocabulary[field] = None
+					index[w] = set()
+				index[w].add(id)
+		self.n_authors.setdefault(n_author, set()).add(id)
+		self.years.setdefault(year, set()).add(id)
+	
+	def add(self, id, author, n_author, year, journal):
+		"""Adds the entry `id` to the index."""
+		
+		author = frozenset(searchTokens(author))
+		journal = frozenset(searchTokens(journal))
+		
+		self.lock.acquire()
+		try:
+			self._add(id, author, n_author, year, journal)
+		finally:
+			self.lock.release()
+	
+	def _remove(self, id):
+		"""Same as :meth:`remove`, without locking."""
+		
+		if not self.entries.has_key(id):
+			return
+		author, n_author, year, journal = self.entries.pop(id)
+		
+		for field, words in [('author', author), ('journal', journal)]:
+			index = self.words[field]
+			for w in words:
+				index[w].discard(id)
+				if len(index[w])==0:
+					del index[w]
+					self.vocabulary[field] = None
+		for d, k in [(self.n_authors, n_author), (self.years, year)]:
+			d[k].discard(id)
+			if len(d[k])==0:
+				del d[k]
+	
+	def remove(self, id):
+		"""Removes the entry `id` from the index, if present."""
+		
+		self.lock.acquire()
+		try:
+			self._remove(id)
+		finally:
+			self.lock.release()
+	
+	def match(self, field, s):
+		"""Returns the ``set`` of the entries whose `field` ('author' or 'journal') contains all the words
+		of `s`. The words ending with "*" are prefixes. Returns ``None`` if `s` has no word. The returned
+		``set`` must not be modified."""
+		
+		self.lock.acquire()
+		try:
+			index = self.words[field]
+			ids = None
+			for w in searchTokens(s):
+				if w.endswith('*'):
+					m = self.prefix(field, w[:-1])
+				else:
+					m = index.get(w, frozenset())
+				if ids is None:
+					ids = m
+				else:
+					ids = ids & m
+				if len(ids)==0:
+					break
+			
+			return ids
+		finally:
+			self.lock.release()
+	
+	def prefix(self, field, p):
+		"""Returns the ``set`` of the entries whose `field` contains a word that starts with `p`."""
+		
+		self.lock.acquire()
+		try:
+			index = self.words[field]
+			if self.vocabulary[field] is None:
+				self.vocabulary[field] = sorted(index.keys())
+			vocabulary = self.vocabulary[field]
+			
+			ids = set()
+			i = bisect.bisect_left(vocabulary, p)
+			while i<len(vocabulary) and vocabulary[i].startswith(p):
+				ids.update(index[vocabulary[i]])
+				i += 1
+			
+			return ids
+		finally:
+			self.lock.release()
+	
+	def search(self, q, limit=100):
+		"""Searches the :class:`query` `q`. Returns the ``list`` of the ids of the entries that match all the
+		criteria of `q`, and the ``list`` of the ids of the entries that match some of the criteria, sorted by
+		decreasing rank (the sum of the :attr:`query.RANK` of the criteria they match). There are at most
+		`limit` ids in total. The entries of same rank are sorted by id.
+		
+		The index is only locked while the complete matches are found and the ``set``\ s of the criteria are
+		copied: the partial matches are ranked without blocking the other readers and writers, in a time
+		proportional to the number of matches."""
+		
+		self.lock.acquire()
+		try:
+			#-- Criteria of the query
+			
+			authors = list()
+			if q.author_names is not None:
+				for i, a in enumerate(q.author_names):
+					m = self.match('author', a)
+					if m is None:
+						continue
+					if i==0:
+						authors.append((q.RANK['firstauthor'], m))
+					else:
+						authors.append((q.RANK['author'], m))
+			
+			journal = None
+			if q.journal is not None:
+				journal = self.match('journal', q.journal)
+			
+			year = None
+			if q.year is not None:
+				year = self.years.get(q.year, frozenset())
+			
+			#-- Complete matches
+			
+			sets = [m for r, m in authors]
+			if journal is not None:
+				sets.append(journal)
+			if year is not None:
+				sets.append(year)
+			
+			if len(sets)==0:
+				ids_main = heapq.nsmallest(limit, self.entries.iterkeys())
+			else:
+				sets.sort(key=len)
+				ids_main = heapq.nsmallest(limit, sets[0].intersection(*sets[1:]))
+			
+			limit = limit-len(ids_main)
+			if limit<=0:
+				return ids_main, []
+			
+			#-- Copy of the criteria of the partial matches
+			
+			criteria = [(r, set(m)) for r, m in authors]
+			if q.n_authors is not None:
+				if q.n_authors<0:
+					m = set()
+					for n, ids in self.n_authors.iteritems():
+						if n>=-q.n_authors:
+							m.update(ids)
+				else:
+					m = set(self.n_authors.get(q.n_authors, frozenset()))
+				criteria.append((q.RANK['number_of_authors'], m))
+			if year is not None:
+				criteria.append((q.RANK['year'], set(year)))
+			if journal is not None:
+				criteria.append((q.RANK['journal'], set(journal)))
+		finally:
+			self.lock.release()
+		
+		#-- Partial matches
+		
+		# The rank of an entry is the sum of the ranks of the criteria it matches. The entries are kept in one
+		# ``set`` per rank, and each criterion moves the entries it matches to a higher rank, so that the cost is
+		# linear in the number of matches (times the number of distinct ranks), with the work done on sets.
+		levels = dict()
+		def merge(rank, ids):
+			if levels.has_key(rank):
+				levels[rank].update(ids)
+			else:
+				levels[rank] = ids
+		
+		for r, rest in criteria:
+			rest.difference_update(ids_main)
+			moved = list()
+			for rank, ids in levels.iteritems():
+				both = ids & rest
+				if len(both)!=0:
+					ids.difference_update(both)
+					rest.difference_update(both)
+					moved.append((rank+r, both))
+			for rank, ids in moved:
+				merge(rank, ids)
+			if len(rest)!=0:
+				merge(r, rest)
+		
+		ids_cmpl = list()
+		for rank in sorted(levels.keys(), reverse=True):
+			ids_cmpl.extend(heapq.nsmallest(limit-len(ids_cmpl), levels[rank]))
+			if len(ids_cmpl)>=limit:
+				break
+		
+		return ids_main, ids_cmpl
+	
+	def __len__(self):
+		return len(self.entries)
+
 #============================================================================================
 
 reDate = re.compile('[0-9]{4}')
 reEtal = re.compile('[^a-zA-Z0-9_-](et +al[^a-zA-Z0-9_]*)$')
 
-class query:
+# The default weightings of the query objects, see query.RANK
+QUERY_RANK = {'firstauthor': 2, 'number_of_authors': 1, 'author': 1, 'year': 1, 'journal': 1}
+
+class query(object):
 	""":class:`query` objects are used to implement natural search. The user types in a
 	string that is parsed, and then provided to the database :meth:`naturalSearch` implementation.
 	The object allows ``dict``\ -like access. If an attribute is missing, it is set to ``None``.
@@ -207,46 +1673,72 @@ class query:
 	
 	.. attribute:: RANK
 	   
-	   **Constant** Gives the weightings for the authors, year and journal for the searches::
+	   Gives the weightings for the authors, year and journal for the searches. Each object has its own copy of
+	   :data:`QUERY_RANK`, that can be modified or replaced::
 	   
-	      query.RANK = {'firstauthor': 2, 'number_of_authors': 1, 'author': 1, 'year': 1, 'journal': 1}
+	      q.RANK = {'firstauthor': 2, 'number_of_authors': 1, 'author': 1, 'year': 1, 'journal': 1}
 	
 	"""
 	
+	_fields = ('author_names', 'n_authors', 'journal', 'year', 'q')
+	_keys = frozenset(_fields)
+	__slots__ = list(_fields) + ['RANK']
+	
 	def __init__(self, x):
 		
+		self.RANK = dict(QUERY_RANK)
 		self.author_names = None # author names with prefix and possibly initials with no dot (e.g. Patterson RD)
 		self.n_authors = None # Number of authors
 		self.journal = None # In one of the known formats
 		self.year = None
 		self.q = None
 		
-		self.RANK = {'firstauthor': 2, 'number_of_authors': 1, 'author': 1, 'year': 1, 'journal': 1}
-		
 		if type(x)==type(str()):
 			self.parseQuery(x)
 		elif type(x)==type(self):
-			self.from_dict(x.__dict__)
+			self.from_dict(x)
 		else:
 			raise TypeError('%s is not a valid type for query constructor.' % str(type(x)))
 	
 	def from_dict(self, x):
-		keys = self.__dict__.keys()
-		
 		if x is not None:
-			for k in keys:
+			for k in self._fields:
 				if x.has_key(k):
 					object.__setattr__(self, k, x[k])
+			if isinstance(x, query):
+				self.RANK = dict(x.RANK)
 	
 	def __getitem__(self, key):
-		return self.__dict__[key]
+		if key not in self._keys:
+			raise KeyError(key)
+		return getattr(self, key)
 	
 	def __setitem__(self, key, value):
-		if key not in self.__dict__.keys():
-			raise IndexError('No new key can be created in citation objects.')
-		self.__dict__[key] = value
-		
-		self._check_firstname()
+		if key not in self._keys:
+			raise IndexError('No new key can be created in query objects.')
+		object.__setattr__(self, key, value)
+	
+	def __eq__(self, other):
+		return isinstance(other, query) and self.dict()==other.dict()
+	
+	def __ne__(self, other):
+		return not self.__eq__(other)
+	
+	def __hash__(self):
+		return hash(self.q)
+	
+	def keys(self):
+		return list(self._fields)
+	
+	def has_key(self, key):
+		return key in self._keys
+	
+	def iteritems(self):
+		return self.dict().iteritems()
+	
+	def dict(self):
+		"""Returns a copy of the properties as a ``dict``."""
+		return dict([(k, getattr(self, k)) for k in self._fields])
 	
 	def parseQuery(self, q):
 		"""Parses the string query `q` and fills the :class:`query` object. Any sequence of 4 digits will be
@@ -281,7 +1773,6 @@ class query:
 		else:
 			et_al = False
 		
-		print authors
 		authors = re.split('[,;]', authors)
 		
 		self.n_authors = 0
@@ -306,11 +1797,99 @@ class query:
 def test_query():
 	
 	q = query('patterson et al, 2006')
-	print q.__dict__
+	print q.dict()
 	
 	q = query('patterson rd, smith 2005 JASA')
-	print q.__dict__
-
+	print q.dict()
+	
+	# Each query has its own weightings
+	r = query(q)
+	r.RANK['year'] = 3
+	q.RANK = dict(q.RANK, journal=2)
+	print r==q, r.RANK['year'], q.RANK['year'], q.RANK['journal'], query('smith').RANK==QUERY_RANK
 
+def test_duplicateIndex():
+	
+	rows = [(1, 'Roy | D | Patterson | # Toshio | | Irino | ', 2006, 'Vocal tract length'),
+	        (2, '', 2001, 'No author'),
+	        (3, None, None, None),
+	        (4, 'Patterson # | Irino', 'in press', 'Malformed authors'),
+	        (5, 'Roy | D | Patterson | ', 'in press', 'The perception of pitch')]
+	index = duplicateIndex(rows)
+	print len(index), index.entries[2][:2], index.entries[3][:2], index.entries[4][:2], index.entries[5][:2]
+	
+	e = bBase.entry({'type': 'article', 'title': 'No author', 'author': [], 'year': 2001})
+	f = bBase.entry({'type': 'article', 'title': 'Perception of pitch', 'author': 'Roy | D | Patterson | ', 'year': 'in press'})
+	print index.findStrict(e), index.findFuzzy(f)
+	
+	index.remove(2)
+	index.remove(3)
+	print len(index), index.findStrict(e)
 
+def test_searchIndex():
+	
+	import random
+	import timeit
+	
+	random.seed(1)
+	surnames = ["%s%s" % (random.choice(['pat', 'gau', 'iri', 'smi', 'mor', 'dev', 'car', 'ber']), "".join(random.sample('abcdefghijklmnoprstuvwy', 5))) for i in range(20000)]
+	journals = ['The Journal of the Acoustical Society of America', 'Hearing Research', 'Nature', 'Nature Neuroscience',
+	            'Journal of Neuroscience', 'Ear and Hearing', 'Trends in Amplification', 'Journal of Neurophysiology']
+	
+	rows = list()
+	for id in range(1, 100001):
+		authors = ["%s %s" % (random.choice(surnames).capitalize(), random.choice('ABCDEFGHRT')) for i in range(random.randint(1, 6))]
+		rows.append((id, ", ".join(authors), len(authors), random.randint(1950, 2012), random.choice(journals)))
+	
+	t = timeit.default_timer()
+	index = searchIndex(rows)
+	print "%d entries indexed in %.2f s" % (len(index), timeit.default_timer()-t)
+	
+	a = rows[123][1].split(',')[0]
+	for s in [a+', 2006', a+' et al, '+str(rows[123][3])+' JASA', a[:4]+'*, 1999 Nature', 'Journal of Neuroscience', '1980 Hearing']:
+		q = query(s)
+		main, partial = index.search(q)
+		t = min(timeit.repeat(lambda: index.search(q), number=10, repeat=3))/10
+		print "%-40s %3d + %3d matches %8.2f ms" % (s, len(main), len(partial), t*1000)
 
+def test_wordCorrelation():
+	
+	import random
+	import timeit
+	
+	def wordCorrelation_legacy(A, B):
+		A = re.split('\W+', A)
+		uA = dict()
+		for x in A:
+			if len(x)!=0:
+				uA[x.lower()] = None
+		uA = uA.keys()
+		B = re.split('\W+', B)
+		uB = dict()
+		for x in B:
+			if len(x)!=0:
+				uB[x.lower()] = None
+		uB = uB.keys()
+		n = 0
+		for x in uA:
+			if x in uB:
+				n += 1
+		return float(n), float(len(uA)), float(len(uB))
+	
+	words = ['pitch', 'perception', 'of', 'the', 'cochlear', 'implant', 'users', 'temporal', 'fine', 'structure',
+	         'speech', 'in', 'noise', 'auditory', 'nerve', 'model', 'vocal', 'tract', 'length', 'a', 'and', 'for']
+	random.seed(1)
+	title = " ".join(random.sample(words, 10))
+	candidates = [" ".join(random.sample(words, random.randint(4, 14))).capitalize() for i in range(5000)]
+	
+	db = database()
+	assert [wordCorrelation_legacy(title, c) for c in candidates] == db.wordCorrelationMany(title, candidates)
+	
+	t_legacy = min(timeit.repeat(lambda: [wordCorrelation_legacy(title, c) for c in candidates], number=1, repeat=5))
+	t_single = min(timeit.repeat(lambda: [db.wordCorrelation(title, c) for c in candidates], number=1, repeat=5))
+	t_many   = min(timeit.repeat(lambda: db.wordCorrelationMany(title, candidates), number=1, repeat=5))
+	
+	print "%d candidates" % len(candidates)
+	print "legacy:              %8.2f ms" % (t_legacy*1000)
+	print "wordCorrelation:     %8.2f ms (x%.1f)" % (t_single*1000, t_legacy/t_single)
+	print "wordCorrelationMany: %8.2f ms (x%.1f)" % (t_many*1000, t_legacy/t_many)
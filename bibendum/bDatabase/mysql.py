@@ -30,6 +30,185 @@ import bBase
 import bDatabase._generic
 import MySQLdb 
 
+import functools
+import threading
+
+
+class connection(object):
+	"""A :mod:`MySQLdb` connection `dbc`, with its cursor `db` and its :class:`bDatabase._generic.statementCache`."""
+	
+	def __init__(self, dbc):
+		self.dbc = dbc
+		self.db  = dbc.cursor()
+		self.statements = bDatabase._generic.statementCache()
+	
+	def alive(self):
+		"""Checks that the connection to the server is still up."""
+		
+		try:
+			self.dbc.ping()
+		except Exception:
+			return False
+		return True
+	
+	def close(self):
+		try:
+			self.dbc.close()
+		except Exception:
+			pass
+
+class failedConnection(object):
+	"""Stands for a :class:`connection` that could not be taken from the pool. The query methods of the
+	connection and of its cursor (``execute``, ``executemany``, ``fetchall``, ``fetchone``, ``commit`` and
+	``rollback``) raise `error`, so that the queries fail as with a dropped connection."""
+	
+	description = None
+	
+	def __init__(self, error):
+		self.error = error
+		self.dbc = self
+		self.db  = self
+		self.statements = bDatabase._generic.statementCache()
+	
+	def _fail(self, *args, **kwargs):
+		raise self.error
+	
+	execute = executemany = fetchall = fetchone = commit = rollback = _fail
+	
+	def __nonzero__(self):
+		return False
+	
+	def alive(self):
+		return False
+	
+	def close(self):
+		pass
+
+class connectionPool(object):
+	"""A thread-safe pool of :class:`connection` objects. `connect` is a function that returns a new
+	:mod:`MySQLdb` connection. The pool opens `min_size` connections at creation, and at most `max_size`
+	connections. :meth:`checkout` waits for a connection to be returned if all of them are in use.
+	Once the pool is closed, :meth:`checkout` raises an exception and the connections given back are closed.
+	"""
+	
+	def __init__(self, connect, min_size=1, max_size=5):
+		
+		self.connect  = connect
+		self.min_size = min_size
+		self.max_size = max(max_size, 1)
+		
+		self.size = 0
+		self.idle = list()
+		self.closed = False
+		self.condition = threading.Condition()
+		
+		try:
+			for i in range(min_size):
+				self.idle.append(connection(self.connect()))
+				self.size += 1
+		except Exception:
+			# The connections already opened are closed
+			self.close()
+			raise
+	
+	def checkout(self):
+		"""Returns a :class:`connection` of the pool. The connection is checked with a ping, and replaced
+		by a new one if the server dropped it."""
+		
+		self.condition.acquire()
+		try:
+			while not self.closed and len(self.idle)==0 and self.size>=self.max_size:
+				self.condition.wait()
+			if self.closed:
+				raise Exception('The connection pool is closed.')
+			if len(self.idle)!=0:
+				c = self.idle.pop()
+			else:
+				c = None
+				self.size += 1
+		finally:
+			self.condition.release()
+		
+		try:
+			if c is None:
+				c = connection(self.connect())
+			elif not c.alive():
+				c.close()
+				c = connection(self.connect())
+		except Exception:
+			self.condition.acquire()
+			self.size -= 1
+			self.condition.notify()
+			self.condition.release()
+			raise
+		
+		return c
+	
+	def checkin(self, c):
+		"""Gives the connection `c` back to the pool, or closes it if the pool is closed."""
+		
+		self.condition.acquire()
+		try:
+			if self.closed:
+				c.close()
+				self.size -= 1
+			else:
+				self.idle.append(c)
+			self.condition.notify()
+		finally:
+			self.condition.release()
+	
+	def close(self):
+		"""Closes the idle connections. The connections in use are closed when they are given back."""
+		
+		self.condition.acquire()
+		try:
+			self.closed = True
+			for c in self.idle:
+				c.close()
+			self.size -= len(self.idle)
+			self.idle = list()
+			self.condition.notifyAll()
+		finally:
+			self.condition.release()
+
+def pooled(method):
+	"""Decorator for the methods of :class:`database` that need a connection. If the database uses a
+	:class:`connectionPool`, a connection is bound to the calling thread for the duration of the
+	outermost decorated call, so that nested queries use the same connection.
+	
+	If no connection can be taken from the pool, a :class:`failedConnection` is bound instead, so that
+	the method fails like with a dropped connection (see :attr:`database.last_query_exception`)."""
+	
+	def wrapper(self, *args, **kwargs):
+		pool = self.pool
+		if pool is None:
+			return method(self, *args, **kwargs)
+		
+		local = self._local
+		if local.depth==0:
+			try:
+				local.connection = pool.checkout()
+			except Exception, e:
+				local.connection = failedConnection(e)
+		local.depth += 1
+		try:
+			return method(self, *args, **kwargs)
+		finally:
+			local.depth -= 1
+			if local.depth==0:
+				if not isinstance(local.connection, failedConnection):
+					pool.checkin(local.connection)
+				local.connection = None
+	
+	return functools.wraps(method)(wrapper)
+
+class threadState(threading.local):
+	depth = 0
+	connection = None
+	last_query = None
+	last_query_exception = None
+
 
 class database(bDatabase._generic.database):
 	"""Implementation of the :class:`bDatabase._generic.database` class for MySQL. `options` must specify:
@@ -43,12 +222,29 @@ class database(bDatabase._generic.database):
 	   * 'search_table': the name of the easy search table
 	   * 'backup_table': the table for backup
 	   * 'journal_table': the table that contains the list of journals
+	   * 'entry_cache_size': optional, the number of entries kept in the :class:`bDatabase._generic.entryCache` (1000 by default, 0 to disable the cache).
+	   * 'entry_cache_ttl': optional, the number of seconds an entry stays in the cache (no limit by default).
+	   * 'search_index': optional, if ``False`` :meth:`naturalSearch` queries the search table instead of
+	     using the in-memory :class:`bDatabase._generic.searchIndex` (``True`` by default).
+	
+	By default, all the methods share a single connection. If `options` contains 'pool_max', a
+	:class:`connectionPool` of at most 'pool_max' connections is used instead ('pool_min' connections are
+	opened by :meth:`open`, 1 by default), and the object can be used from several threads. Each
+	thread gets its own connection for the duration of a call. Dropped connections are replaced
+	when they are taken from the pool.
 	
 	This module depends on mysql-python module :mod:`MySQLdb` (`Pypi page <http://pypi.python.org/pypi/MySQL-python>`_
 	and `project page <http://mysql-python.sourceforge.net/>`_).
+	
+	The values of the queries are bound by :mod:`MySQLdb` (see :meth:`bDatabase._generic.database._query`) and the
+	statements are cached per connection in :attr:`statements`.
 	"""
 	
+	paramstyle = 'format'
+	
 	def __init__(self, options):
+		bDatabase._generic.database.__init__(self, options)
+		
 		self.host = options['host']
 		self.user = options['user']
 		self.password = options['password']
@@ -60,17 +256,84 @@ class database(bDatabase._generic.database):
 		self.backup_table = options['backup_table']
 		self.journal_table = options['journal_table']
 		
+		if options.get('entry_cache_size', 1000)>0:
+			self.entry_cache = bDatabase._generic.entryCache(options.get('entry_cache_size', 1000), options.get('entry_cache_ttl', None))
 		
-		self.dbc = None
-		self.db  = None
+		self.use_search_index = options.get('search_index', True)
+		
+		self.pool_min = options.get('pool_min', 1)
+		self.pool_max = options.get('pool_max', None)
+		
+		self.pool = None
+		self.connection = None
+		self._local = threadState()
+	
+	def _current(self):
+		"""Returns the :class:`connection` used by the calling thread."""
+		
+		c = self._local.connection
+		if c is None:
+			return self.connection
+		return c
+	
+	def _getDbc(self):
+		c = self._current()
+		if c is None:
+			return None
+		return c.dbc
+	
+	def _getDb(self):
+		c = self._current()
+		if c is None:
+			return None
+		return c.db
+	
+	def _getStatements(self):
+		c = self._current()
+		if c is None:
+			return None
+		return c.statements
+	
+	def _setStatements(self, statements):
+		c = self._current()
+		if c is not None:
+			c.statements = statements
+	
+	def _getLastQuery(self):
+		return self._local.last_query
+	
+	def _setLastQuery(self, sql):
+		self._local.last_query = sql
+	
+	def _getLastQueryException(self):
+		return self._local.last_query_exception
+	
+	def _setLastQueryException(self, e):
+		self._local.last_query_exception = e
+	
+	last_query = property(_getLastQuery, _setLastQuery, doc="The last query executed by the calling thread.")
+	last_query_exception = property(_getLastQueryException, _setLastQueryException,
+	                                doc="The exception caused by the last query of the calling thread (if failed).")
+	
+	dbc = property(_getDbc, doc="The :mod:`MySQLdb` connection of the calling thread.")
+	db  = property(_getDb, doc="The cursor of the calling thread.")
+	statements = property(_getStatements, _setStatements, doc="The :class:`bDatabase._generic.statementCache` of the connection of the calling thread.")
+	
+	def _connect(self):
+		dbc = MySQLdb.connect(host=self.host, user=self.user, passwd=self.password, db=self.db_name)
+		# The InnoDB tables are transactional: each query is committed, except within START TRANSACTION
+		dbc.autocommit(True)
+		return dbc
 	
 	def open(self):
-		"""Establish a connection. Returns ``(True,None)`` in case of 
+		"""Establish a connection, or create the pool of connections. Returns ``(True,None)`` in case of 
 		success and ``(False,error)`` where ``error`` is an :class:`Exception` in case of failure."""
 		
 		try:
-			self.dbc = MySQLdb.connect(host=self.host, user=self.user, passwd=self.password, db=self.db_name)
-			self.db  = self.dbc.cursor()
+			if self.pool_max is None:
+				self.connection = connection(self._connect())
+			else:
+				self.pool = connectionPool(self._connect, self.pool_min, self.pool_max)
 		except Exception, e:
 			return False, e
 		
@@ -78,137 +341,183 @@ class database(bDatabase._generic.database):
 		
 	
 	def close(self):
-		"""Close the connection."""
+		"""Close the connection, or the pool. The connections of the pool that are still in use are
+		closed when the calls that use them return."""
 		
-		self.db  = None
-		self.dbc.close()
-		self.dbc = None
+		if self.pool is None:
+			self.connection.close()
+			self.connection = None
+		else:
+			self.pool.close()
+			self.pool = None
 	
 	def _protect(self, s):
-		return self.db.connection.escape_string(str(s))
+		return MySQLdb.escape_string(str(s))
 	
-	def _query(self, sql, *args):
-		"""Executes a SQL query. In case of SELECT query, a tuple of lists is returned.
-		The query can contain ``%s``, that will be replaced by the following arguments.
-		Unlike the MySQLdb function, quotes must be included::
+	_query  = pooled(bDatabase._generic.database._query.im_func)
+	_queryd = pooled(bDatabase._generic.database._queryd.im_func)
+	
+	@pooled
+	def _querymany(self, sql, rows):
+		"""Executes the same SQL query for all the `rows` (a ``list`` of ``tuple``\ s) using
+		the ``executemany`` method of the cursor, which turns ``INSERT`` statements into a single
+		multi-row ``INSERT``. Unlike :meth:`_query`, the placeholders of the values are handled by
+		MySQLdb and must not be quoted. Table names must already be formatted in::
 		
-		   self._query("SELECT * FROM `%s` WHERE id=%s OR name='%s'", 'tableName', 1, 'toto "the zero"')
+		   sql = "INSERT INTO `%s` (`id_entry`, `field_name`) VALUES (%%s, %%s)" % self._protect(self.field_table)
+		   self._querymany(sql, [(1, 'journal'), (1, 'volume')])
 		
-		The arguments are converted to strings and protected using :meth:`_protect`.
+		Returns ``True`` in case of success and ``False`` otherwise.
 		"""
 		
-		targs = list()
-		for a in args:
-			targs.append(self._protect(a))
-		sql = sql % tuple(targs)
-		
 		self.last_query = sql
 		
+		if len(rows)==0:
+			return True
+		
 		try:
-			self.db.execute(sql)
+			self.db.executemany(sql, rows)
 		except Exception, e:
 			self.last_query_exception = e
 			return False
 		self.last_query_exception = None
 		
-		result  = self.db.fetchall()
-		description = self.db.description
+		return True
+	
+	@pooled
+	def insertEntry(self, entry, force=False):
+		"""Inserts the :class:`bBase.entry` `e` in the database."""
 		
-		if description==None:
-			return None
+		if not force:
+			e = self.findDuplicates(entry)
+			if len(e)>0:
+				return False, (entry, e)
 		
-		n = len(description)
+		sql = """INSERT INTO `%s` SET `cite_ref`="%s", 
+		         `title`="%s", 
+		         `author`="%s", 
+		         `year`="%s",
+		         `type`="%s", 
+		         `creation_date`=NOW()"""
+		id_entry = self._insertEntryRow(entry, sql)
+		if id_entry is None:
+			return None, tuple()
 		
-		if len(result)==0:
-			return tuple([ list() for i in range(n) ])
+		for name, value in entry.fields.iteritems():
+			sql = """INSERT INTO `%s` SET 
+			         `id_entry`="%s", 
+			         `field_name`="%s", 
+			         `field_value`="%s" """
+			args = (self.field_table, id_entry, name, value)
+			self._query(sql, *args)
 		
-		t = list()
-		for i in range(n) :
-			t.append(list())
-		for row in result :
-			for i in range(n) :
-				t[i].append(row[i])
+		self.makeSearch(id_entry)
+		self._indexEntry(id_entry, entry)
 		
-		return tuple(t)
+		return id_entry, tuple()
 	
-	def _queryd(self, sql, *args):
-		"""Same as :meth:`_query` but returns a list of ``dict``.
+	@pooled
+	def insertEntries(self, entries, force=False):
+		"""Bulk version of :meth:`insertEntry`. The cite_refs of all the entries are resolved in one pass,
+		then the entries, the fields and the search rows are inserted with multi-row ``INSERT`` statements
+		and committed at once. If `force` is ``False``, the entries are checked for duplicates both against
+		the database and within `entries`.
+		
+		Returns the ``list`` of the ids of the inserted entries, and a ``list`` of ``(entry, duplicates)``
+		for the entries that were not inserted, like :meth:`bDatabase._generic.database.insertEntries`.
+		The insertion is a single transaction: if one of the queries fails (including ``START TRANSACTION`` and
+		``COMMIT``, or when no connection could be checked out), it is rolled back, :attr:`last_query_exception` is
+		set and ``None`` is returned instead of the list of ids. This requires
+		the InnoDB tables made by :meth:`createTables`.
 		"""
 		
-		targs = list()
-		for a in args:
-			targs.append(self._protect(a))
-		sql = sql % tuple(targs)
-		
-		self.last_query = sql
+		batch, refs, duplicates = self._prepareEntries(entries, force)
+		if refs is None:
+			return None, duplicates
+		if len(batch)==0:
+			return list(), duplicates
 		
+		ids = None
 		try:
-			self.db.execute(sql)
+			if self._query("START TRANSACTION")!=False:
+				ids = self._insertRows(batch, refs)
+				if ids is not None and self._query("COMMIT")==False:
+					ids = None
 		except Exception, e:
 			self.last_query_exception = e
-			return None
-		self.last_query_exception = None
+		finally:
+			if ids is None:
+				self._rollbackEntries(refs)
 		
-		result  = self.db.fetchall()
-		description = self.db.description
+		if ids is None:
+			return None, duplicates
 		
-		if description==None:
-			return None
-		
-		field_names = [x[0] for x in description]
-		
-		n = len(description)
+		self.cite_refs.confirm(refs)
 		
-		if len(result)==0:
-			return tuple([ list() for i in range(n) ])
+		for id, e in zip(ids, batch):
+			self._indexEntry(id, e)
 		
-		t = list()
-		for row in result :
-			t.append(dict(zip(description, row)))
-		
-		return t
+		return ids, duplicates
 	
-	def insertEntry(self, entry, force=False):
-		"""Inserts the :class:`bBase.entry` `e` in the database."""
+	def _insertRows(self, batch, refs):
+		"""Inserts the rows of the entries of :meth:`insertEntries` in the current transaction. Returns the ``list``
+		of the ids of the entries, or ``None`` if one of the queries failed (see :attr:`last_query_exception`)."""
 		
-		if not force:
-			e = self.findDuplicates(entry)
-			if len(e)>0:
-				return False, (entry, e)
+		res = self._query("SELECT NOW()")
+		if res==False:
+			return None
+		now, = res
 		
+		sql = """INSERT INTO `%s` (`cite_ref`, `title`, `author`, `year`, `type`, `creation_date`)
+		         VALUES (%%s, %%s, %%s, %%s, %%s, %%s)""" % self._protect(self.entry_table)
+		rows = [(r, e.title, e.author.to_string(), e.year, e.type, now[0]) for r, e in zip(refs, batch)]
+		if not self._querymany(sql, rows):
+			return None
 		
-		citeRef = None
-		id_entry = None
-		while id_entry is None:
-			citeRef = entry.make_ref(citeRef)
-			
-			ids, = self._query("SELECT id_entry FROM `%s` WHERE `cite_ref`=%s", (citeRef,))
-			
-			if len(ids) == 0 :
-				sql = """INSERT INTO `%s` SET `cite_ref`="%s", 
-				         `title`="%s", 
-				         `author`="%s", 
-				         `year`="%s",
-				         `type`="%s", 
-				         `creation_date`=NOW()"""
-				args = (self.entry_table, citeRef, entry.title, entry.author.to_string(), entry.year, entry.type)
-				self._query(sql, *args)
-				id_entry = self.db.lastrowid
-				break
-			
+		# Retrieve the ids of the new entries
+		id_of = dict()
+		for i in range(0, len(refs), 500):
+			chunk = refs[i:i+500]
+			sql = "SELECT `id_entry`, `cite_ref` FROM `%s` WHERE `cite_ref` IN (" + ", ".join(["'%s'"]*len(chunk)) + ")"
+			res = self._query(sql, self.entry_table, *chunk)
+			if res==False:
+				return None
+			for id, r in zip(*res):
+				id_of[r] = id
+		ids = [id_of[r] for r in refs]
 		
-		for name, value in entry.fields.iteritems():
-			sql = """INSERT INTO `%s` SET 
-			         `id_entry`="%s", 
-			         `field_name`="%s", 
-			         `field_value`="%s" """
-			args = (self.field_table, id_entry, name, value)
-			self._query(sql, *args)
+		rows = list()
+		for id, e in zip(ids, batch):
+			if e.fields is None:
+				continue
+			for name, value in e.fields.iteritems():
+				rows.append((id, name, value))
+		sql = "INSERT INTO `%s` (`id_entry`, `field_name`, `field_value`) VALUES (%%s, %%s, %%s)" % self._protect(self.field_table)
+		if not self._querymany(sql, rows):
+			return None
 		
-		self.makeSearch(id_entry)
+		journals = dict()
+		rows = list()
+		for id, e in zip(ids, batch):
+			rows.append((id, ) + self._searchRow(e, journals)[1:])
+		sql = """INSERT INTO `%s` (`id_entry`, `author`, `n_author`, `year`, `journal`)
+		         VALUES (%%s, %%s, %%s, %%s, %%s)""" % self._protect(self.search_table)
+		if not self._querymany(sql, rows):
+			return None
 		
-		return id_entry, tuple()
+		return ids
+	
+	def _rollbackEntries(self, refs):
+		"""Rolls back a failed :meth:`insertEntries`, keeping the exception of the faulty query. The cite_refs `refs`
+		are freed, and their bases read again in case the failure comes from a cite_ref taken by another client."""
+		
+		e = self.last_query_exception
+		self._query("ROLLBACK")
+		self.cite_refs.free(refs)
+		self.cite_refs.refresh(refs)
+		self.last_query_exception = e
 	
+	@pooled
 	def backupEntry(self, id, reason):
 		"""Save an entry in the database by serializing an entry object as ``dict``."""
 		
@@ -222,18 +531,19 @@ class database(bDatabase._generic.database):
 		    `reason`='%s',
 		    backup_date=NOW()
 		    """
-		args = (self.backup_table, serialized_entry, serialization_type)
+		args = (self.backup_table, serialized_entry, serialization_type, reason)
 		self._query(sql, *args)
 		
 	
+	@pooled
 	def deleteEntry(self, x):
 		"""Deletes an entry from the database. Actually all entries must be kept
 		in the backup database. `x` can be a database id, a cite_ref or a :class:`bBase.entry` object.
 		Returns ``True`` in case of success, and ``False`` otherwise."""
 		
-		sql = "SELECT `id_entry` FROM `%s` WHERE `id_entry`='%s' OR `cite_ref`='%s' LIMIT 1";
+		sql = "SELECT `id_entry`, `cite_ref` FROM `%s` WHERE `id_entry`='%s' OR `cite_ref`='%s' LIMIT 1";
 		args = (self.entry_table, x, x)
-		id, = self._query(sql, *args)
+		id, ref = self._query(sql, *args)
 		if len(id)==0:
 			return False
 		id = id[0]
@@ -246,8 +556,17 @@ class database(bDatabase._generic.database):
 		sql = "DELETE FROM `%s` WHERE id_entry='%s'"
 		self._query(sql, self.field_table, id)
 		
+		sql = "DELETE FROM `%s` WHERE id_entry='%s'"
+		self._query(sql, self.search_table, id)
+		
+		if self.cite_refs is not None:
+			self.cite_refs.free(ref)
+		# Also removes the entry from the search index, under index_lock
+		self._indexEntry(id)
+		
 		return True
 	
+	@pooled
 	def updateEntry(self, e):
 		"""Updates the :class:`bBase.entry` `e` in the database. 
 		Should backup the old entry, and create a new one if doesn't already exist.
@@ -267,7 +586,7 @@ class database(bDatabase._generic.database):
 			         `year`="%s", 
 			         `type`='%s' 
 			         WHERE `id_entry`=%s """
-			args = (self.entry_table, e.title, e.author.to_string(), e.year, e.style, id)
+			args = (self.entry_table, e.title, e.author.to_string(), e.year, e.type, id)
 			self._query(sql, *args)
 			
 			for fn, fv in e.fields.iteritems():
@@ -288,6 +607,9 @@ class database(bDatabase._generic.database):
 					args = (self.field_table, id, fn, fv)
 					self._query(sql, *args)
 				
+			self._indexEntry(id, e)
+			self.makeSearch(id)
+			
 			return True
 			
 		else:
@@ -295,163 +617,159 @@ class database(bDatabase._generic.database):
 			return False
 		
 	
+	@pooled
 	def getEntry(self, x):
 		"""Retrieve an entry from the database. `x` can be a database id, a cite_ref
 		or a :class:`bBase.entry` object. Returns a filled :class:`bBase.entry` object.
-		Returns ``None`` if the entry cannot be found."""
+		Returns ``None`` if the entry cannot be found. See :meth:`getEntries`."""
 		
-		sql = "SELECT * FROM `%s` WHERE id_entry='%s' OR cite_ref='%s'"
-		args = (self.entry_table, x, x)
-		res = self._queryd(sql, *args)
-		if res is None or len(res)==0:
+		e = self.getEntries([x])
+		if e is None:
 			return None
-		res = res[0]
-		
-		sql = "SELECT * FROM `%s` WHERE id_entry=%s"
-		args = (self.field_table, res['id_entry'])
-		k, v = self._query(sql, *args)
-		res['fields'] = dict(zip(k, v))
 		
-		e = bBase.entry(res)
-		
-		return e
+		return e[0]
+	
+	getEntries = pooled(bDatabase._generic.database.getEntries.im_func)
+	getSearchIndex = pooled(bDatabase._generic.database.getSearchIndex.im_func)
 	
+	@pooled
 	def findDuplicates(self, e, strict=True):
 		"""Returns a list of :class:`bBase.entry` objects that
 		are potential duplicates of `e`. If `strict` is ``True``, a duplicate has the same authors, year and title.
 		If ``strict=False``, first author must be the same, year must be the same, and at least 50% of the word of
-		the title must be the same."""
+		the title must be the same.
+		
+		The lookups are made in the :class:`bDatabase._generic.duplicateIndex` of the database (see
+		:meth:`getDuplicateIndex`), so only the duplicates themselves are read from the database."""
 		
 		if strict:
-			author_surnames = "#".join([("%|%| "+x['surname']+" |%") for x in e.author])
-			sql = "SELECT id_entry FROM `%s` WHERE author LIKE '%s' AND year=%s AND title='%s'"
-			args = (self.entry_table, author_surnames, e.year, e.title)
-			id_entry, = self._query(sql, *args)
+			id_entry = self.getDuplicateIndex().findStrict(e)
 		else:
-			sql = "SELECT id_entry, title FROM `%s` WHERE LOWER(author) REGEXP '^[^|]+\\|[^|]+\\| *%s *\\|.*' AND year=%s"
-			args = (self.entry_table, e.author[0]['surname'].lower(), e.year)
-			ids, titles = self._query(sql, *args)
-			id_entry = list()
-			for id, title in zip(ids, titles):
-				n, nA, nB = self.wordCorrelation(title, e.title)
-				if (n/nA*100.)>=50.:
-					id_entry.append(id)
+			id_entry = self.getDuplicateIndex().findFuzzy(e)
 		
-		duplicates = list()
-		for id in id_entry:
-			duplicates.append( self.getEntry(id) )
+		return self.getEntries(id_entry)
+	
+	def _duplicateRows(self):
+		"""Returns the ``(id_entry, author, year, title)`` of all the entries, used to build the duplicate index."""
 		
-		return duplicates
+		res = self._query("SELECT `id_entry`, `author`, `year`, `title` FROM `%s`", self.entry_table)
+		if res==False:
+			return None
+		
+		return zip(*res)
 	
+	@pooled
 	def makeSearch(self, x):
 		"""Creates the easy search string and insert it or update it in the database."""
 		
 		e = self.getEntry(x)
-		if e.fields.has_key('journal'):
-			journal = self.getJournal(e.fields['journal'])
-			journal_all = list()
-			for k in ['short', 'pubmed', 'long']:
-				if journal.has_key(k):
-					journal_all.append(journal[k])
-			journal_all = ", ".join(journal_all)
-			
-		sql = "INSERT INTO `%s` SET id_entry=%s, author='%s', n_author=%s, year=%s, journal='%s' ON DUPLICATE KEY UPDATE"
-		args = (self.search_table, e.id_entry, e.author, len(e.author), e.year, journal_all)
-		self._query(sql, *args)
-	
-	def getJournal(self, journal, strict=True):
-		"""Returns a ``dict`` with the alternative versions of a journal's title: long, pubmed,
-		iso or short. If a version is empty in the database, the key should not be present in the returned ``dict``.
-		The `journal` argument must be one of the versions of the journal's title.
-		The `strict` flag may allow to get only best matches for journal titles."""
 		
-		if strict:
-			sql = "SELECT * FROM `%s` WHERE `iso`='%s' OR `long`='%s' OR `pubmed`='%s' OR `short`='%s'"
-			args = (self.journal_table, journal, journal, journal, journal)
-			res = self._queryd(sql, *args)
-			if res is None or len(res)==0:
-				return None
-			else:
-				j = res[0]
-			
-		else:
-			pass
-		
-		journal = dict()
-		for k, v in j.iteritems():
-			if v is None or len(v.strip())==0:
-				continue
-			else:
-				journal[k] = v
-		
-		return journal
+		self._query("DELETE FROM `%s` WHERE id_entry=%s", self.search_table, e.id_entry)
 		
+		sql = "INSERT INTO `%s` SET id_entry=%s, author='%s', n_author=%s, year=%s, journal='%s'"
+		args = (self.search_table, ) + self._searchRow(e)
+		self._query(sql, *args)
 	
+	@pooled
 	def naturalSearch(self, q, limit=100):
-		"""Searches in the database using a :class:`query` object. Builds the corresponding
-		query for the specific implementation and returns a list of entries sorted by relevance.
+		"""Searches in the database using a :class:`query` object. Returns the list of the entries that match
+		all the criteria, and the list of the partial matches sorted by decreasing relevance.
 		
-		The "*" in the query strings are replaced by "%".
+		By default, the search is made in the :class:`bDatabase._generic.searchIndex` of the database (see
+		:meth:`getSearchIndex`), and the "*" at the end of the words are used as prefix wildcards. If the 'search_index'
+		option is ``False``, the search table is queried instead, and the "*" in the query strings are replaced by "%".
 		"""
 		
+		if self.use_search_index:
+			index = self.getSearchIndex()
+			if index is not None:
+				ids_main, ids_cmpl = index.search(q, limit)
+				return self.getEntries(ids_main), self.getEntries(ids_cmpl)
+		
 		#-- Get a list of complete matches
 		
-		sql = "SELECT id_entry FROM `%s` WHERE 1" % self._protect(self.search_table)
+		sql = "SELECT `id_entry` FROM `%s` WHERE 1"
+		args = [self.search_table]
 		
 		if q.author_names is not None and len(q.author_names)!=0:
-			sql += " AND author LIKE '%s'" % self._protect("%".join(q.author_names))
+			sql += " AND `author` LIKE '%s'"
+			args.append("%".join(q.author_names).replace("*", "%"))
 		
 		if q.year is not None:
-			sql += " AND year=%d" % q.year
+			sql += " AND `year`=%s"
+			args.append(q.year)
 		
 		if q.journal is not None:
-			sql += " AND journal LIKE '%%%s%%'" % self._protect(q.journal)
+			sql += " AND `journal` LIKE '%s'"
+			args.append("%"+q.journal.replace("*", "%")+"%")
 		
-		sql += " LIMIT %d" % limit
+		sql += " LIMIT %s"
+		args.append(limit)
 		
-		ids_main, = self._query(sql)
+		ids_main, = self._query(sql, *args)
 		limit = limit-len(ids_main)
 		
 		if limit<=0:
-			return [self.getEntry(x) for x in ids_main], []
+			return self.getEntries(ids_main), []
 		
 		#-- Get a list of partial matches
 		
 		sql = list()
+		args = list()
 		
-		for i, a in enumerate(q.author_names):
-			
-			a = a.replace("*", "%")
-			
-			if i==0:
-				rank = q.RANK['firstauthor']
+		if q.author_names is not None:
+			for i, a in enumerate(q.author_names):
+				
+				a = a.replace("*", "%")
+				
+				if i==0:
+					rank = q.RANK['firstauthor']
+				else:
+					rank = q.RANK['author']
+				sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `author` LIKE '%s'")
+				args.extend([rank, self.search_table, "%"+a+"%"])
+		
+		if q.n_authors is not None:
+			if q.n_authors<0:
+				sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `n_author`>=%s")
+				args.extend([q.RANK['number_of_authors'], self.search_table, -q.n_authors])
 			else:
-				rank = q.RANK['author']
-			sql.append("SELECT id_entry, %f AS `rank` FROM `%s` WHERE author LIKE '%s'" %
-			           (rank, self._protect(self.search_table), self._protect(a)))
-		
-		if q.n_authors<0:
-			sql.append("SELECT id_entry, %f AS `rank` FROM `%s` WHERE n_authors>=%d" % (q.RANK['number_of_authors'], self._protect(self.search_table), -q.n_authors))
-		else:
-			sql.append("SELECT id_entry, %f AS `rank` FROM `%s` WHERE n_authors=%d" % (q.RANK['number_of_authors'], self._protect(self.search_table), q.n_authors))
+				sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `n_author`=%s")
+				args.extend([q.RANK['number_of_authors'], self.search_table, q.n_authors])
 		
 		if q.year is not None:
-			sql.append("SELECT id_entry, %f AS `rank` FROM `%s` WHERE year=%d" % (q.RANK['year'], self._protect(self.search_table), q.year))
+			sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `year`=%s")
+			args.extend([q.RANK['year'], self.search_table, q.year])
 		
 		if q.journal is not None:
-			sql.append("SELECT id_entry, %f AS `rank` FROM `%s` WHERE journal LIKE '%%%s%%'" % (q.RANK['journal'], self._protect(self.search_table), q.year))
+			sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `journal` LIKE '%s'")
+			args.extend([q.RANK['journal'], self.search_table, "%"+q.journal.replace("*", "%")+"%"])
+		
+		if len(sql)==0:
+			return self.getEntries(ids_main), []
 		
 		sql = "\n\nUNION ALL\n\n".join(sql)
 		
-		sql = "SELECT id_entry, SUM(rank) AS rank FROM (\n%s\n) AS t WHERE id_entry NOT IN(%s) GROUP BY id_entry ORDER BY rank DESC LIMIT %d" % (sql, ", ".join([str(x) for x in ids_main]), limit)
+		if len(ids_main)!=0:
+			where = "WHERE `id_entry` NOT IN (%s)" % ", ".join(["%s"]*len(ids_main))
+			args.extend(ids_main)
+		else:
+			where = ""
 		
-		ids_cmpl, ranks = self._query(sql)
+		sql = "SELECT `id_entry`, SUM(`rank`) AS `rank` FROM (\n%s\n) AS t %s GROUP BY `id_entry` ORDER BY `rank` DESC LIMIT %%s" % (sql, where)
+		args.append(limit)
 		
-		return [self.getEntry(x) for x in ids_main], [self.getEntry(x) for x in ids_cmpl]
+		ids_cmpl, ranks = self._query(sql, *args)
+		
+		return self.getEntries(ids_main), self.getEntries(ids_cmpl)
 	
+	@pooled
 	def createTables(self, wipe=False):
 		"""Create the tables. Wipe them if already exists and `wipe`=``True``. Returns ``True, None, None`` in case
-		of success, or ``False``, the faulty query and exception otherwise."""
+		of success, or ``False``, the faulty query and exception otherwise.
+		
+		The tables use the InnoDB engine, so that :meth:`insertEntries` is atomic. The tables created as MyISAM by
+		earlier versions are not modified, and should be converted with ``ALTER TABLE `name` ENGINE = InnoDB``."""
 		
 		if wipe:
 			if self._query("DROP TABLE IF EXISTS `%s`" % self._protect(self.entry_table))==False:
@@ -467,7 +785,7 @@ class database(bDatabase._generic.database):
 		    `creation_date` DATETIME NOT NULL ,
 		    UNIQUE KEY (`id_entry`),
 		    UNIQUE KEY (`cite_ref`(32))
-		  ) ENGINE = MYISAM CHARACTER SET utf8 COLLATE utf8_general_ci 
+		  ) ENGINE = InnoDB CHARACTER SET utf8 COLLATE utf8_general_ci 
 		  """ % self._protect(self.entry_table)
 		if self._query(sql)==False:
 			return False, self.last_query, self.last_query_exception
@@ -481,7 +799,7 @@ class database(bDatabase._generic.database):
 		    `id_entry` INT NOT NULL, `field_name` TEXT CHARACTER SET utf8 COLLATE utf8_general_ci NOT NULL,
 		    `field_value` TEXT CHARACTER SET utf8 COLLATE utf8_general_ci NOT NULL,
 		    UNIQUE KEY (`id_field`)
-		  ) ENGINE = MyISAM CHARACTER SET utf8 COLLATE utf8_general_ci
+		  ) ENGINE = InnoDB CHARACTER SET utf8 COLLATE utf8_general_ci
 		  """ % self._protect(self.field_table)
 		if self._query(sql)==False:
 			return False, self.last_query, self.last_query_exception
@@ -498,7 +816,7 @@ class database(bDatabase._generic.database):
 		    `short` TEXT CHARACTER SET utf8 COLLATE utf8_general_ci NOT NULL ,
 		    UNIQUE KEY ( `id_journal` ),
 		    INDEX ( `iso` ( 128 ) )
-		  ) ENGINE = MYISAM CHARACTER SET utf8 COLLATE utf8_general_ci
+		  ) ENGINE = InnoDB CHARACTER SET utf8 COLLATE utf8_general_ci
 		  """ % self._protect(self.journal_table)
 		if self._query(sql)==False:
 			return False, self.last_query, self.last_query_exception
@@ -516,7 +834,7 @@ class database(bDatabase._generic.database):
 		    `journal` TEXT CHARACTER SET utf8 COLLATE utf8_general_ci NULL,
 		    UNIQUE KEY ( `id_search` ),
 		    INDEX (`id_entry`)
-		  ) ENGINE = MYISAM CHARACTER SET utf8 COLLATE utf8_general_ci
+		  ) ENGINE = InnoDB CHARACTER SET utf8 COLLATE utf8_general_ci
 		  """ % self._protect(self.search_table)
 		if self._query(sql)==False:
 			return False, self.last_query, self.last_query_exception
@@ -527,13 +845,13 @@ class database(bDatabase._generic.database):
 		sql = """
 		  CREATE TABLE IF NOT EXISTS `%s`
 		  (
-		    `id_update` INT NOT NULL AUTO_INCREMENT,
+		    `id_backup` INT NOT NULL AUTO_INCREMENT,
 		    `entry_data` TEXT CHARACTER SET utf8 COLLATE utf8_general_ci NOT NULL,
-		    `field_data` TEXT CHARACTER SET utf8 COLLATE utf8_general_ci NOT NULL,
+		    `serialization` TEXT CHARACTER SET utf8 COLLATE utf8_general_ci NOT NULL,
 		    `backup_date` DATETIME NOT NULL,
 		    `reason` VARCHAR( 16 ) NOT NULL,
-		    UNIQUE (`id_field`)
-		  ) ENGINE = MYISAM CHARACTER SET utf8 COLLATE utf8_general_ci
+		    UNIQUE (`id_backup`)
+		  ) ENGINE = InnoDB CHARACTER SET utf8 COLLATE utf8_general_ci
 		  """ % self._protect(self.backup_table)
 		if self._query(sql)==False:
 			return False, self.last_query, self.last_query_exception
@@ -0,0 +1,626 @@
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------
+#    Bibendum's Database Class SQLite implementation
+#    
+#    bDatabase/sqlite.py,
+#    this file is part of the Bibendum Reference Manager project
+#    
+#    $Revision$ $Date$
+#-------------------------------------------------------------------------
+#    
+#    Copyright the Bibendum Reference Manager contributors
+#    
+#    Bibendum Reference Manager is a free software: you can redistribute it
+#    and/or modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, version 3 of the License.
+#    
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#    
+#-------------------------------------------------------------------------
+
+import re
+import sqlite3
+
+import bBase
+import bDatabase._generic
+
+reSearchToken = re.compile('[^\\W_]+\\*?', re.UNICODE)
+
+class database(bDatabase._generic.database):
+	"""Implementation of the :class:`bDatabase._generic.database` class for SQLite. The database is a
+	single file accessed in-process, so no server is needed. `options` must specify:
+	   
+	   * 'filename': the path of the database file (or ':memory:').
+	   * 'entry_table': the name of the entry table.
+	   * 'field_table': the name of the field table.
+	   * 'search_table': the name of the easy search table
+	   * 'backup_table': the table for backup
+	   * 'journal_table': the table that contains the list of journals
+	   * 'entry_cache_size': optional, the number of entries kept in the :class:`bDatabase._generic.entryCache` (1000 by default, 0 to disable the cache).
+	   * 'entry_cache_ttl': optional, the number of seconds an entry stays in the cache (no limit by default).
+	
+	The tables have the same layout as in :mod:`bDatabase.mysql`, except that the search table is
+	an `FTS5 <http://www.sqlite.org/fts5.html>`_ virtual table, which ``rowid`` is the ``id_entry``.
+	The database is opened in WAL mode, and the statements are prepared and cached by :mod:`sqlite3`.
+	
+	This module depends on the :mod:`sqlite3` module of the standard library. SQLite must be compiled with FTS5.
+	"""
+	
+	paramstyle = 'qmark'
+	
+	def __init__(self, options):
+		bDatabase._generic.database.__init__(self, options)
+		
+		self.filename = options['filename']
+		
+		self.entry_table = options['entry_table']
+		self.field_table = options['field_table']
+		self.search_table = options['search_table']
+		self.backup_table = options['backup_table']
+		self.journal_table = options['journal_table']
+		
+		if options.get('entry_cache_size', 1000)>0:
+			self.entry_cache = bDatabase._generic.entryCache(options.get('entry_cache_size', 1000), options.get('entry_cache_ttl', None))
+		
+		self.dbc = None
+		self.db  = None
+	
+	def open(self):
+		"""Opens the database file. Returns ``(True,None)`` in case of
+		success and ``(False,error)`` where ``error`` is an :class:`Exception` in case of failure."""
+		
+		try:
+			self.dbc = sqlite3.connect(self.filename, isolation_level=None, cached_statements=256)
+			self.dbc.text_factory = str
+			self.db  = self.dbc.cursor()
+			self.db.execute("PRAGMA journal_mode=WAL")
+			self.db.execute("PRAGMA synchronous=NORMAL")
+		except Exception, e:
+			return False, e
+		
+		self.statements = bDatabase._generic.statementCache()
+		
+		return True, None
+	
+	def close(self):
+		"""Close the database."""
+		
+		self.db  = None
+		self.dbc.close()
+		self.dbc = None
+		self.statements = None
+	
+	def _querymany(self, sql, rows):
+		"""Executes the same SQL query for all the `rows` (a ``list`` of ``tuple``\ s). The placeholders
+		of the values are ``?``, and table names must already be formatted in::
+		   
+		   sql = "INSERT INTO `%s` (`id_entry`, `field_name`) VALUES (?, ?)" % self.field_table
+		   self._querymany(sql, [(1, 'journal'), (1, 'volume')])
+		
+		Returns ``True`` in case of success and ``False`` otherwise.
+		"""
+		
+		self.last_query = sql
+		
+		try:
+			self.db.executemany(sql, rows)
+		except Exception, e:
+			self.last_query_exception = e
+			return False
+		self.last_query_exception = None
+		
+		return True
+	
+	def insertEntry(self, entry, force=False):
+		"""Inserts the :class:`bBase.entry` `e` in the database."""
+		
+		if not force:
+			e = self.findDuplicates(entry)
+			if len(e)>0:
+				return False, (entry, e)
+		
+		sql = """INSERT INTO `%s` (`cite_ref`, `title`, `author`, `year`, `type`, `creation_date`)
+		         VALUES ('%s', '%s', '%s', %s, '%s', datetime('now'))"""
+		id_entry = self._insertEntryRow(entry, sql)
+		if id_entry is None:
+			return None, tuple()
+		
+		if entry.fields is not None:
+			sql = "INSERT INTO `%s` (`id_entry`, `field_name`, `field_value`) VALUES (?, ?, ?)" % self.field_table
+			self._querymany(sql, [(id_entry, k, v) for k, v in entry.fields.iteritems()])
+		
+		self.makeSearch(id_entry)
+		self._indexEntry(id_entry, entry)
+		
+		return id_entry, tuple()
+	
+	def insertEntries(self, entries, force=False):
+		"""Bulk version of :meth:`insertEntry`. The cite_refs of all the entries are resolved in one pass,
+		then the entries, the fields and the search rows are inserted with ``executemany`` inside
+		a single transaction.
+		
+		Returns the ``list`` of the ids of the inserted entries, and a ``list`` of ``(entry, duplicates)``
+		for the entries that were not inserted, like :meth:`bDatabase._generic.database.insertEntries`.
+		If one of the queries fails, the transaction is rolled back, :attr:`last_query_exception` is set
+		and ``None`` is returned instead of the list of ids.
+		"""
+		
+		batch, refs, duplicates = self._prepareEntries(entries, force)
+		if refs is None:
+			return None, duplicates
+		if len(batch)==0:
+			return list(), duplicates
+		
+		self.db.execute("BEGIN")
+		
+		sql = """INSERT INTO `%s` (`cite_ref`, `title`, `author`, `year`, `type`, `creation_date`)
+		         VALUES (?, ?, ?, ?, ?, datetime('now'))""" % self.entry_table
+		rows = [(r, e.title, e.author.to_string(), e.year, e.type) for r, e in zip(refs, batch)]
+		if not self._querymany(sql, rows):
+			return self._rollbackEntries(duplicates, refs)
+		
+		# Retrieve the ids of the new entries
+		id_of = dict()
+		for i in range(0, len(refs), 500):
+			chunk = refs[i:i+500]
+			sql = "SELECT `id_entry`, `cite_ref` FROM `%s` WHERE `cite_ref` IN (" + ", ".join(["'%s'"]*len(chunk)) + ")"
+			res = self._query(sql, self.entry_table, *chunk)
+			if res==False:
+				return self._rollbackEntries(duplicates, refs)
+			for id, r in zip(*res):
+				id_of[r.lower()] = id
+		ids = [id_of[r.lower()] for r in refs]
+		
+		rows = list()
+		for id, e in zip(ids, batch):
+			if e.fields is None:
+				continue
+			for name, value in e.fields.iteritems():
+				rows.append((id, name, value))
+		sql = "INSERT INTO `%s` (`id_entry`, `field_name`, `field_value`) VALUES (?, ?, ?)" % self.field_table
+		if not self._querymany(sql, rows):
+			return self._rollbackEntries(duplicates, refs)
+		
+		journals = dict()
+		rows = list()
+		for id, e in zip(ids, batch):
+			rows.append((id, id) + self._searchRow(e, journals)[1:])
+		sql = """INSERT INTO `%s` (`rowid`, `id_entry`, `author`, `n_author`, `year`, `journal`)
+		         VALUES (?, ?, ?, ?, ?, ?)""" % self.search_table
+		if not self._querymany(sql, rows):
+			return self._rollbackEntries(duplicates, refs)
+		
+		self.db.execute("COMMIT")
+		self.cite_refs.confirm(refs)
+		
+		for id, e in zip(ids, batch):
+			self._indexEntry(id, e)
+		
+		return ids, duplicates
+	
+	def _rollbackEntries(self, duplicates, refs):
+		"""Rolls back a failed :meth:`insertEntries`, keeping the exception of the faulty query. The cite_refs `refs`
+		are freed, and their bases read again in case the failure comes from a cite_ref taken by another client."""
+		
+		e = self.last_query_exception
+		self.db.execute("ROLLBACK")
+		self.cite_refs.free(refs)
+		self.cite_refs.refresh(refs)
+		self.last_query_exception = e
+		
+		return None, duplicates
+	
+	def backupEntry(self, id, reason):
+		"""Save an entry in the database by serializing an entry object as ``dict``."""
+		
+		e = self.getEntry(id)
+		serialized_entry, serialization_type = self.serializeEntry(e, method="python_repr")
+		
+		sql = """INSERT INTO `%s` (`entry_data`, `serialization`, `reason`, `backup_date`)
+		         VALUES ('%s', '%s', '%s', datetime('now'))"""
+		args = (self.backup_table, serialized_entry, serialization_type, reason)
+		self._query(sql, *args)
+	
+	def deleteEntry(self, x):
+		"""Deletes an entry from the database. Actually all entries must be kept
+		in the backup database. `x` can be a database id, a cite_ref or a :class:`bBase.entry` object.
+		Returns ``True`` in case of success, and ``False`` otherwise."""
+		
+		if isinstance(x, bBase.entry):
+			x = x.cite_ref
+		
+		sql = "SELECT `id_entry`, `cite_ref` FROM `%s` WHERE `id_entry`='%s' OR `cite_ref`='%s' LIMIT 1"
+		id, ref = self._query(sql, self.entry_table, x, x)
+		if len(id)==0:
+			return False
+		id = id[0]
+		
+		self.backupEntry(id, 'deleted')
+		
+		self._query("DELETE FROM `%s` WHERE `id_entry`=%s", self.entry_table, id)
+		self._query("DELETE FROM `%s` WHERE `id_entry`=%s", self.field_table, id)
+		self._query("DELETE FROM `%s` WHERE `rowid`=%s", self.search_table, id)
+		
+		if self.cite_refs is not None:
+			self.cite_refs.free(ref)
+		self._indexEntry(id)
+		
+		return True
+	
+	def updateEntry(self, e):
+		"""Updates the :class:`bBase.entry` `e` in the database.
+		Should backup the old entry, and create a new one if doesn't already exist.
+		Returns ``True`` if the entry was updated and ``False`` if a new entry was created."""
+		
+		ids, = self._query("SELECT `id_entry` FROM `%s` WHERE `cite_ref`='%s'", self.entry_table, e.cite_ref)
+		if len(ids)==0:
+			self.insertEntry(e, True)
+			return False
+		
+		id = ids[0]
+		
+		self.backupEntry(id, 'edit')
+		
+		sql = "UPDATE `%s` SET `title`='%s', `author`='%s', `year`=%s, `type`='%s' WHERE `id_entry`=%s"
+		args = (self.entry_table, e.title, e.author.to_string(), e.year, e.type, id)
+		self._query(sql, *args)
+		
+		if e.fields is not None:
+			self._query("DELETE FROM `%s` WHERE `id_entry`=%s", self.field_table, id)
+			sql = "INSERT INTO `%s` (`id_entry`, `field_name`, `field_value`) VALUES (?, ?, ?)" % self.field_table
+			self._querymany(sql, [(id, k, v) for k, v in e.fields.iteritems()])
+		
+		self._indexEntry(id, e)
+		self.makeSearch(id)
+		
+		return True
+	
+	def getEntry(self, x):
+		"""Retrieve an entry from the database. `x` can be a database id, a cite_ref
+		or a :class:`bBase.entry` object. Returns a filled :class:`bBase.entry` object.
+		Returns ``None`` if the entry cannot be found. See :meth:`getEntries`."""
+		
+		e = self.getEntries([x])
+		if e is None:
+			return None
+		
+		return e[0]
+	
+	def findDuplicates(self, e, strict=True):
+		"""Returns a list of :class:`bBase.entry` objects that
+		are potential duplicates of `e`. If `strict` is ``True``, a duplicate has the same authors, year and title.
+		If ``strict=False``, first author must be the same, year must be the same, and at least 50% of the word of
+		the title must be the same. The lookups are made in the :class:`bDatabase._generic.duplicateIndex`."""
+		
+		if strict:
+			id_entry = self.getDuplicateIndex().findStrict(e)
+		else:
+			id_entry = self.getDuplicateIndex().findFuzzy(e)
+		
+		return self.getEntries(id_entry)
+	
+	def _duplicateRows(self):
+		"""Returns the ``(id_entry, author, year, title)`` of all the entries, used to build the duplicate index."""
+		
+		res = self._query("SELECT `id_entry`, `author`, `year`, `title` FROM `%s`", self.entry_table)
+		if res==False:
+			return None
+		
+		return zip(*res)
+	
+	def makeSearch(self, x):
+		"""Creates the easy search string and insert it or update it in the database."""
+		
+		e = self.getEntry(x)
+		
+		self._query("DELETE FROM `%s` WHERE `rowid`=%s", self.search_table, e.id_entry)
+		
+		sql = """INSERT INTO `%s` (`rowid`, `id_entry`, `author`, `n_author`, `year`, `journal`)
+		         VALUES (%s, %s, '%s', %s, %s, '%s')"""
+		args = (self.search_table, e.id_entry) + self._searchRow(e)
+		self._query(sql, *args)
+	
+	def _match(self, column, s):
+		"""Converts the string `s` into a FTS5 query on `column` that requires all the words of `s`.
+		The "*" wildcards at the end of the words are kept as prefix queries."""
+		
+		if isinstance(s, str):
+			s = s.decode('utf-8')
+		
+		tokens = list()
+		for t in reSearchToken.findall(s):
+			if t.endswith('*'):
+				tokens.append('"%s"*' % t[:-1])
+			else:
+				tokens.append('"%s"' % t)
+		
+		if len(tokens)==0:
+			return None
+		
+		return ('%s : (%s)' % (column, " AND ".join(tokens))).encode('utf-8')
+	
+	def naturalSearch(self, q, limit=100):
+		"""Searches in the database using a :class:`query` object, using the full text index of the
+		search table. Returns the list of the entries that match all the criteria, and the list of the
+		partial matches sorted by decreasing relevance (see :attr:`bDatabase._generic.query.RANK`).
+		
+		The "*" at the end of the words are used as prefix wildcards.
+		"""
+		
+		#-- Get a list of complete matches
+		
+		match = list()
+		if q.author_names is not None:
+			match.extend([self._match('author', a) for a in q.author_names])
+		if q.journal is not None:
+			match.append(self._match('journal', q.journal))
+		match = [x for x in match if x is not None]
+		
+		sql = "SELECT `id_entry` FROM `%s` WHERE 1"
+		args = [self.search_table]
+		if len(match)!=0:
+			sql += " AND `%s` MATCH '%s'"
+			args.extend([self.search_table, " AND ".join(match)])
+		if q.year is not None:
+			sql += " AND `year`=%s"
+			args.append(q.year)
+		sql += " LIMIT %s"
+		args.append(limit)
+		
+		ids_main, = self._query(sql, *args)
+		limit = limit-len(ids_main)
+		
+		if limit<=0:
+			return self.getEntries(ids_main), []
+		
+		#-- Get a list of partial matches
+		
+		sql = list()
+		args = list()
+		
+		if q.author_names is not None:
+			for i, a in enumerate(q.author_names):
+				m = self._match('author', a)
+				if m is None:
+					continue
+				if i==0:
+					rank = q.RANK['firstauthor']
+				else:
+					rank = q.RANK['author']
+				sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `%s` MATCH '%s'")
+				args.extend([rank, self.search_table, self.search_table, m])
+		
+		if q.n_authors is not None:
+			if q.n_authors<0:
+				sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `n_author`>=%s")
+				args.extend([q.RANK['number_of_authors'], self.search_table, -q.n_authors])
+			else:
+				sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `n_author`=%s")
+				args.extend([q.RANK['number_of_authors'], self.search_table, q.n_authors])
+		
+		if q.year is not None:
+			sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `year`=%s")
+			args.extend([q.RANK['year'], self.search_table, q.year])
+		
+		m = None
+		if q.journal is not None:
+			m = self._match('journal', q.journal)
+		if m is not None:
+			sql.append("SELECT `id_entry`, %s AS `rank` FROM `%s` WHERE `%s` MATCH '%s'")
+			args.extend([q.RANK['journal'], self.search_table, self.search_table, m])
+		
+		if len(sql)==0:
+			return self.getEntries(ids_main), []
+		
+		sql = "\n\nUNION ALL\n\n".join(sql)
+		sql = "SELECT `id_entry`, SUM(`rank`) AS `rank` FROM (\n%s\n) WHERE `id_entry` NOT IN (%s) GROUP BY `id_entry` ORDER BY `rank` DESC LIMIT %%s" % (
+		      sql, ", ".join(["%s"]*len(ids_main)))
+		args.extend(ids_main)
+		args.append(limit)
+		
+		ids_cmpl, ranks = self._query(sql, *args)
+		
+		return self.getEntries(ids_main), self.getEntries(ids_cmpl)
+	
+	def createTables(self, wipe=False):
+		"""Create the tables. Wipe them if already exists and `wipe`=``True``. Returns ``True, None, None`` in case
+		of success, or ``False``, the faulty query and exception otherwise."""
+		
+		tables = [
+		  (self.entry_table, ["""
+		    CREATE TABLE IF NOT EXISTS `%s` (
+		      `id_entry` INTEGER PRIMARY KEY AUTOINCREMENT,
+		      `cite_ref` TEXT NOT NULL COLLATE NOCASE UNIQUE,
+		      `type` TEXT NOT NULL,
+		      `title` TEXT NOT NULL,
+		      `author` TEXT NOT NULL,
+		      `year` INTEGER NOT NULL,
+		      `creation_date` TEXT NOT NULL
+		    )"""]),
+		  (self.field_table, ["""
+		    CREATE TABLE IF NOT EXISTS `%s` (
+		      `id_field` INTEGER PRIMARY KEY AUTOINCREMENT,
+		      `id_entry` INTEGER NOT NULL,
+		      `field_name` TEXT NOT NULL,
+		      `field_value` TEXT NOT NULL
+		    )""",
+		    "CREATE INDEX IF NOT EXISTS `%(table)s_id_entry` ON `%(table)s` (`id_entry`)"]),
+		  (self.journal_table, ["""
+		    CREATE TABLE IF NOT EXISTS `%s` (
+		      `id_journal` INTEGER PRIMARY KEY AUTOINCREMENT,
+		      `iso` TEXT NOT NULL COLLATE NOCASE,
+		      `long` TEXT NOT NULL COLLATE NOCASE,
+		      `pubmed` TEXT NOT NULL COLLATE NOCASE,
+		      `short` TEXT NOT NULL COLLATE NOCASE
+		    )""",
+		    "CREATE INDEX IF NOT EXISTS `%(table)s_iso` ON `%(table)s` (`iso`)",
+		    "CREATE INDEX IF NOT EXISTS `%(table)s_long` ON `%(table)s` (`long`)",
+		    "CREATE INDEX IF NOT EXISTS `%(table)s_pubmed` ON `%(table)s` (`pubmed`)",
+		    "CREATE INDEX IF NOT EXISTS `%(table)s_short` ON `%(table)s` (`short`)"]),
+		  (self.search_table, ["""
+		    CREATE VIRTUAL TABLE IF NOT EXISTS `%s` USING fts5(
+		      `id_entry` UNINDEXED,
+		      `author`,
+		      `n_author` UNINDEXED,
+		      `year` UNINDEXED,
+		      `journal`,
+		      tokenize = 'unicode61 remove_diacritics 2'
+		    )"""]),
+		  (self.backup_table, ["""
+		    CREATE TABLE IF NOT EXISTS `%s` (
+		      `id_backup` INTEGER PRIMARY KEY AUTOINCREMENT,
+		      `entry_data` TEXT NOT NULL,
+		      `serialization` TEXT NOT NULL,
+		      `backup_date` TEXT NOT NULL,
+		      `reason` VARCHAR(16) NOT NULL
+		    )"""])]
+		
+		for table, queries in tables:
+			if wipe:
+				if self._query("DROP TABLE IF EXISTS `%s`", table)==False:
+					return False, self.last_query, self.last_query_exception
+			
+			if self._query(queries[0], table)==False:
+				return False, self.last_query, self.last_query_exception
+			
+			for sql in queries[1:]:
+				if self._query(sql % {'table': table.replace('`', '``')})==False:
+					return False, self.last_query, self.last_query_exception
+		
+		return True, None, None
+
+#--------------------------------
+
+def test_sqlite():
+	
+	db = database({'filename': ':memory:', 'entry_table': 'entries', 'field_table': 'fields', 'search_table': 'search',
+	               'backup_table': 'backup', 'journal_table': 'journals'})
+	print db.open()
+	print db.createTables()
+	
+	db.addJournal('J. Acoust. Soc. Am.', 'The Journal of the Acoustical Society of America', 'J Acoust Soc Am', 'JASA')
+	print db.getJournal('j acoust soc am'), db.getJournal('Journal of the Acoustical Society', False)
+	
+	entries = list()
+	for i, (a, y, t) in enumerate([('Roy | D | Patterson | ', 2006, 'The perception of pitch'),
+	                               ('Roy | D | Patterson | # Toshio | | Irino | ', 2006, 'Vocal tract length'),
+	                               ('Etienne | | Gaudrain | ', 2009, 'Streaming of vowel sequences'),
+	                               ('Roy | D | Patterson | ', 2006, 'The perception of pitch')]):
+		entries.append(bBase.entry({'type': 'article', 'title': t, 'author': a, 'year': y,
+		                            'fields': {'journal': 'JASA', 'volume': str(i)}}))
+	
+	ids, duplicates = db.insertEntries(entries)
+	print ids, [(str(e.title), len(d)) for e, d in duplicates]
+	
+	e = db.getEntry('patterson:2006a')
+	print e.id_entry, e.cite_ref, e.title, e.fields
+	print [x and x.cite_ref for x in db.getEntries([3, 'patterson:2006', 'nobody:1900', e, '2'])]
+	print db.entryCacheStats()
+	
+	q = bDatabase._generic.query('Patterson, 2006 JASA')
+	main, partial = db.naturalSearch(q)
+	print [x.cite_ref for x in main], [x.cite_ref for x in partial]
+	
+	# Unicode author names, as typed in the user interface
+	q = bDatabase._generic.query('Patterson 2006')
+	q['author_names'] = [u'M\xfcller', u'Patterson']
+	main, partial = db.naturalSearch(q)
+	print [x.cite_ref for x in main], [x.cite_ref for x in partial]
+	
+	print db.deleteEntry('gaudrain:2009'), db.getEntry('gaudrain:2009')
+	
+	db.close()
+
+def test_citeRefAllocator():
+	import time
+	
+	class countingDatabase(database):
+		queries = 0
+		def _query(self, sql, *args):
+			self.queries += 1
+			return database._query(self, sql, *args)
+	
+	db = countingDatabase({'filename': ':memory:', 'entry_table': 'entries', 'field_table': 'fields', 'search_table': 'search',
+	                       'backup_table': 'backup', 'journal_table': 'journals'})
+	db.open()
+	db.createTables()
+	
+	print [bBase.citeRefSuffix(n) for n in [0, 1, 26, 27, 52, 703]], [bBase.citeRefIndex(x) for x in ['', 'z', 'aa', 'zz', 'aaa', 'a1']]
+	
+	entries = [bBase.entry({'type': 'article', 'title': 'Title %d' % i, 'author': 'Roy | D | Patterson | ', 'year': 2006}) for i in range(1000)]
+	
+	db.queries = 0
+	t = time.time()
+	ids = [db.insertEntry(e, True)[0] for e in entries[:30]]
+	t = time.time()-t
+	refs = [db.getEntry(id).cite_ref for id in ids]
+	print "30 inserts in %.1f ms, %d queries:" % (t*1e3, db.queries), refs[0], refs[1], refs[26], refs[27], refs[29]
+	
+	# Another client takes the next cite_ref
+	db.db.execute("INSERT INTO `entries` (`cite_ref`, `title`, `author`, `year`, `type`, `creation_date`) VALUES ('patterson:2006ad', 't', 'a', 2006, 'article', datetime('now'))")
+	id, d = db.insertEntry(entries[30], True)
+	print db.getEntry(id).cite_ref
+	
+	# A deleted cite_ref is handed out again
+	db.deleteEntry('patterson:2006b')
+	id, d = db.insertEntry(entries[31], True)
+	print db.getEntry(id).cite_ref
+	
+	db.queries = 0
+	t = time.time()
+	ids, duplicates = db.insertEntries(entries[32:], True)
+	t = time.time()-t
+	print "%d bulk inserts in %.1f ms, %d queries, last: %s" % (len(ids), t*1e3, db.queries, db.getEntry(ids[-1]).cite_ref)
+	
+	db.close()
+
+def test_searchIndex_ranking():
+	import random
+	import timeit
+	
+	random.seed(2)
+	
+	db = database({'filename': ':memory:', 'entry_table': 'entries', 'field_table': 'fields', 'search_table': 'search',
+	               'backup_table': 'backup', 'journal_table': 'journals'})
+	db.open()
+	db.createTables()
+	
+	surnames = ["%s%s" % (random.choice(['pat', 'gau', 'iri', 'smi']), "".join(random.sample('abcdefghijklmnop', 4))) for i in range(60)]
+	entries = list()
+	for i in range(3000):
+		authors = " # ".join(["%s | | %s | " % (random.choice('ABCDEF'), random.choice(surnames).capitalize()) for j in range(random.randint(1, 6))])
+		entries.append(bBase.entry({'type': 'article', 'title': 'Title %d' % i, 'author': authors, 'year': random.randint(2000, 2010),
+		                            'fields': {'journal': random.choice(['Nature', 'Hearing Research', 'Ear and Hearing'])}}))
+	db.insertEntries(entries)
+	index = db.getSearchIndex()
+	
+	# 20 authors, a year and a journal: 23 criteria with the number of authors
+	q = bDatabase._generic.query(", ".join(surnames[:20]) + ", 2006 Hearing")
+	
+	t = timeit.default_timer()
+	ids_main, ids_cmpl = index.search(q, 100)
+	t = timeit.default_timer()-t
+	
+	main, partial = db.naturalSearch(q, 100)
+	
+	# The ranks of the SQL path and of the index must be the same (the order of the entries of same rank can differ)
+	def rank(id):
+		author, n_author, year, journal = index.entries[id]
+		r = sum([q.RANK['firstauthor' if i==0 else 'author'] for i, a in enumerate(q.author_names) if a.lower() in author])
+		r += q.RANK['number_of_authors']*(n_author==q.n_authors) + q.RANK['year']*(year==q.year) + q.RANK['journal']*('hearing' in journal)
+		return r
+	
+	assert sorted(ids_main)==sorted([e.id_entry for e in main])
+	assert [rank(id) for id in ids_cmpl]==[rank(e.id_entry) for e in partial]
+	assert t<1
+	
+	print "%d criteria: %d + %d matches in %.2f ms, same ranks as the SQL path" % (len(q.author_names)+3, len(ids_main), len(ids_cmpl), t*1000)
+	
+	db.close()
@@ -27,11 +27,13 @@
 #-------------------------------------------------------------------------
 
 import pickle
+import cPickle
 import base64
+import json
 
 """This module is used to communicate with text processors such as MS Word or OpenOffice.org.
 
-Imports :mod:`pickle`, :mod:`base64`."""
+Imports :mod:`pickle`, :mod:`cPickle`, :mod:`base64`, :mod:`json`."""
 
 #====================================================================
 
@@ -41,6 +43,14 @@ FIELD_PROTECTION_TABLE = list()
 for c in FIELD_PROTECTED_CHARS:
 	FIELD_PROTECTION_TABLE.append((c, '_x%03dx_' % ord(c)))
 
+# Short names of the usual property keys in the version 2 of the field encoding, also used for the keys
+# of the nested 'search' dict ('search_type' and 'search_string').
+# Warning: Any change will endanger backward compatibility. New keys can only be appended.
+FIELD_KEYS = [('fieldtype', 'f'), ('fieldxref', 'x'), ('cite_ref', 'r'), ('type', 't'), ('search', 's'),
+              ('search_type', 'st'), ('search_string', 'ss'), ('etal', 'e'), ('index', 'i')]
+FIELD_KEYS_SHORT = dict(FIELD_KEYS)
+FIELD_KEYS_LONG  = dict([(v, k) for k, v in FIELD_KEYS])
+
 #====================================================================
 class bridge:
 	"""Generic class for communication with text processor. This class defines the method that needs to be implemented in the specific text processor classes.
@@ -67,6 +77,30 @@ class bridge:
 	   
 	   The prefix used for Bibendum field names.
 	
+	.. attribute:: fieldEncoding
+	   
+	   The version of the encoding used by :meth:`encodeField`: 1 (pickle, base64 and :meth:`_protectFieldName`) or 2 (the default,
+	   see :meth:`encodeField`). :meth:`decodeField` reads both.
+	
+	.. attribute:: fieldStore
+	   
+	   If ``True``, the properties of the fields are kept in a single document property store instead of
+	   being serialized in the field names (see :meth:`getFieldProperties`). ``False`` by default.
+	
+	.. attribute:: field_properties
+	   
+	   The document property store, or ``None`` if not loaded yet.
+	
+	.. attribute:: chunkOverlap
+	   
+	   The number of characters shared by two consecutive chunks of :meth:`iterTextChunks`.
+	
+	.. attribute:: snapshot
+	   
+	   ``None``, or the text of the document kept by the implementations that cache it, in a tuple
+	   ``(state, text, paragraphs)`` where `state` is the :meth:`_documentState` at the time the text
+	   was extracted. See :meth:`_validSnapshot`.
+	
 	.. automethod:: _protectFieldName
 	.. automethod:: _unprotectFieldName
 	
@@ -79,6 +113,14 @@ class bridge:
 	previous_view_cursor = None
 	
 	bibendumFieldPrefix  = 'Bibendum_'
+	fieldEncoding = 2
+	
+	fieldStore = False
+	field_properties = None
+	field_properties_modified = False
+	
+	chunkOverlap = 0
+	snapshot = None
 	
 	def connect(self, options=None):
 		"""**Abstract method**. Implementation must establish connection with the text processor
@@ -87,6 +129,45 @@ class bridge:
 		
 		raise NotImplementedError()
 	
+	def getText(self):
+		"""**Abstract method**. Implementation must return the text of the document, in a form where the indices
+		are compatible with cursor operations (the text searched by :meth:`findRegexp`). This allows several
+		searches to be made on a single extraction of the text."""
+		
+		raise NotImplementedError()
+	
+	def getParagraphs(self):
+		"""Returns the list of ``(offset, text)`` of the paragraphs of the document, where `offset` is the index of the
+		paragraph in the text returned by :meth:`getText`. Implementations that can extract the paragraphs separately should
+		override this method. By default, the whole text is returned as one paragraph."""
+		
+		return [(0, self.getText())]
+	
+	def _documentState(self):
+		"""Returns a value that is cheap to obtain and changes when the document is modified (e.g. a modification
+		counter with the numbers of characters and paragraphs), or ``None`` if the implementation cannot tell.
+		Used by :meth:`_validSnapshot`."""
+		
+		return None
+	
+	def _validSnapshot(self):
+		"""Returns ``True`` if :attr:`snapshot` reflects the current state of the document, i.e. it was not dropped
+		and the :meth:`_documentState` did not change since it was taken. The methods that modify the text must set
+		:attr:`snapshot` to ``None``, since the state may miss the changes made by the bridge itself."""
+		
+		if self.snapshot is None:
+			return False
+		
+		state = self._documentState()
+		return state is not None and state==self.snapshot[0]
+	
+	def iterTextChunks(self):
+		"""Generator of ``(offset, text)`` chunks covering the text returned by :meth:`getText`, where `offset` is the index
+		of the chunk in the text. Each chunk starts :attr:`chunkOverlap` characters before the end of the previous one. Implementations
+		that can read the document by parts should override this method. By default, the whole text is one chunk."""
+		
+		yield (0, self.getText())
+	
 	def findRegexp(self, regexp):
 		"""**Abstract method**. Implementation must return a list of matches using the provided regular expression. The list format is::
 		
@@ -142,27 +223,185 @@ class bridge:
 		
 		*i* provides the index of the field. This is used to ensure field names are unique.
 		
+		With the version 2 of the encoding (see :attr:`fieldEncoding`), the name is ``prefix + 'V2_' + index + '_' + data``,
+		where data is given by :meth:`_serializeProperties`.
+		
+		If :attr:`fieldStore` is ``True``, the name is ``prefix + 'S_' + index``, and the properties are kept in the
+		document property store (see :meth:`getFieldProperties`).
+		
 		Returns a string."""
 		
-		s = pickle.dumps(d, 2)
-		s = base64.b64encode(s)
+		if self.fieldStore:
+			self.getFieldProperties()[i] = d
+			self.field_properties_modified = True
+			return self.bibendumFieldPrefix + ("S_%d" % i)
 		
-		s = self.bibendumFieldPrefix + ("%d_" % i) + self._protectFieldName(s)
+		if self.fieldEncoding==1:
+			s = pickle.dumps(d, 2)
+			s = base64.b64encode(s)
+			
+			return self.bibendumFieldPrefix + ("%d_" % i) + self._protectFieldName(s)
 		
-		return s
+		return self.bibendumFieldPrefix + ("V2_%d_" % i) + self._serializeProperties(_shortKeys(d))
 	
 	def decodeField(self, s):
-		"""Decodes a field name *s*. Returns the field index and the dictionary of properties."""
+		"""Decodes a field name *s* encoded with any version of :meth:`encodeField`. Returns the field index
+		and the dictionary of properties."""
 		
 		if not s.startswith(self.bibendumFieldPrefix):
 			return None
 		
+		s = s[len(self.bibendumFieldPrefix):]
+		
+		if s.startswith('S_'):
+			i = int(s[2:])
+			return i, self.getFieldProperties().get(i, dict())
+		
+		if s.startswith('V2_'):
+			_, i, s = s.split('_', 2)
+			return int(i), _longKeys(self._unserializeProperties(s))
+		
 		s = s.split('_')
-		i = int(s[1])
-		s = self._unprotectFieldName("_".join(s[2:]))
+		i = int(s[0])
+		s = self._unprotectFieldName("_".join(s[1:]))
 		d = pickle.loads( base64.b64decode(s) )
 		
 		return i, d
+	
+	def tryDecodeField(self, s):
+		"""Same as :meth:`decodeField`, but does not raise when *s* cannot be decoded (e.g. a truncated name, or
+		damaged base64, pickle or JSON data), so that one damaged field can be skipped. Returns ``(True,(index,properties))``
+		in case of success and ``(False,error)`` where ``error`` is an :class:`Exception` in case of failure."""
+		
+		try:
+			return True, self.decodeField(s)
+		except Exception, e:
+			return False, e
+	
+	def _serializeProperties(self, d):
+		"""Serializes *d* with :mod:`json` when it only contains ASCII ``str``, numbers, lists and dicts, or with
+		:mod:`cPickle` otherwise. The result is encoded in base64 without padding, where '+' and '/' are replaced by
+		'_A' and '_B', so that only letters, digits and '_' are used and :meth:`_protectFieldName` is not needed."""
+		
+		if _jsonCompatible(d):
+			s = 'J' + json.dumps(d, separators=(',', ':'))
+		else:
+			s = 'P' + cPickle.dumps(d, 2)
+		
+		return base64.b64encode(s).rstrip('=').replace('+', '_A').replace('/', '_B')
+	
+	def _unserializeProperties(self, s):
+		"""Does the reverse operation than :meth:`_serializeProperties`."""
+		
+		s = s.replace('_A', '+').replace('_B', '/')
+		s = base64.b64decode(s + '='*(-len(s)%4))
+		if s[0]=='J':
+			return _fromJson(json.loads(s[1:]))
+		else:
+			return cPickle.loads(s[1:])
+	
+	def getFieldProperties(self):
+		"""Returns the document property store: a ``dict`` of the field indices to the properties of the fields, used
+		when :attr:`fieldStore` is ``True``. The store is read from the document at once on the first call (see
+		:meth:`_loadFieldProperties`). After modification, it must be written back with :meth:`saveFieldProperties`."""
+		
+		if self.field_properties is None:
+			s = self._loadFieldProperties()
+			self.field_properties = dict()
+			if s is not None and len(s)!=0:
+				for i, d in self._unserializeProperties(s).iteritems():
+					self.field_properties[int(i)] = _longKeys(d)
+			self.field_properties_modified = False
+		
+		return self.field_properties
+	
+	def removeFieldProperties(self, i):
+		"""Removes the properties of the field of index *i* from the document property store, if present."""
+		
+		if self.field_properties is not None and self.field_properties.has_key(i):
+			del self.field_properties[i]
+			self.field_properties_modified = True
+	
+	def saveFieldProperties(self):
+		"""Writes the document property store in the document if it was modified (see :meth:`_saveFieldProperties`)."""
+		
+		if self.field_properties is None or not self.field_properties_modified:
+			return
+		
+		d = dict([(str(i), _shortKeys(p)) for i, p in self.field_properties.iteritems()])
+		self._saveFieldProperties(self._serializeProperties(d))
+		self.field_properties_modified = False
+	
+	def _loadFieldProperties(self):
+		"""**Abstract method**. Implementation must return the string saved by :meth:`_saveFieldProperties` in the
+		document, or ``None``."""
+		
+		raise NotImplementedError()
+	
+	def _saveFieldProperties(self, s):
+		"""**Abstract method**. Implementation must save the string *s* in the document, for instance in a
+		user defined document property."""
+		
+		raise NotImplementedError()
+
+def _shortKeys(d):
+	"""Replaces the keys of *d* by their short version (see :data:`FIELD_KEYS`), including the keys of the
+	nested 'search' ``dict``. Other keys are prefixed with '~'."""
+	
+	r = dict()
+	for k, v in d.iteritems():
+		if k=='search' and isinstance(v, dict):
+			v = dict([(FIELD_KEYS_SHORT.get(x, '~'+x), y) for x, y in v.iteritems()])
+		r[FIELD_KEYS_SHORT.get(k, '~'+k)] = v
+	return r
+
+def _longKeys(d):
+	"""Does the reverse operation than :func:`_shortKeys`. The keys of the nested 'search' ``dict`` that are
+	neither short nor prefixed were written before they were shortened, and are kept as is."""
+	
+	r = dict()
+	for k, v in d.iteritems():
+		k = FIELD_KEYS_LONG.get(k) or k[1:]
+		if k=='search' and isinstance(v, dict):
+			v = dict([(FIELD_KEYS_LONG.get(x) or (x[1:] if x.startswith('~') else x), y) for x, y in v.iteritems()])
+		r[k] = v
+	return r
+
+def _jsonCompatible(x):
+	"""Returns ``True`` if *x* is restored exactly by :func:`_fromJson` after a :mod:`json` round trip."""
+	
+	if x is None or isinstance(x, (bool, int, long)):
+		return True
+	if isinstance(x, float):
+		return x==x and x not in (float('inf'), float('-inf'))
+	if isinstance(x, str):
+		try:
+			x.decode('ascii')
+		except UnicodeDecodeError:
+			return False
+		return True
+	if isinstance(x, list):
+		for v in x:
+			if not _jsonCompatible(v):
+				return False
+		return True
+	if isinstance(x, dict):
+		for k, v in x.iteritems():
+			if not isinstance(k, str) or not _jsonCompatible(k) or not _jsonCompatible(v):
+				return False
+		return True
+	return False
+
+def _fromJson(x):
+	"""Converts the ``unicode`` strings returned by :func:`json.loads` back to ``str``."""
+	
+	if isinstance(x, unicode):
+		return x.encode('ascii')
+	if isinstance(x, list):
+		return [_fromJson(v) for v in x]
+	if isinstance(x, dict):
+		return dict([(_fromJson(k), _fromJson(v)) for k, v in x.iteritems()])
+	return x
 
 #======================================================================================
 
@@ -193,3 +432,92 @@ def test_field_encode():
 	print "-"*30
 	print i
 	print d
+
+def test_field_encoding():
+	import timeit
+	
+	b = bridge()
+	fields = [{'fieldtype': 'cite', 'cite_ref': ['smith:2009', 'vangeek:2001'], 'type': 'p*'},
+	          {'fieldtype': 'cite', 'cite_ref': ['smith:2009'], 'type': 'p', 'search': {'search_type': 'string', 'search_string': 'Smith, 2009', 'page': 3}},
+	          {'fieldtype': 'xref', 'fieldxref': 'Bibendum_V2_12_SnsiZiI6ImNpdGUiLCJyIjpbInNtaXRoOjIwMDkiXSwidCI6ImEifQ'},
+	          {'prop1': 'String', 'prop2': 'Fancy String \xc3\x87\xc3\x81+', 'prop3': 42.13258879, 'prop4': {'type': 'dict', 'value': 1}}]
+	
+	for d in fields:
+		for version in [1, 2]:
+			b.fieldEncoding = version
+			s = b.encodeField(12, d)
+			assert b.decodeField(s)==(12, d)
+			t_encode = min(timeit.repeat(lambda: b.encodeField(12, d), number=1000, repeat=3))
+			t_decode = min(timeit.repeat(lambda: b.decodeField(s), number=1000, repeat=3))
+			print "V%d: %3d chars, encode %6.2f us, decode %6.2f us" % (version, len(s), t_encode*1000, t_decode*1000)
+		print "-"*30
+	
+	# Damaged names: truncated base64, bad JSON, bad pickle
+	s = b.encodeField(12, fields[0])
+	damaged = [s[:-5], s[:-2]+'x', b.bibendumFieldPrefix+'V2_12_'+b._serializeProperties({})[:-1]+'Q', b.bibendumFieldPrefix+'12_AAAA']
+	print [b.tryDecodeField(x)[0] for x in damaged], b.tryDecodeField(s)==(True, (12, fields[0]))
+	
+	# Nested search keys written before they were shortened
+	s = b.bibendumFieldPrefix + 'V2_3_' + b._serializeProperties({'f': 'cite', 's': {'search_type': 'string', 'search_string': 'Smith'}})
+	print b.decodeField(s)
+
+def test_snapshot():
+	
+	class listBridge(bridge):
+		# A document held in a list of paragraphs, with a modification counter that misses some changes
+		def __init__(self, paragraphs):
+			self.paragraphs = paragraphs
+			self.modifications = 0
+			self.extractions = 0
+		def _documentState(self):
+			return (self.modifications, sum([len(p) for p in self.paragraphs]), len(self.paragraphs))
+		def _takeSnapshot(self):
+			state = self._documentState()
+			self.extractions += 1
+			self.snapshot = (state, "".join(self.paragraphs), None)
+		def getText(self):
+			if not self._validSnapshot():
+				self._takeSnapshot()
+			return self.snapshot[1]
+		def insertField(self, range, properties, text):
+			# Same length, not seen by the counter
+			self.snapshot = None
+			t = "".join(self.paragraphs)
+			self.paragraphs = [t[:range[0]] + "F"*(range[1]-range[0]) + t[range[1]:]]
+	
+	b = listBridge(["Smith (2001) and ", "Jones (2002).\n"])
+	b.getText()
+	b.getText()
+	print b.extractions
+	
+	# Change missed by the counter, seen by the content check
+	b.paragraphs.append("Doe (2003).\n")
+	print b.getText()==''.join(b.paragraphs), b.extractions
+	
+	# Change made by the bridge itself
+	b.insertField((0, 12), {}, [])
+	print b.getText()==''.join(b.paragraphs), b.extractions
+	
+	b.modifications += 1
+	b.getText()
+	print b.extractions
+
+def test_field_store():
+	
+	class storeBridge(bridge):
+		document_property = None
+		def _loadFieldProperties(self):
+			return self.document_property
+		def _saveFieldProperties(self, s):
+			self.document_property = s
+	
+	b = storeBridge()
+	b.fieldStore = True
+	names = [b.encodeField(i, {'fieldtype': 'cite', 'cite_ref': ['ref:%d' % i], 'type': 'p'}) for i in range(3)]
+	b.saveFieldProperties()
+	print names, len(b.document_property)
+	
+	b2 = storeBridge()
+	b2.fieldStore = True
+	b2.document_property = b.document_property
+	print [b2.decodeField(n) for n in names]
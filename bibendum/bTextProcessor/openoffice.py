@@ -27,26 +27,80 @@
 #-------------------------------------------------------------------------
 
 import uno
+import unohelper
 import re
+import time
 
 import bBase
 import bTextProcessor._generic
 
 from com.sun.star.text.ControlCharacter import PARAGRAPH_BREAK
+from com.sun.star.util import XModifyListener
+from com.sun.star.beans.PropertyAttribute import REMOVEABLE
 
 
 """This module is used to communicate with OpenOffice.org Writer using `PyUNO <http://udk.openoffice.org/python/python-bridge.html>`_."""
 
+class modifyListener(unohelper.Base, XModifyListener):
+	"""Counts the modifications of the document in :attr:`bridge.modifications`."""
+	
+	def __init__(self, bridge):
+		self.bridge = bridge
+	
+	def modified(self, event):
+		self.bridge.modifications += 1
+	
+	def disposing(self, event):
+		self.bridge.modifications += 1
+		self.bridge.listener = None
+
 class bridge(bTextProcessor._generic.bridge):
 	"""This implementation of :class:`bTextProcessor._generic` is used to communicate with
 	OpenOffice.org Writer using `PyUNO <http://udk.openoffice.org/python/python-bridge.html>`_.
 	
+	.. attribute:: modifications
+	   
+	   The number of modifications of the document, counted by a :class:`modifyListener`.
+	
+	.. attribute:: snapshot
+	   
+	   ``None``, or the text of the document as returned by :meth:`getText`, in a tuple
+	   ``(state, text, paragraphs)`` (see :meth:`_documentState` and :meth:`getParagraphs`).
+	   The methods that insert or delete fields drop it.
+	
+	.. attribute:: registry
+	   
+	   ``None``, or the Bibendum fields of the document as returned by :meth:`getAllFields`, in a ``dict``
+	   ``{'fields': fields, 'index': next_index, 'names': set_of_field_master_names, 'hits': number_of_calls, 'errors': errors}``,
+	   where `errors` is a ``dict`` of the names of the fields that could not be decoded to the :class:`Exception` raised.
+	
+	.. attribute:: registryMaxHits
+	   
+	   The number of calls of :meth:`getAllFields` answered from the :attr:`registry` before it is built again,
+	   which also disposes the unused field masters.
+	
+	.. attribute:: fieldMasterPrefix
+	   
+	   The prefix of the names of the user field masters in ``TextFieldMasters``.
+	
+	.. attribute:: fieldStoreName
+	   
+	   The name of the user defined document property used as property store (see :meth:`_saveFieldProperties`).
+	
 	.. automethod:: _getRealText
 	
 	.. automethod:: _setStyle
 	
 	"""
 	
+	modifications = 0
+	listener = None
+	registry = None
+	registryMaxHits = 100
+	
+	fieldStoreName = 'BibendumFields'
+	fieldMasterPrefix = 'com.sun.star.text.fieldmaster.User.'
+	
 	def __init__(self, options=None):
 		localContext = uno.getComponentContext()
 		self.resolver = localContext.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", localContext )
@@ -60,11 +114,14 @@ class bridge(bTextProcessor._generic.bridge):
 		  * *'type'*: is either "pipe" or "socket"
 		  * if *'type'* is "pipe", an item *'name'* containing the pipe name should be provided
 		  * if *'type'* is socket, *'host'* and *'port'* should be provided
+		  * *'field_store'*: optional, if ``True`` the properties of the fields are kept in the user defined
+		    document property :attr:`fieldStoreName` (see :attr:`bTextProcessor._generic.bridge.fieldStore`)
 		
 		Once the connected, the method searches for an active window of the correct type and store in ``self.doc``.
 		"""
 		
 		self.options = options
+		self.fieldStore = options.get('field_store', False)
 		
 		self.unourl = "uno:%s" % options['type']
 		if options['type']=='pipe':
@@ -86,9 +143,19 @@ class bridge(bTextProcessor._generic.bridge):
 			self.connected = False
 			return False, e
 		
+		self.snapshot = None
+		self.registry = None
+		self.field_properties = None
+		try:
+			self.listener = modifyListener(self)
+			self.doc.addModifyListener(self.listener)
+		except Exception:
+			# Without listener, the text is extracted at each call of getText()
+			self.listener = None
+		
 		self.connected = True
 		return True, None
-
+	
 	# TODO: Mechanism to check the connection is valid to be able to re-use the connection
 	
 	def _getRealText(self, obj=None):
@@ -102,28 +169,82 @@ class bridge(bTextProcessor._generic.bridge):
 		if obj is None:
 			obj = self.doc.Text
 		
-		real_txt = ''
+		parts = list()
+		self._collectRealText(obj, parts)
 		
-		if obj.ImplementationName in ['SwXTextPortion']:
-			if obj.TextPortionType=='Text':
-				s = obj.String
-			elif obj.TextPortionType=='TextField':
-				s = ' '
-			else:
-				s = ''
-			real_txt += s
-		elif obj.ImplementationName in ['SwXCell', 'SwXParagraph', 'SwXBodyText']:
+		return u''.join(parts)
+	
+	def _collectRealText(self, obj, parts):
+		"""Appends the pieces of the text of *obj* to the list *parts* (see :meth:`_getRealText`)."""
+		
+		name = obj.ImplementationName
+		
+		if name=='SwXTextPortion':
+			portion_type = obj.TextPortionType
+			if portion_type=='Text':
+				parts.append(obj.String)
+			elif portion_type=='TextField':
+				parts.append(u' ')
+		elif name in ['SwXCell', 'SwXParagraph', 'SwXBodyText']:
 			e = obj.createEnumeration()
 			while e.hasMoreElements():
-				real_txt += self._getRealText(e.nextElement())
-			if obj.ImplementationName == 'SwXParagraph':
-				real_txt += '\n'
-		elif obj.ImplementationName in ['SwXTextTable']:
+				self._collectRealText(e.nextElement(), parts)
+			if name=='SwXParagraph':
+				parts.append(u'\n')
+		elif name=='SwXTextTable':
 			for i in range(obj.Rows.Count):
 				for j in range(obj.Columns.Count):
-					real_txt += self._getRealText(obj.getCellByPosition(i,j))
+					self._collectRealText(obj.getCellByPosition(i,j), parts)
+	
+	def _takeSnapshot(self):
+		"""Extracts the text of the document paragraph by paragraph (tables count as one paragraph),
+		and stores it in :attr:`snapshot`."""
+		
+		state = self._documentState()
+		
+		paragraphs = list()
+		offset = 0
+		e = self.doc.Text.createEnumeration()
+		while e.hasMoreElements():
+			parts = list()
+			self._collectRealText(e.nextElement(), parts)
+			t = u''.join(parts)
+			paragraphs.append((offset, t))
+			offset += len(t)
+		
+		self.snapshot = (state, u''.join([t for o, t in paragraphs]), paragraphs)
+	
+	def _documentState(self):
+		"""Returns the number of modifications counted by the :class:`modifyListener` with the numbers of characters and
+		paragraphs of the document, or ``None`` without listener. The modify events are not sent for every change once the
+		document is modified, hence the counts."""
+		
+		if self.listener is None:
+			return None
 		
-		return real_txt
+		try:
+			return (self.modifications, self.doc.CharacterCount, self.doc.ParagraphCount)
+		except Exception:
+			return None
+	
+	def getText(self):
+		"""Returns the text of the document as extracted by :meth:`_getRealText`. The text is kept in :attr:`snapshot`
+		and only extracted again when the document has been modified, so that several searches on an unchanged document
+		do not go through the UNO bridge again."""
+		
+		if not self._validSnapshot():
+			self._takeSnapshot()
+		
+		return self.snapshot[1]
+	
+	def getParagraphs(self):
+		"""Returns the list of ``(offset, text)`` of the paragraphs of the document, where `offset` is the index of the
+		paragraph in the text returned by :meth:`getText`. Tables are one paragraph. Uses the same :attr:`snapshot` as :meth:`getText`."""
+		
+		if not self._validSnapshot():
+			self._takeSnapshot()
+		
+		return self.snapshot[2]
 	
 	def findRegexp(self, regexp):
 		"""Returns a list of match using the provided regular expression.
@@ -134,7 +255,7 @@ class bridge(bTextProcessor._generic.bridge):
 		
 		Note 2: The match list is returned starting with the last one."""
 		
-		txt = self._getRealText()
+		txt = self.getText()
 		
 		if type(regexp)==type(''):
 			regexp = re.compile(regexp, re.UNICODE)
@@ -222,14 +343,28 @@ class bridge(bTextProcessor._generic.bridge):
 		The fields that have children, i.e. which have xref fields pointing to, also have a `children` key
 		with a list of children field names.
 		
-		The function also remove all the Bibendum masters with no dependent field.
+		The function also remove all the Bibendum masters with no dependent field. The fields whose name cannot be
+		decoded are skipped, and their errors kept in the 'errors' item of the :attr:`registry` (see :meth:`tryDecodeField`).
+		
+		The fields are decoded once and kept in :attr:`registry`, which is then updated when fields are inserted,
+		updated or deleted through the bridge. The registry is built again if the names of the field masters of the
+		document changed in the meantime (e.g. after an undo), and after :attr:`registryMaxHits` calls. The returned
+		``dict`` must not be modified.
 		"""
 		
-		OOoFieldPrefix = 'com.sun.star.text.fieldmaster.User.'
+		OOoFieldPrefix = self.fieldMasterPrefix
 		
 		masterNames = self.doc.TextFieldMasters.ElementNames
+		
+		r = self.registry
+		if r is not None and r['hits']<self.registryMaxHits and r['names']==set(masterNames):
+			r['hits'] += 1
+			return r['fields'], r['index']
+		
 		fields = dict()
 		indices = list()
+		errors = dict()
+		names = set(masterNames)
 		for m in masterNames:
 			if m.startswith(OOoFieldPrefix+self.bibendumFieldPrefix):
 				
@@ -237,16 +372,29 @@ class bridge(bTextProcessor._generic.bridge):
 				# Remove the field masters that are not used anymore
 				if OOoField.DependentTextFields is None or len(OOoField.DependentTextFields)==0:
 					OOoField.dispose()
+					names.discard(m)
+					if self.fieldStore:
+						success, decoded = self.tryDecodeField(m.replace(OOoFieldPrefix, '', 1))
+						if success:
+							self.removeFieldProperties(decoded[0])
+					continue
 				
 				field_name = m.replace(OOoFieldPrefix, '', 1)
-				index, properties = self.decodeField(field_name)
+				# A damaged field is skipped rather than breaking all the field operations of the document
+				success, decoded = self.tryDecodeField(field_name)
+				if not success:
+					errors[field_name] = decoded
+					continue
+				index, properties = decoded
 				indices.append(index)
 				fields[field_name] = {'name': field_name, 'fieldmaster': OOoField, 'properties': properties, 'index': index}
 		
 		for k, f in fields.iteritems():
-			if f['properties']['fieldtype']=='xref':
+			if f['properties'].get('fieldtype')=='xref':
 				xref = f['properties']['fieldxref']
-				if not fields[xref].has_key('xref'):
+				if not fields.has_key(xref):
+					continue
+				if not fields[xref].has_key('children'):
 					fields[xref]['children'] = list()
 				fields[xref]['children'].append( k )
 		
@@ -255,7 +403,42 @@ class bridge(bTextProcessor._generic.bridge):
 		else:
 			i = max(indices)+1
 		
+		self.registry = {'fields': fields, 'index': i, 'names': names, 'hits': 0, 'errors': errors}
+		self.saveFieldProperties()
+		
 		return fields, i
+	
+	def _registerField(self, field_name, master, properties, index):
+		"""Adds a field that was just inserted to the :attr:`registry`."""
+		
+		if self.registry is None:
+			return
+		
+		fields = self.registry['fields']
+		fields[field_name] = {'name': field_name, 'fieldmaster': master, 'properties': properties, 'index': index}
+		if properties.get('fieldtype')=='xref' and fields.has_key(properties['fieldxref']):
+			fields[properties['fieldxref']].setdefault('children', list()).append(field_name)
+		
+		self.registry['index'] = max(self.registry['index'], index+1)
+		self.registry['names'].add(self.fieldMasterPrefix+field_name)
+	
+	def _unregisterField(self, field_name):
+		"""Removes a field that was just disposed from the :attr:`registry`."""
+		
+		if self.registry is None or not self.registry['fields'].has_key(field_name):
+			return
+		
+		fields = self.registry['fields']
+		f = fields.pop(field_name)
+		if f['properties'].get('fieldtype')=='xref' and fields.has_key(f['properties']['fieldxref']):
+			parent = fields[f['properties']['fieldxref']]
+			if field_name in parent.get('children', []):
+				parent['children'].remove(field_name)
+		
+		self.registry['names'].discard(self.fieldMasterPrefix+field_name)
+		
+		if self.fieldStore:
+			self.removeFieldProperties(f['index'])
 		
 	
 	def insertField(self, range, properties, text):
@@ -269,6 +452,56 @@ class bridge(bTextProcessor._generic.bridge):
 		c.goRight(range[1]-range[0], True)
 		
 		self._insertFieldAtCursor(c, properties, text)
+		self.saveFieldProperties()
+	
+	def insertFields(self, fields):
+		"""Inserts several fields. *fields* is a list of ``(range, properties, text)`` as for :meth:`insertField`.
+		
+		The next field index is computed once, and the ranges are replaced from the last one to the first one with a
+		single cursor, which is moved from one range to the previous one (the text before the current range is not
+		modified by the insertion).
+		
+		Returns a ``dict`` with the number of inserted `fields` and the time in seconds spent to compute the
+		field `index`, to `move` the cursor, to `insert` the fields, and in `total`."""
+		
+		timing = {'fields': len(fields), 'index': 0., 'move': 0., 'insert': 0., 'total': 0.}
+		t_start = time.time()
+		
+		_, index = self.getAllFields()
+		
+		t = time.time()
+		timing['index'] = t-t_start
+		
+		fields = sorted(fields, key=lambda f: f[0][0], reverse=True)
+		
+		c = self.doc.Text.createTextCursor()
+		previous = None
+		for range, properties, text in fields:
+			
+			if previous is None or range[1]>previous[0][0]:
+				c.gotoStart(False)
+				c.goRight(range[0], False)
+				c.goRight(range[1]-range[0], True)
+			else:
+				c.gotoRange(previous[1], False)
+				c.goLeft(previous[0][0]-range[1], False)
+				c.goLeft(range[1]-range[0], True)
+			
+			previous = (range, c.getStart())
+			
+			t_move = time.time()
+			timing['move'] += t_move-t
+			
+			index = self._insertFieldAtCursor(c, properties, text, index)
+			
+			t = time.time()
+			timing['insert'] += t-t_move
+		
+		self.saveFieldProperties()
+		
+		timing['total'] = time.time()-t_start
+		
+		return timing
 	
 	def insertFieldHere(self, properties, text):
 		"""Inserts a field in place of the current selection."""
@@ -277,8 +510,13 @@ class bridge(bTextProcessor._generic.bridge):
 		c  = self.doc.Text.createTextCursorByRange(tr)
 		
 		self._insertFieldAtCursor(c, properties, text)
+		self.saveFieldProperties()
 	
 	def _insertFieldAtCursor(self, c, properties, text, index=None):
+		"""Inserts the field in place of the cursor *c*. If *index* is ``None``, the next field index is obtained
+		from :meth:`getAllFields`. Returns the next available field index."""
+		
+		self.snapshot = None
 		
 		if index is None:
 			_, index = self.getAllFields()
@@ -310,6 +548,7 @@ class bridge(bTextProcessor._generic.bridge):
 			
 			xUserField = self.doc.createInstance("com.sun.star.text.textfield.User")
 			xUserField.attachTextFieldMaster(xMaster)
+			self._registerField(field_name, xMaster, p, index)
 			
 			if i==0:
 				self.doc.Text.insertTextContent(c, xUserField, True)
@@ -322,6 +561,8 @@ class bridge(bTextProcessor._generic.bridge):
 			
 			index += 1
 		
+		return index
+	
 	def _setStyle(self, cursor, style_dict):
 		"""Applies the style defined in `style_dict` (Bibendum format) to the `object`.
 		The `object` is for example an OOo cursor."""
@@ -357,6 +598,8 @@ class bridge(bTextProcessor._generic.bridge):
 		"""Deletes the field, i.e. the master field and all the occurrences in the text.
 		The `field` argument is a ``dict`` as returned by :meth:`getAllFields()`."""
 		
+		self.snapshot = None
+		
 		try:
 			for f in field['fieldmaster'].DependentTextFields:
 				f.dispose()
@@ -364,6 +607,9 @@ class bridge(bTextProcessor._generic.bridge):
 		except Exception, e:
 			return False, e
 		
+		self._unregisterField(field['name'])
+		self.saveFieldProperties()
+		
 		return True, None
 	
 	def updateField(self, field, properties, text):
@@ -374,20 +620,42 @@ class bridge(bTextProcessor._generic.bridge):
 		"""
 		
 		fields, i = self.getAllFields()
+		self.snapshot = None
 		
 		if not fields.has_key(field['name']):
 			return False, LookupError('The field "%s" is not present')
 		
 		# Wipe the attached 'xref' fields if any
 		if field.has_key('children'):
-			for c in field['children']:
+			for c in list(field['children']):
 				self.deleteField(fields[c])
 		
 		for f in field['fieldmaster'].DependentTextFields:
 			c = self.doc.Text.createTextCursorByRange(f.Anchor)
-			self._insertFieldAtCursor(c, properties, text, i)
-			i += 1
+			i = self._insertFieldAtCursor(c, properties, text, i)
 		field['fieldmaster'].dispose()
+		self._unregisterField(field['name'])
+		self.saveFieldProperties()
+		
+		return True, None
+	
+	def _loadFieldProperties(self):
+		"""Returns the value of the user defined document property :attr:`fieldStoreName`, or ``None``."""
+		
+		properties = self.doc.DocumentProperties.UserDefinedProperties
+		if not properties.getPropertySetInfo().hasPropertyByName(self.fieldStoreName):
+			return None
+		
+		return properties.getPropertyValue(self.fieldStoreName)
+	
+	def _saveFieldProperties(self, s):
+		"""Saves *s* in the user defined document property :attr:`fieldStoreName`."""
+		
+		properties = self.doc.DocumentProperties.UserDefinedProperties
+		if properties.getPropertySetInfo().hasPropertyByName(self.fieldStoreName):
+			properties.setPropertyValue(self.fieldStoreName, s)
+		else:
+			properties.addProperty(self.fieldStoreName, REMOVEABLE, s)
 	
 	def createDocumentStyles(self, char_styles, para_styles):
 		"""Create the document wide styles if they don't already exist. Each argument is a ``dict`` which keys are the style names and
@@ -490,6 +758,20 @@ def test_insertField():
 	
 	OOoBridge.insertFieldHere(p, t)
 
+def test_insertFields():
+	import bCitationFinder.natbib
+	
+	OOoBridge = bridge()
+	ok, e = OOoBridge.connect({'type': 'pipe', 'name':'OOo_pipe'})
+	if not ok:
+		print e
+		return
+	
+	citations = bCitationFinder.natbib.finder(OOoBridge).findCitations()
+	fields = [(span, {'cite_ref': c.cite_ref, 'type': c.type}, [(", ".join(c.cite_ref), {'bold': True})]) for c, span in citations]
+	
+	print OOoBridge.insertFields(fields)
+
 #================================================================================
 
 
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+#-------------------------------------------------------------------------
+#    Bibendum's Text Processor plain file module
+#    
+#    bTextProcessor/plainfile.py,
+#    this file is part of the Bibendum Reference Manager project
+#    
+#    $Revision$ $Date$
+#-------------------------------------------------------------------------
+#    
+#    Copyright the Bibendum Reference Manager contributors
+#    
+#    Bibendum Reference Manager is a free software: you can redistribute it
+#    and/or modify it under the terms of the GNU General Public License as
+#    published by the Free Software Foundation, version 3 of the License.
+#    
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#    
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+#    
+#-------------------------------------------------------------------------
+
+import codecs
+import re
+
+import bTextProcessor._generic
+
+
+"""This module reads plain text files, like LaTeX sources, without text processor."""
+
+class bridge(bTextProcessor._generic.bridge):
+	"""This implementation of :class:`bTextProcessor._generic` reads the text of a plain file. The file is
+	only read: the methods modifying the document (:meth:`highlight`, :meth:`insertField`...) are not implemented.
+	
+	The text is decoded and returned as ``unicode``, and the ranges are indices of characters in the file.
+	With :meth:`iterTextChunks`, the file can be searched without loading it in memory (see
+	:meth:`bCitationFinder._generic.finder.iterCitations`).
+	
+	.. attribute:: filename
+	   
+	   The path of the file.
+	
+	.. attribute:: encoding
+	   
+	   The encoding of the file, 'utf-8' by default.
+	
+	.. attribute:: chunkSize
+	   
+	   The number of bytes read at once by :meth:`iterTextChunks`. The chunks overlap by :attr:`chunkOverlap` characters.
+	"""
+	
+	filename = None
+	encoding = 'utf-8'
+	
+	chunkSize    = 1048576
+	chunkOverlap = 4096
+	
+	def __init__(self, options=None):
+		if options is not None:
+			self.connect(options)
+	
+	def connect(self, options):
+		"""Opens the file. *options* is ``dict`` with the following entries:
+		
+		  * *'filename'*: the path of the file
+		  * *'encoding'*: optional, the encoding of the file (see :attr:`encoding`)
+		  * *'chunk_size'* and *'chunk_overlap'*: optional, see :attr:`chunkSize` and :attr:`chunkOverlap`
+		
+		Returns `(True,None)` in case of success, or `(False,e)`, where `e` is the exception, in case of failure.
+		"""
+		
+		self.options = options
+		
+		try:
+			self.filename = options['filename']
+			self.encoding = options.get('encoding', self.encoding)
+			self.chunkSize    = options.get('chunk_size', self.chunkSize)
+			self.chunkOverlap = options.get('chunk_overlap', self.chunkOverlap)
+			
+			codecs.lookup(self.encoding)
+			open(self.filename, 'rb').close()
+			
+		except Exception, e:
+			self.connected = False
+			return False, e
+		
+		self.connected = True
+		return True, None
+	
+	def getText(self):
+		"""Returns the whole text of the file."""
+		
+		f = codecs.open(self.filename, 'r', self.encoding)
+		try:
+			return f.read()
+		finally:
+			f.close()
+	
+	def iterTextChunks(self):
+		"""Reads the file :attr:`chunkSize` bytes at a time. Only the current chunk and the overlap with the
+		previous one are kept in memory."""
+		
+		decoder = codecs.getincrementaldecoder(self.encoding)()
+		
+		f = open(self.filename, 'rb')
+		try:
+			offset = 0
+			txt = u''
+			while True:
+				data = f.read(self.chunkSize)
+				txt += decoder.decode(data, not data)
+				
+				if not data:
+					yield (offset, txt)
+					break
+				
+				if len(txt)>self.chunkOverlap:
+					yield (offset, txt)
+					offset += len(txt)-self.chunkOverlap
+					txt = txt[len(txt)-self.chunkOverlap:]
+		finally:
+			f.close()
+	
+	def findRegexp(self, regexp):
+		"""Returns a list of match using the provided regular expression.
+		
+		Note 1: If *regexp* is a string, it will be compiled using the ``re.UNICODE`` option.
+		
+		Note 2: The match list is returned starting with the last one."""
+		
+		if type(regexp)==type(''):
+			regexp = re.compile(regexp, re.UNICODE)
+		
+		citations = [(f.group(), f.span(), f.groups()) for f in regexp.finditer(self.getText())]
+		citations.reverse()
+		
+		return citations
+
+
+#========================================================================
+
+def test_iterCitations():
+	import os
+	import tempfile
+	import time
+	import bCitationFinder.natbib
+	import bCitationFinder.plaintext
+	
+	paragraph = u"As shown by \\citet{jon90} and Smith et al. (2005), the effect is robust (Doe and Roe, 1998, 2000).\n" \
+	            u"See also \\citep*{smith:2005, jon90}, van Dijk (2003) and Müller, Baker & Williams 2001.\n\n"
+	
+	fd, filename = tempfile.mkstemp('.tex')
+	f = os.fdopen(fd, 'wb')
+	for i in range(100000):
+		f.write(paragraph.encode('utf-8'))
+	f.close()
+	
+	try:
+		b = bridge({'filename': filename, 'chunk_size': 65536, 'chunk_overlap': 256})
+		
+		for module in [bCitationFinder.natbib, bCitationFinder.plaintext]:
+			
+			t = time.time()
+			n = 0
+			last = None
+			for cite, span in module.finder(b).iterCitations():
+				n += 1
+				last = (cite.cite_ref or cite.search['search_string'], span)
+			t = time.time()-t
+			
+			print "%s: %d citations in %.1f MB, %.2f s, last %s" % (module.__name__, n, os.path.getsize(filename)/1048576., t, last)
+		
+		# Same results as on the whole text, with chunk boundaries everywhere
+		txt = b.getText()[:20000]
+		g = open(filename+'.small', 'wb')
+		g.write(txt.encode('utf-8'))
+		g.close()
+		
+		for chunk_size in [100, 257, 1000]:
+			s = bridge({'filename': filename+'.small', 'chunk_size': chunk_size, 'chunk_overlap': 200})
+			for module in [bCitationFinder.natbib, bCitationFinder.plaintext]:
+				f = module.finder(s)
+				a = [(c.type, c.cite_ref, span) for c, span in f.iterCitations()]
+				w = [(c.type, c.cite_ref, span) for c, span in reversed(f.scanText(txt)[0])]
+				print chunk_size, module.__name__, len(a), a==w
+		
+		os.remove(filename+'.small')
+	
+	finally:
+		os.remove(filename)